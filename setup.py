@@ -57,6 +57,12 @@ setup(
     description="",
     python_requires=">=3.8",
     install_requires=INSTALL_REQUIRES,
+    extras_require={
+        # ONNX Runtime CPU 推理引擎
+        "onnx": ["onnxruntime"],
+        # 异步直播服务(-server async)
+        "async": ["aiohttp"],
+    },
     url="",
     author="walkerjun",
     author_email="yujun2647@163.com",
@@ -65,6 +71,7 @@ setup(
     entry_points={
         "console_scripts": [
             "watchdog=watchdog.watch:main",
+            "watchdog-bench=watchdog.bench:main",
         ],
     },
     packages=all_packages,
@@ -0,0 +1,56 @@
+from collections import Counter
+
+from watchdog.services.workers.detect.detect_scheduler import (
+    FpsWeightedRoundRobin)
+
+
+def _run(rr: FpsWeightedRoundRobin, weights, rounds, has_frame=None):
+    """每轮取第一个有帧的相机，返回取帧顺序"""
+    served_names = []
+    for _ in range(rounds):
+        idle_names, served = [], None
+        for name in rr.schedule(weights):
+            if has_frame is None or has_frame(name):
+                served = name
+                break
+            idle_names.append(name)
+        rr.settle(weights, served, idle_names=idle_names)
+        served_names.append(served)
+    return served_names
+
+
+def test_weighted_fairness():
+    weights = {"a": 10, "b": 5, "c": 5}
+    rr = FpsWeightedRoundRobin(weights)
+    served = Counter(_run(rr, weights, rounds=40))
+    assert served == {"a": 20, "b": 10, "c": 10}
+
+
+def test_smooth_no_monopoly():
+    weights = {"a": 5, "b": 1, "c": 1}
+    rr = FpsWeightedRoundRobin(weights)
+    served = _run(rr, weights, rounds=7)
+    assert Counter(served) == {"a": 5, "b": 1, "c": 1}
+    # 平滑加权: 高帧率相机不会连续独占 5 轮
+    assert "a" * 5 not in "".join(served)
+
+
+def test_idle_camera_not_accumulate():
+    weights = {"a": 1, "b": 1}
+    rr = FpsWeightedRoundRobin(weights)
+    served = _run(rr, weights, rounds=10, has_frame=lambda name: name == "a")
+    assert served == ["a"] * 10
+    assert rr.to_dict()["b"] <= 0
+
+    # b 来帧后按权重交替，不会突发连续抢占
+    served = _run(rr, weights, rounds=6)
+    assert Counter(served) == {"a": 3, "b": 3}
+    assert "bb" not in "".join(served)
+
+
+def test_no_frames():
+    weights = {"a": 2, "b": 1}
+    rr = FpsWeightedRoundRobin(weights)
+    assert _run(rr, weights, rounds=3, has_frame=lambda name: False) == \
+        [None] * 3
+    assert all(current <= 0 for current in rr.to_dict().values())
@@ -0,0 +1,33 @@
+from watchdog.models.detect_info import DetectInfo
+from watchdog.services.workers.detect.detector_pool import (
+    DetectInfosReorderBuffer)
+
+
+def _d_infos(frame_id):
+    return [DetectInfo(frame_id=frame_id, label="person")]
+
+
+def test_newest_result_released_immediately():
+    buffer = DetectInfosReorderBuffer()
+    buffer.push(_d_infos(3))
+    assert [d[0].frame_id for d in buffer.pop_ready()] == [3]
+    assert len(buffer) == 0
+
+
+def test_gap_not_waited():
+    buffer = DetectInfosReorderBuffer()
+    for frame_id in (1, 3, 4):
+        buffer.push(_d_infos(frame_id))
+    # 第 2 帧还没到也不等待
+    assert [d[0].frame_id for d in buffer.pop_ready()] == [1, 3, 4]
+
+
+def test_late_older_result_dropped():
+    buffer = DetectInfosReorderBuffer()
+    buffer.push(_d_infos(5))
+    buffer.push(_d_infos(2))
+    buffer.push(_d_infos(5))
+    buffer.push(_d_infos(6))
+    assert [d[0].frame_id for d in buffer.pop_ready()] == [5, 6]
+    assert buffer.dropped_num == 2
+    assert buffer.pop_ready() == []
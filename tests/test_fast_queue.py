@@ -0,0 +1,40 @@
+import os
+import time
+import signal
+import multiprocessing as mp
+
+import numpy as np
+
+from watchdog.utils.util_multiprocess.queue import FastQueue
+
+
+def _put_and_sleep(q: FastQueue):
+    q.put(np.zeros((10, 10, 3), dtype=np.uint8))
+    time.sleep(60)
+
+
+def test_put_get_through_ring():
+    q = FastQueue(name="test_ring", maxsize=4)
+    frame = np.arange(300, dtype=np.uint8).reshape((10, 10, 3))
+    q.put(frame)
+    assert np.array_equal(q.get(timeout=5), frame)
+    assert q._ring_owner_pids[0] == os.getpid()
+
+
+def test_unlink_ring_of_killed_producer():
+    q = FastQueue(name="test_ring_cleanup", maxsize=4)
+    producer = mp.Process(target=_put_and_sleep, args=(q,))
+    producer.start()
+    q.get(timeout=5)
+    assert q._ring_owner_pids[0] == producer.pid
+    ring_name = q._ring_owner_name(0)
+    assert os.path.exists(f"/dev/shm/{ring_name}")
+
+    os.kill(producer.pid, signal.SIGKILL)
+    producer.join()
+    q.put(np.zeros((10, 10, 3), dtype=np.uint8))
+    q.get(timeout=5)
+
+    assert not os.path.exists(f"/dev/shm/{ring_name}")
+    assert list(q._ring_owner_pids).count(producer.pid) == 0
+    assert os.getpid() in list(q._ring_owner_pids)
@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+
+import pytest
+
+from watchdog.configs.constants import CameraConfig
+from watchdog.services.fps_controller import AdaptiveFpsController
+
+
+class FakeQConsole(object):
+
+    def __init__(self, video_fps, active=True):
+        self.camera = SimpleNamespace(video_fps=video_fps)
+        self.active = active
+        self.active_fps = None
+
+    def is_camera_active(self):
+        return self.active
+
+    def set_active_fps(self, fps, tag=""):
+        self.active_fps = fps
+
+
+class FakeDetectorPool(object):
+
+    def __init__(self, q_consoles, worker_num=1):
+        self.stream_q_consoles = {str(i): q for i, q in enumerate(q_consoles)}
+        self.worker_num = worker_num
+        self.cost = (0.0, 0)
+        self.dropped = 0
+        self.pending = 0
+
+    def detect_cost(self):
+        return self.cost
+
+    def dropped_num(self):
+        return self.dropped
+
+    def pending_num(self):
+        return self.pending
+
+    def detect(self, frame_num, cost_secs):
+        secs, num = self.cost
+        self.cost = (secs + frame_num * cost_secs, num + frame_num)
+
+
+@pytest.fixture(autouse=True)
+def fps_config():
+    active_fps = CameraConfig.ACTIVE_FPS.value
+    min_fps = CameraConfig.ADAPTIVE_MIN_FPS.value
+    CameraConfig.ACTIVE_FPS.value = 15
+    CameraConfig.ADAPTIVE_MIN_FPS.value = 3
+    yield
+    CameraConfig.ACTIVE_FPS.value = active_fps
+    CameraConfig.ADAPTIVE_MIN_FPS.value = min_fps
+
+
+def test_fps_bounds():
+    assert AdaptiveFpsController.fps_bounds() == (3, 15)
+    CameraConfig.ADAPTIVE_MIN_FPS.value = 20
+    assert AdaptiveFpsController.fps_bounds() == (15, 15)
+
+
+def test_no_detection_hold():
+    pool = FakeDetectorPool([FakeQConsole(15)])
+    decision = AdaptiveFpsController(pool).step()
+    assert decision["reason"] == "no detection yet"
+    assert decision["new_fps_limit"] == 15
+
+
+def test_overload_clamped_to_min_fps():
+    q_console = FakeQConsole(15)
+    pool = FakeDetectorPool([q_console])
+    controller = AdaptiveFpsController(pool)
+    # 每帧 1 秒，处理能力远低于最小帧率
+    pool.detect(frame_num=5, cost_secs=1)
+    pool.dropped = 10
+    decision = controller.step()
+    assert decision["reason"] == "overload"
+    assert decision["new_fps_limit"] == 3
+    assert controller.fps_limit == 3
+    assert q_console.active_fps == 3
+
+
+def test_overload_decrease():
+    pool = FakeDetectorPool([FakeQConsole(15)])
+    controller = AdaptiveFpsController(pool)
+    # 处理能力 0.8 / 0.08 = 10 fps
+    pool.detect(frame_num=10, cost_secs=0.08)
+    decision = controller.step()
+    assert decision["reason"] == "overload"
+    assert decision["new_fps_limit"] == 10
+
+
+def test_headroom_clamped_to_active_fps():
+    q_console = FakeQConsole(5)
+    pool = FakeDetectorPool([q_console])
+    controller = AdaptiveFpsController(pool)
+    controller.fps_limit = 5
+    for _ in range(20):
+        pool.detect(frame_num=10, cost_secs=0.001)
+        controller.step()
+    assert controller.fps_limit == 15
+    assert controller.step()["new_fps_limit"] == 15
+
+
+def test_rest_cameras_estimate_clamped():
+    q_console = FakeQConsole(5, active=False)
+    pool = FakeDetectorPool([q_console], worker_num=2)
+    controller = AdaptiveFpsController(pool)
+    pool.detect(frame_num=10, cost_secs=0.001)
+    decision = controller.step()
+    assert decision["reason"] == "estimate for next activation"
+    assert decision["new_fps_limit"] == 15
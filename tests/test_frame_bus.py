@@ -0,0 +1,89 @@
+import struct
+import threading
+
+import numpy as np
+import pytest
+
+from watchdog.utils.util_multiprocess.frame_bus import FrameBus
+
+
+def _frame(value):
+    return np.full((4, 6, 3), value, dtype=np.uint8)
+
+
+@pytest.fixture
+def bus():
+    bus = FrameBus(slot_num=4, name="test_frame_bus")
+    yield bus
+    bus._close_shm()
+    bus._unlink_previous_segment()
+
+
+def test_read_published_frame(bus):
+    seq = bus.publish(_frame(1), meta={"id": 1})
+    meta, frame = bus.read(seq)
+    assert seq == 1
+    assert meta == {"id": 1}
+    assert np.array_equal(frame, _frame(1))
+
+
+def test_read_overwritten_slot(bus):
+    for i in range(1, 6):
+        bus.publish(_frame(i))
+    # 第 1 帧的槽位已被第 5 帧覆盖
+    assert bus.read(1) is None
+    assert np.array_equal(bus.read(5)[1], _frame(5))
+
+
+def test_torn_read_retry(bus):
+    bus.publish(_frame(1), meta=1)
+    # 生产者写入槽位期间, 槽位序号为 0
+    struct.pack_into("Q", bus._shm.buf, bus._slot_start(1), 0)
+    assert bus.read(1) is None
+
+    subscriber = bus.subscribe("torn", policy=FrameBus.POLICY_SEQUENTIAL)
+    timer = threading.Timer(0.2, bus.publish, args=(_frame(2),),
+                            kwargs=dict(meta=2))
+    timer.start()
+    meta, frame = subscriber.get(timeout=3)
+    timer.join()
+    assert meta == 2
+    assert np.array_equal(frame, _frame(2))
+    assert subscriber.dropped_num.value == 1
+
+
+def test_latest_policy_skips(bus):
+    subscriber = bus.subscribe("latest", policy=FrameBus.POLICY_LATEST)
+    bus.publish(_frame(1), meta=1)
+    assert subscriber.get(timeout=1)[0] == 1
+    for i in range(2, 5):
+        bus.publish(_frame(i), meta=i)
+    assert subscriber.get(timeout=1)[0] == 4
+    assert subscriber.dropped_num.value == 2
+    assert subscriber.get(timeout=0.1) is None
+
+
+def test_sequential_policy(bus):
+    subscriber = bus.subscribe("seq", policy=FrameBus.POLICY_SEQUENTIAL)
+    bus.publish(_frame(1), meta=1)
+    assert subscriber.get(timeout=1)[0] == 1
+    for i in range(2, 5):
+        bus.publish(_frame(i), meta=i)
+    assert [subscriber.get(timeout=1)[0] for _ in range(3)] == [2, 3, 4]
+    assert subscriber.dropped_num.value == 0
+
+    # 落后超过槽位数时跳到仍安全的最旧帧
+    for i in range(5, 12):
+        bus.publish(_frame(i), meta=i)
+    assert subscriber.get(timeout=1)[0] == 9
+    assert subscriber.dropped_num.value == 4
+
+
+def test_reuse_buffer(bus):
+    subscriber = bus.subscribe("reuse", reuse_buffer=True)
+    bus.publish(_frame(1))
+    _, first = subscriber.get(timeout=1)
+    bus.publish(_frame(2))
+    _, second = subscriber.get(timeout=1)
+    assert second is first
+    assert np.array_equal(second, _frame(2))
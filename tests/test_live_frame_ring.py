@@ -0,0 +1,74 @@
+import threading
+from queue import Empty
+
+import numpy as np
+import pytest
+
+from watchdog.utils.util_camera import FrameBox
+from watchdog.services.workshop import LiveFrameRing
+
+
+def _frame_box(value):
+    return FrameBox(np.full((2, 2, 3), value, dtype=np.uint8))
+
+
+def test_latest_wait_timeout():
+    ring = LiveFrameRing(capacity=4)
+    with pytest.raises(Empty):
+        ring.latest(timeout=0.05)
+
+
+def test_latest():
+    ring = LiveFrameRing(capacity=4)
+    boxes = [_frame_box(i) for i in range(3)]
+    for box in boxes:
+        ring.push(box)
+    assert ring.latest(timeout=0) == (3, boxes[-1])
+
+
+def test_get_after_in_order():
+    ring = LiveFrameRing(capacity=4)
+    boxes = [_frame_box(i) for i in range(3)]
+    for box in boxes:
+        ring.push(box)
+    assert ring.get_after(0, timeout=0) == (1, boxes[0])
+    assert ring.get_after(1, timeout=0) == (2, boxes[1])
+    with pytest.raises(Empty):
+        ring.get_after(3, timeout=0.05)
+
+
+def test_get_after_overwritten_jumps_to_latest():
+    ring = LiveFrameRing(capacity=4)
+    boxes = [_frame_box(i) for i in range(10)]
+    for box in boxes:
+        ring.push(box)
+    # 第 2 帧已被覆盖，直接返回最新帧
+    assert ring.get_after(1, timeout=0) == (10, boxes[-1])
+    # 仍在缓冲区内的帧按顺序返回
+    assert ring.get_after(6, timeout=0) == (7, boxes[6])
+
+
+def test_capacity_bounded():
+    ring = LiveFrameRing(capacity=4)
+    for i in range(100):
+        ring.push(_frame_box(i))
+    assert len(ring._frames) == 4
+    assert ring.generation == 100
+
+
+def test_get_after_wakes_on_push():
+    ring = LiveFrameRing(capacity=4)
+    box = _frame_box(1)
+    timer = threading.Timer(0.1, ring.push, args=(box,))
+    timer.start()
+    assert ring.get_after(0, timeout=3) == (1, box)
+    timer.join()
+
+
+def test_listener():
+    ring = LiveFrameRing(capacity=4)
+    generations = []
+    ring.add_listener(generations.append)
+    ring.push(_frame_box(1))
+    ring.push(_frame_box(2))
+    assert generations == [1, 2]
@@ -0,0 +1,98 @@
+import pytest
+
+from watchdog.services.record_catalog import RecordCatalog
+
+
+def _filename(day, hour, tag, camera=""):
+    start_time = f"2023-05-{day:02d}-{hour:02d}-00-00-000000"
+    if camera:
+        return f"{start_time}-{camera}-{tag}.mp4"
+    return f"{start_time}-{tag}.mp4"
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    catalog = RecordCatalog(db_path=str(tmp_path / "catalog.db"))
+    yield catalog
+    catalog.close()
+
+
+def test_parse_filename():
+    assert RecordCatalog.parse_filename(_filename(1, 8, "有人出现")) == (
+        "2023-05-01-08-00-00-000000", "", "有人出现")
+    assert RecordCatalog.parse_filename(
+        _filename(1, 8, "有人出现", camera="door")) == (
+        "2023-05-01-08-00-00-000000", "door", "有人出现")
+    assert RecordCatalog.parse_filename(_filename(1, 8, "still active")) == (
+        "2023-05-01-08-00-00-000000", "", "still active")
+
+
+def test_query_pagination(catalog):
+    for hour in range(5):
+        catalog.add_record(_filename(1, hour, "有人出现"))
+
+    total, page = catalog.query(offset=0, limit=2)
+    assert total == 5
+    assert [r["start_time"][11:13] for r in page] == ["04", "03"]
+    total, page = catalog.query(offset=4, limit=2)
+    assert total == 5
+    assert [r["start_time"][11:13] for r in page] == ["00"]
+    assert len(catalog.query(limit=0)[1]) == 5
+
+
+def test_query_filter(catalog):
+    catalog.add_record(_filename(1, 8, "有人出现", camera="door"),
+                       camera="door")
+    catalog.add_record(_filename(2, 8, "车辆遮挡大门", camera="yard"),
+                       camera="yard")
+    catalog.add_record(_filename(3, 8, "有人出现", camera="door"),
+                       camera="door")
+
+    total, page = catalog.query(camera="door")
+    assert total == 2
+    assert {r["camera"] for r in page} == {"door"}
+    total, page = catalog.query(start_time="2023-05-02",
+                                end_time="2023-05-03")
+    assert total == 1
+    assert page[0]["camera"] == "yard"
+    assert page[0]["tag"] == "车辆遮挡大门"
+
+
+def test_finish_record(catalog):
+    filename = _filename(1, 8, "有人出现")
+    catalog.add_record(filename)
+    catalog.finish_record(filename, end_time="2023-05-01-08-00-30-000000",
+                          duration=30, size=1024,
+                          detect_summary={"person": 3})
+    record = catalog.query()[1][0]
+    assert record["duration"] == 30
+    assert record["size"] == 1024
+    assert record["detect_summary"] == {"person": 3}
+
+
+def test_sync_dir(catalog, tmp_path):
+    record_dir = tmp_path / "records"
+    record_dir.mkdir()
+    for filename in (_filename(1, 8, "有人出现", camera="door"),
+                     _filename(1, 9, "有人出现")):
+        (record_dir / filename).write_bytes(b"0" * 10)
+    catalog.add_record(_filename(1, 7, "有人出现"))
+
+    assert catalog.sync_dir(str(record_dir)) == (2, 1)
+    total, page = catalog.query(camera="door")
+    assert total == 1
+    assert page[0]["tag"] == "有人出现"
+    assert page[0]["size"] == 10
+    assert catalog.query(camera="")[0] == 1
+    assert catalog.sync_dir(str(record_dir)) == (0, 0)
+
+
+def test_sync_dir_repairs_camera(catalog, tmp_path):
+    filename = _filename(1, 8, "有人出现", camera="door")
+    (tmp_path / filename).write_bytes(b"")
+    # 早期补录的记录 camera 为空
+    catalog.add_record(filename, tag="door-有人出现", camera="")
+
+    catalog.sync_dir(str(tmp_path))
+    record = catalog.query(camera="door")[1][0]
+    assert record["tag"] == "有人出现"
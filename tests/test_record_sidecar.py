@@ -0,0 +1,39 @@
+from watchdog.services.record_sidecar import (DetectionSidecar,
+                                              get_sidecar_filename,
+                                              read_sidecar)
+
+
+def test_sidecar_filename():
+    assert get_sidecar_filename("2023-05-01-08-00-00-000000-有人出现.mp4") == \
+        "2023-05-01-08-00-00-000000-有人出现.detections.jsonl"
+
+
+def test_trim_keeps_recent():
+    sidecar = DetectionSidecar()
+    for i in range(10):
+        sidecar.add(100 + i * 0.5, [], frame_size=(640, 360))
+    sidecar.trim(keep_secs=2)
+    assert len(sidecar) == 5
+
+    sidecar.clear()
+    sidecar.trim(keep_secs=2)
+    assert len(sidecar) == 0
+
+
+def test_write_and_read(tmp_path):
+    sidecar = DetectionSidecar()
+    person = [["person", 0.9, 10, 20, 30, 40]]
+    sidecar.add(99.5, person, frame_size=(640, 360))
+    sidecar.add(100.0, person, frame_size=(640, 360))
+    sidecar.add(100.04, [], frame_size=(640, 360))
+
+    filepath = tmp_path / "a.detections.jsonl"
+    # 早于录像第一帧的结果被丢弃
+    assert sidecar.write(str(filepath), video_start_time=100.0) == 2
+    assert len(sidecar) == 0
+
+    sidecar_info = read_sidecar(str(filepath))
+    assert sidecar_info["width"] == 640
+    assert sidecar_info["height"] == 360
+    assert sidecar_info["frames"] == [dict(t=0.0, d=person),
+                                      dict(t=0.04, d=[])]
@@ -0,0 +1,86 @@
+import os
+import multiprocessing as mp
+
+import pytest
+
+from watchdog.utils.util_multiprocess.ring_buffer import ShmRingBuffer
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRingBuffer.create(slot_num=3, slot_size=100)
+    yield ring
+    ring.close()
+    ring.unlink()
+
+
+def test_slot_size_aligned(ring):
+    assert ring.slot_num == 3
+    assert ring.slot_size % ShmRingBuffer.ALIGNMENT == 0
+    assert ring.slot_size >= 100
+    assert ring.is_idle()
+
+
+def test_acquire_wraps_around(ring):
+    assert [ring.acquire_slot() for _ in range(3)] == [0, 1, 2]
+    assert ring.busy_num() == 3
+    assert ring.acquire_slot() is None
+
+    ring.release_slot(1)
+    assert ring.acquire_slot() == 1
+    ring.release_slot(0)
+    assert ring.acquire_slot() == 0
+    assert ring.head == 1
+
+
+def test_release_out_of_order(ring):
+    slots = [ring.acquire_slot() for _ in range(3)]
+    for slot in reversed(slots):
+        ring.release_slot(slot)
+    assert ring.is_idle()
+    assert ring.acquire_slot() == 0
+
+
+def test_write_and_read_views(ring):
+    slot = ring.acquire_slot()
+    datas = [b"header", bytes(range(50))]
+    ranges = ring.write(slot, [memoryview(d) for d in datas],
+                        [len(d) for d in datas])
+    assert ranges == [(0, 6), (6, 56)]
+
+    attached = ShmRingBuffer.attach(ring.name)
+    try:
+        views = attached.slot_views(slot, ranges)
+        assert [bytes(v) for v in views] == datas
+        attached.release_slot(slot)
+        del views
+    finally:
+        attached.close()
+    assert ring.is_idle()
+
+
+def test_reclaim_slot_of_exited_holder(ring, monkeypatch):
+    monkeypatch.setattr(ShmRingBuffer, "RECLAIM_INTERVAL_SECS", 0)
+    slots = [ring.acquire_slot() for _ in range(3)]
+
+    process = mp.Process(target=lambda: None)
+    process.start()
+    process.join()
+    ring.set_holder(slots[0], process.pid)
+    ring.set_holder(slots[1], os.getpid())
+
+    assert ring.acquire_slot() == slots[0]
+    assert ring.holder(slots[0]) == 0
+    # 持有者存活的槽位不回收
+    assert ring.acquire_slot() is None
+    assert ring.holder(slots[1]) == os.getpid()
+
+
+def test_reclaim_throttled(ring):
+    ring.acquire_slot()
+    ring.set_holder(0, 2 ** 31)
+    ring.reclaim_slots()
+    ring.acquire_slot()
+    ring.acquire_slot()
+    ring.set_holder(1, 2 ** 31)
+    assert ring.reclaim_slots() == 0
@@ -0,0 +1,356 @@
+"""
+    推理后端
+
+    所有引擎输入为若干张 BGR 图像(可以是裁剪后的视图)，
+    输出统一为 SSD DetectionOutput 格式的 N x 7 数组:
+        image_id, class_id, confidence, left, top, right, bottom(坐标归一化到 0~1)
+    后处理(坐标映射、NMS、DetectInfo 构造)由 YoloDetector 统一完成
+"""
+import os
+import time
+import logging
+from abc import ABC, abstractmethod
+from typing import *
+
+import numpy as np
+import cv2
+
+DIR_PATH = os.path.dirname(__file__)
+MODEL_DATA_PATH = os.path.join(DIR_PATH, "object_detect/model_data")
+
+
+class InferenceEngine(ABC):
+    NAME = ""
+
+    INPUT_SIZE = (320, 320)
+    INPUT_SCALE = 1.0 / 127.5
+    INPUT_MEAN = (127.5, 127.5, 127.5)
+
+    def __init__(self, input_size: Optional[Tuple[int, int]] = None,
+                 **kwargs):
+        """
+        :param input_size: 模型输入尺寸 (宽, 高)，为空时使用 INPUT_SIZE
+        """
+        if input_size:
+            self.INPUT_SIZE = tuple(input_size)
+        self.loaded = False
+        self.reset_stats()
+
+    @classmethod
+    @abstractmethod
+    def is_available(cls, model_path: Optional[str] = None) -> bool:
+        """
+        :param model_path: 将要加载的模型，为空时检查引擎的默认模型
+        """
+        pass
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        """能否加载指定格式的模型文件"""
+        return True
+
+    @abstractmethod
+    def _load(self):
+        pass
+
+    @abstractmethod
+    def _forward(self, frames: List[np.ndarray]) -> np.ndarray:
+        pass
+
+    def load(self):
+        if not self.loaded:
+            self._load()
+            self.loaded = True
+        return self
+
+    def blob(self, frames: List[np.ndarray]) -> np.ndarray:
+        return cv2.dnn.blobFromImages(
+            frames, scalefactor=self.INPUT_SCALE, size=self.INPUT_SIZE,
+            mean=self.INPUT_MEAN, swapRB=True, crop=False)
+
+    def detect_batch(self, frames: List[np.ndarray]) -> np.ndarray:
+        self.load()
+        start = time.perf_counter()
+        outs = self._forward(frames).reshape(-1, 7)
+        cost_ms = (time.perf_counter() - start) * 1000
+        self.calls += 1
+        self.frame_num += len(frames)
+        self.total_ms += cost_ms
+        self.last_ms = cost_ms
+        return outs
+
+    def warmup(self, runs=3, frame_size=(1280, 720)) -> float:
+        """
+            预热并返回单帧平均耗时(ms)，预热数据不计入统计
+        """
+        self.load()
+        frame = np.zeros((frame_size[1], frame_size[0], 3), dtype=np.uint8)
+        self._forward([frame])
+        start = time.perf_counter()
+        for _ in range(runs):
+            self._forward([frame])
+        return (time.perf_counter() - start) * 1000 / max(runs, 1)
+
+    def reset_stats(self):
+        self.calls = 0
+        self.frame_num = 0
+        self.total_ms = 0.0
+        self.last_ms = 0.0
+
+    def stats(self) -> Dict:
+        return {
+            "engine": self.NAME,
+            "calls": self.calls,
+            "frame_num": self.frame_num,
+            "avg_frame_ms": (round(self.total_ms / self.frame_num, 3)
+                             if self.frame_num else 0),
+            "last_ms": round(self.last_ms, 3),
+        }
+
+
+class OpenCVDnnEngine(InferenceEngine):
+    """OpenCV DNN CPU 推理，有 OpenVINO(Inference Engine) 时优先使用"""
+    NAME = "opencv"
+
+    DEFAULT_CONFIG_PATH = os.path.join(
+        MODEL_DATA_PATH, "ssd_mobilenet_v3_large_coco_2020_01_14.pbtxt")
+    DEFAULT_MODEL_PATH = os.path.join(MODEL_DATA_PATH,
+                                      "frozen_inference_graph.pb")
+
+    def __init__(self, model_path=None, config_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.model_path = model_path if model_path else self.DEFAULT_MODEL_PATH
+        self.config_path = (config_path if config_path
+                            else self.DEFAULT_CONFIG_PATH)
+        self.net: Optional[cv2.dnn.Net] = None
+
+    @classmethod
+    def is_available(cls, model_path: Optional[str] = None) -> bool:
+        return os.path.exists(model_path if model_path
+                              else cls.DEFAULT_MODEL_PATH)
+
+    @classmethod
+    def _has_openvino(cls) -> bool:
+        try:
+            return bool(cv2.dnn.getAvailableTargets(
+                cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE))
+        except (AttributeError, cv2.error):
+            return False
+
+    def _set_backend(self):
+        if self._has_openvino():
+            self.net.setPreferableBackend(
+                cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE)
+        else:
+            self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+
+    def _load(self):
+        self.net = cv2.dnn.readNet(self.model_path, self.config_path)
+        self._set_backend()
+
+    def _forward(self, frames: List[np.ndarray]) -> np.ndarray:
+        self.net.setInput(self.blob(frames))
+        return self.net.forward()
+
+
+class OpenCVCudaEngine(OpenCVDnnEngine):
+    """OpenCV DNN CUDA 推理，仅在有 CUDA 设备时可用"""
+    NAME = "opencv-cuda"
+
+    @classmethod
+    def is_available(cls, model_path: Optional[str] = None) -> bool:
+        try:
+            has_cuda = cv2.cuda.getCudaEnabledDeviceCount() > 0
+        except (AttributeError, cv2.error):
+            has_cuda = False
+        return has_cuda and super().is_available(model_path)
+
+    def _set_backend(self):
+        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
+        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+
+
+class OnnxRuntimeEngine(InferenceEngine):
+    """
+        ONNX Runtime CPU 推理 (可选依赖: pip install onnxruntime)
+
+        支持两种模型输出:
+            - 单个 DetectionOutput 格式的 N x 7 输出
+            - tf2onnx 导出的 TF Object Detection 模型:
+              detection_boxes(ymin, xmin, ymax, xmax) / detection_classes /
+              detection_scores / num_detections
+    """
+    NAME = "onnxruntime"
+
+    DEFAULT_MODEL_PATH = os.path.join(MODEL_DATA_PATH,
+                                      "ssd_mobilenet_v3_large_coco.onnx")
+
+    def __init__(self, model_path=None, intra_op_threads=0,
+                 inter_op_threads=0, **kwargs):
+        super().__init__(**kwargs)
+        self.model_path = model_path if model_path else self.DEFAULT_MODEL_PATH
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.session = None
+        self._input_name = ""
+        self._uint8_nhwc = False
+        self._output_names: List[str] = []
+
+    @classmethod
+    def is_available(cls, model_path: Optional[str] = None) -> bool:
+        try:
+            import onnxruntime
+        except ImportError:
+            return False
+        return os.path.exists(model_path if model_path
+                              else cls.DEFAULT_MODEL_PATH)
+
+    @classmethod
+    def can_load(cls, model_path: str) -> bool:
+        return model_path.endswith(".onnx")
+
+    def _load(self):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        # 0 表示由 onnxruntime 自行决定
+        options.intra_op_num_threads = self.intra_op_threads
+        options.inter_op_num_threads = self.inter_op_threads
+        options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL)
+        self.session = ort.InferenceSession(
+            self.model_path, sess_options=options,
+            providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self._input_name = model_input.name
+        self._uint8_nhwc = model_input.type == "tensor(uint8)"
+        self._output_names = [o.name for o in self.session.get_outputs()]
+
+    def _inputs(self, frames: List[np.ndarray]) -> np.ndarray:
+        if not self._uint8_nhwc:
+            return self.blob(frames)
+        return np.stack([
+            cv2.cvtColor(cv2.resize(frame, self.INPUT_SIZE), cv2.COLOR_BGR2RGB)
+            for frame in frames])
+
+    def _forward(self, frames: List[np.ndarray]) -> np.ndarray:
+        outs = self.session.run(None, {self._input_name: self._inputs(frames)})
+        if len(outs) == 1:
+            return outs[0]
+
+        named_outs = {name.split(":")[0]: out
+                      for name, out in zip(self._output_names, outs)}
+        boxes = named_outs["detection_boxes"]
+        classes = named_outs["detection_classes"]
+        scores = named_outs["detection_scores"]
+        nums = named_outs["num_detections"].astype(int)
+        rows = []
+        for image_id in range(boxes.shape[0]):
+            num = nums[image_id]
+            for (ymin, xmin, ymax, xmax), class_id, score in zip(
+                    boxes[image_id][:num], classes[image_id][:num],
+                    scores[image_id][:num]):
+                rows.append((image_id, class_id, score, xmin, ymin,
+                             xmax, ymax))
+        return np.array(rows, dtype=np.float32).reshape(-1, 7)
+
+
+class StubEngine(InferenceEngine):
+    """测试用，不做推理，每帧返回预设的检测行(image_id 会被替换)"""
+    NAME = "stub"
+
+    def __init__(self, rows: Optional[List[Sequence[float]]] = None,
+                 cost_ms=0, **kwargs):
+        super().__init__(**kwargs)
+        self.rows = np.array(rows if rows else [],
+                             dtype=np.float32).reshape(-1, 7)
+        self.cost_ms = cost_ms
+
+    @classmethod
+    def is_available(cls, model_path: Optional[str] = None) -> bool:
+        return True
+
+    def _load(self):
+        pass
+
+    def _forward(self, frames: List[np.ndarray]) -> np.ndarray:
+        if self.cost_ms:
+            time.sleep(self.cost_ms / 1000)
+        outs = []
+        for image_id in range(len(frames)):
+            rows = self.rows.copy()
+            rows[:, 0] = image_id
+            outs.append(rows)
+        return np.concatenate(outs) if outs else self.rows
+
+
+ENGINES: Dict[str, Type[InferenceEngine]] = {
+    engine.NAME: engine
+    for engine in (OpenCVDnnEngine, OpenCVCudaEngine, OnnxRuntimeEngine,
+                   StubEngine)
+}
+
+# 自动选择时参与比较的引擎
+AUTO_CANDIDATES = (OpenCVCudaEngine.NAME, OnnxRuntimeEngine.NAME,
+                   OpenCVDnnEngine.NAME)
+
+
+def check_engine(name: str, model_path: Optional[str] = None):
+    """
+        检查引擎能否加载将要使用的模型，不能时直接报错，避免悄悄换用默认模型
+    :param name:
+    :param model_path: 自定义模型，为空时检查引擎的默认模型
+    """
+    if name not in ENGINES:
+        raise TypeError(f"Unknown inference engine: {name}, "
+                        f"must in {list(ENGINES)}")
+    engine_class = ENGINES[name]
+    if model_path and not engine_class.can_load(model_path):
+        raise ValueError(f"Inference engine {name} can not load model: "
+                         f"{model_path}")
+    if not engine_class.is_available(model_path):
+        raise RuntimeError(f"Inference engine {name} is unavailable, "
+                           f"model: {model_path or 'default'}")
+
+
+def create_engine(name: str, **kwargs) -> InferenceEngine:
+    if name not in ENGINES:
+        raise TypeError(f"Unknown inference engine: {name}, "
+                        f"must in {list(ENGINES)}")
+    return ENGINES[name](**kwargs)
+
+
+def select_fastest_engine(candidates=AUTO_CANDIDATES, model_path=None,
+                          config_path=None, **kwargs) -> InferenceEngine:
+    """
+        对所有可用引擎预热测速，返回单帧耗时最短的引擎
+    :param candidates:
+    :param model_path: 自定义模型，不能加载该模型的引擎不参与比较
+    :param config_path:
+    :param kwargs: 创建引擎的其他参数
+    """
+    if model_path:
+        kwargs.update(model_path=model_path, config_path=config_path)
+    best_engine, best_ms = None, None
+    for name in candidates:
+        engine_class = ENGINES[name]
+        if model_path and not engine_class.can_load(model_path):
+            continue
+        if not engine_class.is_available(model_path):
+            continue
+        # noinspection PyBroadException
+        try:
+            engine = engine_class(**kwargs)
+            cost_ms = engine.warmup()
+        except Exception as exp:
+            logging.warning(f"[inference engine] {name} unusable: {exp}")
+            continue
+        logging.info(f"[inference engine] {name}: {round(cost_ms, 2)} ms/frame")
+        if best_ms is None or cost_ms < best_ms:
+            best_engine, best_ms = engine, cost_ms
+
+    if best_engine is None:
+        raise RuntimeError(f"No inference engine available in {candidates}")
+    logging.info(f"[inference engine] selected: {best_engine.NAME}")
+    return best_engine
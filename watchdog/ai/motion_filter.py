@@ -0,0 +1,74 @@
+import time
+from typing import *
+
+import numpy as np
+import cv2
+
+
+class MotionFilter(object):
+    """
+        检测前的运动预过滤：
+            对 ROI 区域缩小后转灰度，与上一次送去检测的参考帧做帧差，
+            变化像素占比低于阈值视为静止画面，可跳过 DNN 推理
+
+        参考帧只在判定为运动(需要推理)时更新，缓慢的变化会持续累积，最终仍会触发检测
+    """
+    # 缩小后的宽度
+    SCALE_WIDTH = 160
+    # 灰度差大于此值视为变化像素
+    DIFF_THRESHOLD = 25
+    # 变化像素占比大于此值视为有运动
+    MOTION_RATIO = 0.002
+    # 最长跳过时间，超过后强制推理一次
+    REFRESH_SECS = 5
+
+    def __init__(self, diff_threshold=DIFF_THRESHOLD, motion_ratio=MOTION_RATIO,
+                 refresh_secs=REFRESH_SECS):
+        self.diff_threshold = diff_threshold
+        self.motion_ratio = motion_ratio
+        self.refresh_secs = refresh_secs
+        self._reference: Optional[np.ndarray] = None
+        self._reference_time = 0
+
+    def reset(self):
+        self._reference = None
+
+    def _preprocess(self, frame: np.ndarray,
+                    roi: Optional[Tuple[int, int, int, int]] = None):
+        if roi is not None:
+            x, y, w, h = roi
+            roi_frame = frame[max(y, 0): y + h, max(x, 0): x + w]
+            if roi_frame.size:
+                frame = roi_frame
+        height, width = frame.shape[:2]
+        scale_height = max(1, int(height * self.SCALE_WIDTH / max(width, 1)))
+        small = cv2.resize(frame, (self.SCALE_WIDTH, scale_height),
+                           interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def has_motion(self, frame: np.ndarray,
+                   roi: Optional[Tuple[int, int, int, int]] = None) -> bool:
+        """
+        :param frame:
+        :param roi: x, y, w, h，只在此区域内判断
+        :return: 是否需要推理
+        """
+        gray = self._preprocess(frame, roi)
+        now = time.perf_counter()
+        if (self._reference is None or self._reference.shape != gray.shape
+                or now - self._reference_time >= self.refresh_secs):
+            self._reference = gray
+            self._reference_time = now
+            return True
+
+        diff = cv2.absdiff(gray, self._reference)
+        _, diff = cv2.threshold(diff, self.diff_threshold, 255,
+                                cv2.THRESH_BINARY)
+        if cv2.countNonZero(diff) < gray.size * self.motion_ratio:
+            return False
+
+        self._reference = gray
+        self._reference_time = now
+        return True
@@ -9,6 +9,9 @@ from watchdog.utils.util_time import get_bj_time
 from watchdog.models.detect_info import DetectInfo
 from watchdog.utils.util_log import time_cost_log_with_desc
 from watchdog.utils.util_camera import FrameBox
+from watchdog.configs.constants import DetectConfig
+from watchdog.ai.engines import (InferenceEngine, check_engine,
+                                 create_engine, select_fastest_engine)
 
 DIR_PATH = os.path.dirname(__file__)
 
@@ -24,25 +27,64 @@ class YoloDetector(object):
                                       "frozen_inference_graph.pb")
     DEFAULT_CLASS_PATH = os.path.join(DEFAULT_MODEL_DATA_PATH, "coco.names")
 
-    def __init__(self, model_path=None, config_path=None, class_path=None):
+    CONF_THRESHOLD = 0.5
+
+    def __init__(self, model_path=None, config_path=None, class_path=None,
+                 engine: Optional[InferenceEngine] = None):
+        """
+        :param model_path:
+        :param config_path:
+        :param class_path:
+        :param engine: 推理引擎，为空时按 DetectConfig.ENGINE 创建，
+                       "auto" 表示预热测速后选择最快的可用引擎
+        """
         self.model_path = model_path if model_path else self.DEFAULT_MODEL_PATH
         self.config_path = (config_path if config_path
                             else self.DEFAULT_CONFIG_PATH)
         self.class_path = class_path if class_path else self.DEFAULT_CLASS_PATH
-        net_detector = cv2.dnn.readNet(self.model_path, self.config_path, "darknet")
-        net_detector.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-        net_detector.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
-        self.net = cv2.dnn_DetectionModel(net_detector)
-        #self.net = cv2.dnn_DetectionModel(self.model_path, self.config_path)
-        self.net.setInputSize(320, 320)
-        self.net.setInputScale(1.0 / 127.5)
-        self.net.setInputMean((127.5, 127.5, 127.5))
-        self.net.setInputSwapRB(True)
+        if engine is None:
+            engine = self._create_engine(model_path, config_path)
+        self.engine: InferenceEngine = engine.load()
         self.classes_list: Optional[List[str]] = None
         self.color_list: Optional[List[str]] = None
 
         self.init_classes()
 
+    @classmethod
+    def _engine_kwargs(cls) -> Dict:
+        return dict(intra_op_threads=DetectConfig.ORT_INTRA_OP_THREADS,
+                    inter_op_threads=DetectConfig.ORT_INTER_OP_THREADS)
+
+    @classmethod
+    def resolve_engine(cls, model_path=None, config_path=None) -> str:
+        """
+            DetectConfig.ENGINE 为 "auto" 时预热测速选出最快的引擎，
+            并将 DetectConfig.ENGINE 改为选中的引擎；
+            在启动检测进程前调用，各检测进程直接创建选中的引擎，不再各自测速
+        """
+        if DetectConfig.ENGINE == "auto":
+            DetectConfig.ENGINE = select_fastest_engine(
+                model_path=model_path, config_path=config_path,
+                **cls._engine_kwargs()).NAME
+        else:
+            check_engine(DetectConfig.ENGINE, model_path)
+        return DetectConfig.ENGINE
+
+    def _create_engine(self, model_path=None,
+                       config_path=None) -> InferenceEngine:
+        """
+        :param model_path: 自定义模型，为空时各引擎使用自己的默认模型
+        :param config_path:
+        """
+        engine_kwargs = self._engine_kwargs()
+        if DetectConfig.ENGINE == "auto":
+            return select_fastest_engine(model_path=model_path,
+                                         config_path=config_path,
+                                         **engine_kwargs)
+        check_engine(DetectConfig.ENGINE, model_path)
+        engine_kwargs.update(model_path=model_path, config_path=config_path)
+        return create_engine(DetectConfig.ENGINE, **engine_kwargs)
+
     def init_classes(self):
         with open(self.class_path, "r") as fp:
             self.classes_list = fp.readlines()
@@ -51,14 +93,64 @@ class YoloDetector(object):
         self.color_list = np.random.uniform(low=0, high=255,
                                             size=(len(self.classes_list), 3))
 
+    @classmethod
+    def _crop(cls, frame: np.ndarray,
+              roi: Optional[Tuple[int, int, int, int]] = None):
+        """
+            裁剪出 roi 区域(不拷贝)，返回裁剪后的帧及其左上角在原图中的坐标
+        """
+        if roi is None:
+            return frame, (0, 0)
+        x, y, w, h = roi
+        return frame[y: y + h, x: x + w], (x, y)
+
     # @time_cost_log_with_desc(min_cost=10)
-    def detect(self, frame_box: FrameBox) -> List[DetectInfo]:
-        frame = frame_box.frame
-        class_label_ids, confidences, bboxes = self.net.detect(
-            frame, confThreshold=0.5)
-        bboxes = list(bboxes)
-        confidences = list(np.array(confidences).reshape(1, -1)[0])
-        confidences = list(map(float, confidences))
+    def detect(self, frame_box: FrameBox,
+               roi: Optional[Tuple[int, int, int, int]] = None) \
+            -> List[DetectInfo]:
+        """
+        :param frame_box:
+        :param roi: x, y, w, h, 只在此区域内推理, 结果坐标会映射回原图
+        :return:
+        """
+        return self.detect_batch([frame_box], roi=roi)[0]
+
+    def detect_batch(self, frame_boxes: List[FrameBox],
+                     roi: Optional[Tuple[int, int, int, int]] = None) \
+            -> List[List[DetectInfo]]:
+        """
+            多帧一次前向推理，再逐帧做 NMS，返回结果与 frame_boxes 一一对应
+        """
+        if not frame_boxes:
+            return []
+
+        crops = [self._crop(frame_box.frame, roi) for frame_box in frame_boxes]
+        # 每行为 image_id, class_id, confidence, left, top, right, bottom(归一化)
+        outs = self.engine.detect_batch([frame for frame, _ in crops])
+
+        batch_results = []
+        for image_id, frame_box in enumerate(frame_boxes):
+            frame, offset = crops[image_id]
+            width, height = frame.shape[1], frame.shape[0]
+            rows = outs[(outs[:, 0] == image_id)
+                        & (outs[:, 2] >= self.CONF_THRESHOLD)]
+            class_label_ids, confidences, bboxes = [], [], []
+            for _, class_id, confidence, left, top, right, bottom in rows:
+                x1 = int(max(0, min(left * width, width - 1)))
+                y1 = int(max(0, min(top * height, height - 1)))
+                x2 = int(max(0, min(right * width, width - 1)))
+                y2 = int(max(0, min(bottom * height, height - 1)))
+                class_label_ids.append(int(class_id))
+                confidences.append(float(confidence))
+                bboxes.append((x1, y1, x2 - x1 + 1, y2 - y1 + 1))
+            batch_results.append(self._to_detect_infos(
+                frame_box, class_label_ids, confidences, bboxes,
+                offset=offset))
+        return batch_results
+
+    def _to_detect_infos(self, frame_box: FrameBox, class_label_ids,
+                         confidences: List[float], bboxes: List,
+                         offset=(0, 0)) -> List[DetectInfo]:
         now_time = get_bj_time()
         if 8 <= now_time.hour <= 18:
             score_threshold = 0.5
@@ -81,6 +173,7 @@ class YoloDetector(object):
                 class_label = class_label.replace("\n", "")
                 class_color = [int(c) for c in self.color_list[class_label_id]]
                 x, y, w, h = bbox
+                x, y = int(x) + offset[0], int(y) + offset[1]
                 detect_infos.append(DetectInfo(
                     frame_id=frame_box.frame_id,
                     width=width,
@@ -0,0 +1,212 @@
+"""
+    检测器基准测试，离线运行，不依赖摄像头
+
+        watchdog-bench detect --frames 300 --batch-size 4 --engine opencv
+        watchdog-bench detect --video test.mp4 --threads 4 --output result.json
+
+    输出 JSON: p50/p95/p99 延迟、FPS、峰值内存，便于对比不同版本/参数
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+from typing import *
+
+import numpy as np
+import cv2
+
+from watchdog import __version__
+from watchdog.configs.constants import DetectConfig
+from watchdog.utils.util_camera import FrameBox
+
+
+def _synthetic_frames(frame_num, width, height) -> Iterator[np.ndarray]:
+    """固定随机种子的噪声背景 + 移动的矩形，保证每次运行输入一致"""
+    rng = np.random.default_rng(2023)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    box_w, box_h = max(width // 8, 1), max(height // 4, 1)
+    for i in range(frame_num):
+        frame = background.copy()
+        x = (i * 7) % max(width - box_w, 1)
+        y = (i * 3) % max(height - box_h, 1)
+        cv2.rectangle(frame, (x, y), (x + box_w, y + box_h), (40, 80, 200),
+                      thickness=-1)
+        yield frame
+
+
+def _video_frames(video_path, frame_num, width, height) \
+        -> Iterator[np.ndarray]:
+    """读取视频文件，不够 frame_num 帧时从头循环"""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise FileNotFoundError(f"Can not open video: {video_path}")
+    try:
+        count = 0
+        while count < frame_num:
+            grabbed, frame = cap.read()
+            if not grabbed:
+                if count == 0:
+                    raise ValueError(f"No frame in video: {video_path}")
+                cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                continue
+            if (frame.shape[1], frame.shape[0]) != (width, height):
+                frame = cv2.resize(frame, (width, height))
+            count += 1
+            yield frame
+    finally:
+        cap.release()
+
+
+def _percentile(values: List[float], q) -> float:
+    if not values:
+        return 0
+    return round(float(np.percentile(values, q)), 3)
+
+
+def _peak_rss_mb() -> float:
+    # linux 下 ru_maxrss 单位为 KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2)
+
+
+def bench_detect(args) -> Dict:
+    from watchdog.ai.engines import create_engine, select_fastest_engine
+    from watchdog.ai.yolo_detector import YoloDetector
+
+    if args.threads > 0:
+        cv2.setNumThreads(args.threads)
+    engine_kwargs = dict(intra_op_threads=max(args.threads, 0))
+    if args.input_size > 0:
+        # 自动选择时也按指定的输入尺寸测速
+        engine_kwargs.update(input_size=(args.input_size, args.input_size))
+    if args.engine == "auto":
+        engine = select_fastest_engine(**engine_kwargs)
+    else:
+        engine = create_engine(args.engine, **engine_kwargs)
+    detector = YoloDetector(engine=engine)
+
+    if args.video:
+        frames = list(_video_frames(args.video, args.frames, args.width,
+                                    args.height))
+    else:
+        frames = list(_synthetic_frames(args.frames, args.width, args.height))
+    frame_boxes = [FrameBox(frame) for frame in frames]
+
+    for _ in range(args.warmup):
+        detector.detect_batch(frame_boxes[:args.batch_size])
+    # 引擎统计只计正式测试的批次
+    engine.reset_stats()
+
+    batch_ms, frame_ms = [], []
+    detect_num = 0
+    start = time.perf_counter()
+    for i in range(0, len(frame_boxes), args.batch_size):
+        batch = frame_boxes[i: i + args.batch_size]
+        batch_start = time.perf_counter()
+        results = detector.detect_batch(batch)
+        cost_ms = (time.perf_counter() - batch_start) * 1000
+        batch_ms.append(cost_ms)
+        frame_ms.extend([cost_ms / len(batch)] * len(batch))
+        detect_num += sum(len(d_infos) for d_infos in results)
+    total_secs = time.perf_counter() - start
+
+    return {
+        "version": __version__,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "opencv": cv2.__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "params": {
+            "engine": engine.NAME,
+            "source": args.video if args.video else "synthetic",
+            "frames": len(frame_boxes),
+            "frame_size": [args.width, args.height],
+            "input_size": list(engine.INPUT_SIZE),
+            "batch_size": args.batch_size,
+            "threads": args.threads,
+            "warmup": args.warmup,
+        },
+        "result": {
+            "fps": round(len(frame_boxes) / total_secs, 2)
+            if total_secs else 0,
+            "total_secs": round(total_secs, 3),
+            "frame_latency_ms": {
+                "p50": _percentile(frame_ms, 50),
+                "p95": _percentile(frame_ms, 95),
+                "p99": _percentile(frame_ms, 99),
+            },
+            "batch_latency_ms": {
+                "p50": _percentile(batch_ms, 50),
+                "p95": _percentile(batch_ms, 95),
+                "p99": _percentile(batch_ms, 99),
+            },
+            "detect_num": detect_num,
+            "peak_rss_mb": _peak_rss_mb(),
+            "engine_stats": engine.stats(),
+        },
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="watchdog-bench")
+    parser.version = str(__version__)
+    parser.add_argument('-V', action='version',
+                        help='print the version and exit')
+    sub_parsers = parser.add_subparsers(dest="command")
+    sub_parsers.required = True
+
+    detect_parser = sub_parsers.add_parser(
+        "detect", help="benchmark detector throughput and latency")
+    detect_parser.add_argument(
+        "--video", help="recorded clip, synthetic frames are used if empty",
+        default="", type=str)
+    detect_parser.add_argument(
+        "--frames", help="frames to detect, default: 200",
+        default=200, type=int)
+    detect_parser.add_argument(
+        "--width", help="frame width, default: 1280", default=1280, type=int)
+    detect_parser.add_argument(
+        "--height", help="frame height, default: 720", default=720, type=int)
+    detect_parser.add_argument(
+        "--input-size", help="network input size, 0 means engine default",
+        default=0, type=int)
+    detect_parser.add_argument(
+        "--batch-size", help="frames per forward pass, default: 1",
+        default=1, type=int)
+    detect_parser.add_argument(
+        "--threads", help="inference threads, 0 means library default",
+        default=0, type=int)
+    detect_parser.add_argument(
+        "--engine", help="inference engine, default: auto",
+        default=DetectConfig.ENGINE,
+        choices=["auto", "opencv", "opencv-cuda", "onnxruntime", "stub"],
+        type=str)
+    detect_parser.add_argument(
+        "--warmup", help="warmup batches, default: 3", default=3, type=int)
+    detect_parser.add_argument(
+        "--output", help="also write the json result to this file",
+        default="", type=str)
+    detect_parser.set_defaults(func=bench_detect)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    args.batch_size = max(1, args.batch_size)
+    args.frames = max(1, args.frames)
+    result = args.func(args)
+    result_str = json.dumps(result, indent=4, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as fp:
+            fp.write(result_str)
+    sys.stdout.write(result_str + "\n")
+    return result
+
+
+if __name__ == "__main__":
+    main()
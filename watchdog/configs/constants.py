@@ -253,3 +253,102 @@ class CameraConfig(object):
     VIDEO_HEIGHT = mp.Value("i", 720)
     CAR_ALART_SECS = mp.Value("i", 3 * 60)
     CACHE_DAYS = mp.Value("i", 30)
+    # 自适应帧率：根据检测耗时与待检测帧数，在 [ADAPTIVE_MIN_FPS, ACTIVE_FPS]
+    # 内调整激活时的帧率，静止时仍为 REST_FPS
+    ADAPTIVE_FPS = mp.Value("i", 0)
+    ADAPTIVE_MIN_FPS = mp.Value("i", 2)
+
+
+class DetectConfig(object):
+    # 批量推理：一次最多攒 BATCH_SIZE 帧，或最多等待 BATCH_WAIT_MS 毫秒，为 1 时逐帧检测
+    BATCH_SIZE = mp.Value("i", 1)
+    BATCH_WAIT_MS = mp.Value("i", 20)
+    # ROI 推理：只对感应器关注区域(外扩 ROI_MARGIN 比例)做推理，结果再映射回原图坐标
+    ROI_INFERENCE = mp.Value("i", 0)
+    ROI_MARGIN = mp.Value("d", 0.2)
+
+    # 推理引擎：auto / opencv / opencv-cuda / onnxruntime / stub，
+    # 只在检测进程启动时读取，需在启动工作进程前设置
+    ENGINE = "auto"
+    # onnxruntime 线程数，0 表示由 onnxruntime 自行决定
+    ORT_INTRA_OP_THREADS = 0
+    ORT_INTER_OP_THREADS = 0
+
+    # 各检测优先级(DetectPriority.ORDERED)的帧最大等待时长(ms)，
+    # 从相机读取起算，取帧时已超过的帧直接丢弃，不再推理，0 为不丢弃
+    MAX_AGE_MS = mp.Array("i", [1000, 2000, 5000])
+
+
+class DetectPriority(Base):
+    """检测优先级，检测器优先处理高优先级相机的帧"""
+    # 检测到目标(MonitorStates.is_now_active)
+    ACTIVE = "active"
+    # 有人正在观看(LatestViewTime.is_live)
+    VIEWED = "viewed"
+    REST = "rest"
+
+    # 从高到低
+    ORDERED = (ACTIVE, VIEWED, REST)
+
+
+class MotionConfig(object):
+    # 是否启用检测前的运动预过滤，静止画面跳过推理
+    ENABLE = mp.Value("i", 0)
+    # 运动判断区域 x, y, w, h，全为 0 时使用相机的 center_box
+    ROI = mp.Array("i", [0, 0, 0, 0])
+
+
+class FrameStage(Base):
+    """帧在流水线中经过的各个阶段，用于统计端到端延迟"""
+    READ = "read"
+    RESIZE = "resize"
+    DISTRIBUTE = "distribute"
+    DETECT = "detect"
+    MARK = "mark"
+    RENDER = "render"
+    ENCODE = "encode"
+    RECORD = "record"
+
+    # 按流水线顺序
+    ORDERED = (READ, RESIZE, DISTRIBUTE, DETECT, MARK, RENDER, ENCODE, RECORD)
+
+
+class VideoEncodeStage(Base):
+    """录像每帧编码的耗时分项"""
+    # BGR 转 yuv420p
+    CONVERT = "convert"
+    H264 = "h264"
+
+    ORDERED = (CONVERT, H264)
+
+
+class DebugConfig(object):
+    # 是否将各阶段延迟文字画到帧上(仅用于调试，会修改录制的画面)
+    DELAY_TEXT = mp.Value("i", 0)
+
+
+class RecordConfig(object):
+    # 预录时长(秒)，触发录像时先写入这段时间内的画面，0 为关闭
+    PRE_ROLL_SECS = mp.Value("d", 5)
+    # 预录缓冲内存上限(MB)
+    PRE_ROLL_MAX_MB = mp.Value("i", 32)
+    # 连续录像：始终编码并写入固定时长的分段，事件录像从分段中剪出(不重新编码)
+    CONTINUOUS = mp.Value("i", 0)
+    # 分段时长(秒)
+    SEGMENT_SECS = mp.Value("i", 60)
+    # 分段保留时长(小时)
+    SEGMENT_KEEP_HOURS = mp.Value("d", 24)
+    # 录制原始画面，检测框写入旁路文件(.detections.jsonl)由播放器叠加，不画进录像
+    RAW_FRAMES = mp.Value("i", 0)
+
+    # 录像编码参数(libx264)，只在录像进程创建编码器时读取，需在启动工作进程前设置
+    ENCODER_PRESET = "veryfast"
+    # 为空时不设置
+    ENCODER_TUNE = "zerolatency"
+    # 编码线程数，0 表示由 x264 自行决定
+    ENCODER_THREADS = 0
+    # 关键帧间隔(秒)，也是预录/剪辑起点的对齐粒度
+    GOP_SECS = 1.0
+    # 恒定质量(0~51，越小质量越高)，0 表示按 BIT_RATE 码率编码
+    CRF = 0
+    BIT_RATE = 1024 * 500
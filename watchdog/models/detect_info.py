@@ -2,7 +2,8 @@ class DetectInfo(object):
 
     def __init__(self, frame_id, fps=25, width=None, height=None, label=None,
                  bbox=None, confidence=None, suggest_color=(255, 255, 255),
-                 is_detected=True):
+                 is_detected=True, worker_id=None, seq=None,
+                 detect_time=None):
         self.frame_id = frame_id
         self.fps = fps
         self.width = width
@@ -12,6 +13,11 @@ class DetectInfo(object):
         self.confidence = confidence
         self.suggest_color = suggest_color
         self.is_detected = is_detected
+        # 检测池中产出该结果的检测器编号，以及该检测器内的结果序号
+        self.worker_id = worker_id
+        self.seq = seq
+        # 检测完成时间(perf_counter)，用于统计检测阶段延迟
+        self.detect_time = detect_time
 
     @property
     def center_point(self):
@@ -35,10 +35,14 @@ class WorkerEndReq(WorkerReq):
 
 class VidRecStartReq(WorkerStartReq):
 
-    def __init__(self, tag=""):
+    def __init__(self, tag="", camera=""):
         super().__init__()
         self.raw_tag = tag
-        self.req_tag = f"{get_bj_time_str()}-{tag}"
+        self.camera = camera
+        self.start_time = get_bj_time_str()
+        # 多路相机时文件名带上相机名，避免同时触发的录像重名
+        self.req_tag = (f"{self.start_time}-{camera}-{tag}" if camera
+                        else f"{self.start_time}-{tag}")
         self.rec_filename = f"{self.req_tag}.mp4"
         self.write_filepath = get_cache_filepath(self.rec_filename)
         self.rec_secs = CameraConfig.REC_SECS.value
@@ -1,6 +1,8 @@
 from watchdog.models.audios import AudioPlayMod
-from watchdog.server.api_handlers.watch_handler import WatchStream
+from watchdog.server.api_handlers.watch_handler import (WatchStream,
+                                                        WatchCameraHandler)
 from watchdog.utils.util_router import Route
+from watchdog.utils.util_video import H264EncoderOptions
 from watchdog.services.path_service import get_person_detect_audio_file
 
 
@@ -19,3 +21,91 @@ class PersonWelcome(WatchStream):
             self.q_console.camera.audio_worker.play_audio(
                 get_person_detect_audio_file(),
                 play_mod=AudioPlayMod.FORCE)
+
+
+class DebugHandler(WatchCameraHandler):
+    """调试统计接口，返回 JSON，多路相机时用 camera 参数指定相机"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.work_shop = self.get_request_workshop()
+        self.q_console = self.work_shop.q_console
+
+
+@Route("/debug/latency")
+class StageLatency(DebugHandler):
+    """各阶段从相机读取到完成时的延迟分布, ?reset=1 读取后清零"""
+
+    def get(self):
+        summary = self.q_console.latency_stats.summary()
+        if self.request_data.get("reset"):
+            self.q_console.latency_stats.reset()
+        return summary
+
+
+@Route("/debug/liveStream")
+class LiveStreamStat(DebugHandler):
+    """直播 JPEG 编码次数与推送帧数"""
+
+    def get(self):
+        return self.work_shop.live_stream_stats.to_dict()
+
+
+@Route("/debug/recordEncode")
+class RecordEncode(DebugHandler):
+    """录像编码参数与每帧格式转换/编码耗时分布, ?reset=1 读取后清零"""
+
+    def get(self):
+        cost = self.q_console.record_encode_stats.summary()
+        if self.request_data.get("reset"):
+            self.q_console.record_encode_stats.reset()
+        return dict(options=H264EncoderOptions.from_record_config().to_dict(),
+                    cost=cost)
+
+
+@Route("/debug/detectSchedule")
+class DetectSchedule(DebugHandler):
+    """
+        检测调度: 各优先级(active/viewed/rest)的待检测帧数、等待时长分布、
+        超时丢弃数，以及各路相机当前的优先级, ?reset=1 读取后清零
+    """
+
+    def get(self):
+        detector_pool = self.work_shop.detector_pool
+        stats = detector_pool.schedule_stats()
+        if self.request_data.get("reset"):
+            detector_pool.priority_stats.reset()
+        return stats
+
+
+@Route("/debug/motion")
+class MotionGate(DebugHandler):
+    """运动预过滤(-motion-gate)命中/跳过检测的帧数"""
+
+    def get(self):
+        return self.work_shop.detector_pool.motion_stats()
+
+
+@Route("/debug/frameBus")
+class FrameBusStat(DebugHandler):
+    """帧广播总线(-frame-bus)的最新帧序号与各订阅者读取/丢帧数"""
+
+    def get(self):
+        frame_bus = self.q_console.frame_bus
+        if frame_bus is None:
+            return dict(enabled=False)
+        return dict(enabled=True, **frame_bus.stats())
+
+
+@Route("/debug/fpsController")
+class FpsController(DebugHandler):
+    """自适应帧率(-adaptive-fps)最近一次的采样与决策"""
+
+    def get(self):
+        fps_controller = self.work_shop.fps_controller
+        if fps_controller is None:
+            return dict(enabled=False)
+        min_fps, max_fps = fps_controller.fps_bounds()
+        return dict(enabled=True, fps_limit=fps_controller.fps_limit,
+                    fps_bounds=[min_fps, max_fps],
+                    last_decision=fps_controller.last_decision)
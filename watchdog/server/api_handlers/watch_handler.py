@@ -3,19 +3,21 @@ from typing import *
 import json
 import logging
 import traceback
-from queue import Empty
 
-import cv2
-import numpy as np
-from werkzeug.exceptions import HTTPException
+from werkzeug.exceptions import HTTPException, NotFound
 from flask import make_response, Response, render_template, send_file
 
 from watchdog.utils.util_router import Route
-from watchdog.utils.util_camera import FrameBox
 from watchdog.configs.constants import PathConfig
 from watchdog.services.workshop import WorkShop
+from watchdog.services.live_viewer import LiveViewer
 from watchdog.services.path_service import get_cache_videos
+from watchdog.services.record_catalog import (RecordCatalog,
+                                              get_record_catalog)
+from watchdog.services.record_sidecar import (get_sidecar_filepath,
+                                              read_sidecar)
 from watchdog.server.api_handlers.base_handler import BaseHandler
+from watchdog.server.custom_server import SendfileWrapper
 
 
 @Route("/")
@@ -94,6 +96,7 @@ class WatchDogHandler(WatchDogIndex):
 
 @Route("/echo")
 class WatchCameraHandler(BaseHandler):
+    # 单路相机时以相机地址为键，多路相机时以相机名为键
     WORKSHOP_MAP: Dict[str, WorkShop] = {}
 
     @classmethod
@@ -110,6 +113,17 @@ class WatchCameraHandler(BaseHandler):
 
         return cls.WORKSHOP_MAP.get(camera_address, None)
 
+    def get_request_workshop(self) -> WorkShop:
+        """
+            路径参数 <camera> 或请求参数 camera 指定的相机，不指定时为第一路
+        """
+        camera = ((self.request.view_args or {}).get("camera")
+                  or self.get_argument("camera", None))
+        work_shop = self.get_workshop(camera)
+        if work_shop is None:
+            raise NotFound(f"camera {camera} not exist")
+        return work_shop
+
     def get(self):
         return dict(server="watchdog",
                     version=os.environ.get("VERSION"))
@@ -117,12 +131,22 @@ class WatchCameraHandler(BaseHandler):
 
 @Route("/stream")
 class WatchStream(WatchCameraHandler):
+    """
+        直播流，支持参数 width / quality / max_fps，详见 LiveViewer，
+        多路相机时用 camera 参数或 /stream/<camera> 指定相机
+    """
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.work_shop = self.get_workshop()
+        self.work_shop = self.get_request_workshop()
         self.q_console = self.work_shop.q_console
-        self.last: Optional[FrameBox] = None
+        self.viewer = LiveViewer(
+            self.work_shop,
+            client_id=f"{self.request.remote_addr}-{id(self)}",
+            width=self.get_argument("width", 0, value_processor=int),
+            quality=self.get_argument("quality", LiveViewer.DEFAULT_QUALITY,
+                                      value_processor=int),
+            max_fps=self.get_argument("max_fps", 0, value_processor=float))
 
     @classmethod
     def make_ok_response(cls, view_request_gen):
@@ -131,29 +155,24 @@ class WatchStream(WatchCameraHandler):
             mimetype="multipart/x-mixed-replace; boundary=frame",
         )
 
-    @classmethod
-    def encode(cls, frame: np.ndarray):
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 17]
-        result, jpeg = cv2.imencode('.jpg', frame, encode_param)
-        return jpeg.tobytes()
-
     def get_byte_frame2(self):
-        try:
-            if self.last is None:
-                frame_box = self.work_shop.live_frame
-            else:
-                if not self.last.next_come.wait(timeout=5):
-                    raise Empty
-                frame_box = self.last.next
-            self.last = frame_box
-            return self.encode(frame_box.frame)
-        except Empty:
+        frame_box = self.viewer.next_frame(timeout=5)
+        if frame_box is None:
             return
+        return self.viewer.get_jpeg(frame_box)
 
     def handle_view_request(self):
         """
         :return:
         """
+        self.viewer.open()
+        try:
+            yield from self._view_frames()
+        finally:
+            # 客户端断开后生成器被关闭
+            self.viewer.close()
+
+    def _view_frames(self):
         byte_frame = None
         while True:
             try:
@@ -171,11 +190,56 @@ class WatchStream(WatchCameraHandler):
         return self.handle_view_request()
 
 
+@Route("/stream/<camera>")
+class WatchCameraStream(WatchStream):
+    """多路相机中指定相机的直播流"""
+
+    def get(self, camera):
+        return self.handle_view_request()
+
+
+@Route("/cameras")
+class CameraList(WatchCameraHandler):
+    """所有相机及其当前状态"""
+
+    def get(self):
+        cameras = []
+        for name, work_shop in self.WORKSHOP_MAP.items():
+            q_console = work_shop.q_console
+            cameras.append(dict(
+                name=name,
+                width=q_console.camera.video_width,
+                height=q_console.camera.video_height,
+                fps=q_console.camera.video_fps,
+                active=q_console.monitor_states.is_now_active(),
+                viewing=q_console.cam_viewing()))
+        return cameras
+
+
 @Route("/check_records")
 class RecordHandler(WatchDogHandler):
+    """
+        不带参数时返回全部录像文件名;
+        带 start / end(开始时间范围，格式同录像文件名时间，可只给前缀) /
+        camera / page / page_size 任一参数时，分页返回录像详情
+    """
 
     def get(self):
-        return get_cache_videos()
+        if not any(name in self.request_data
+                   for name in RecordCatalog.QUERY_ARGS):
+            return get_cache_videos()
+
+        page = max(self.get_argument("page", 1, value_processor=int), 1)
+        page_size = self.get_argument(
+            "page_size", RecordCatalog.DEFAULT_PAGE_SIZE,
+            value_processor=int)
+        total, records = get_record_catalog().query(
+            start_time=self.get_argument("start", None),
+            end_time=self.get_argument("end", None),
+            camera=self.get_argument("camera", None),
+            offset=(page - 1) * page_size, limit=page_size)
+        return dict(total=total, page=page, page_size=page_size,
+                    records=records)
 
 
 @Route("/check_video/<video_name>")
@@ -189,4 +253,42 @@ class CheckVideo(WatchDogHandler):
         video_filepath = os.path.join(PathConfig.CACHE_DATAS_PATH, video_name)
         if not os.path.exists(video_filepath):
             raise FileNotFoundError(f"file {video_filepath} not exist")
-        return send_file(video_filepath)
+        # 由 werkzeug 处理 Range(206)/ETag/Last-Modified(304)
+        rsp = send_file(video_filepath, mimetype="video/mp4",
+                        conditional=True, etag=True)
+        if rsp.status_code == 206:
+            offset, count = (rsp.content_range.start,
+                             rsp.content_range.stop - rsp.content_range.start)
+        elif rsp.status_code == 200:
+            offset, count = 0, rsp.content_length
+        else:
+            return rsp
+
+        rsp.headers["Accept-Ranges"] = "bytes"
+        if self.request.method == "HEAD":
+            # 只返回头部，不发送文件内容
+            rsp.close()
+            rsp.response = []
+            return rsp
+
+        if not SendfileWrapper.can_sendfile(self.request.environ):
+            # 由 werkzeug.wsgi.wrap_file(优先使用 wsgi.file_wrapper)发送
+            return rsp
+
+        # 响应体改为零拷贝发送
+        rsp.close()
+        rsp.response = SendfileWrapper(video_filepath, offset, count,
+                                       self.request.environ)
+        rsp.direct_passthrough = True
+        return rsp
+
+
+@Route("/check_detections/<video_name>")
+class CheckDetections(WatchDogHandler):
+    """录像的检测结果旁路文件，仅录制原始画面(-record-raw)时存在"""
+
+    def get(self, video_name):
+        sidecar_filepath = get_sidecar_filepath(os.path.basename(video_name))
+        if not os.path.exists(sidecar_filepath):
+            raise FileNotFoundError(f"file {sidecar_filepath} not exist")
+        return read_sidecar(sidecar_filepath)
@@ -0,0 +1,214 @@
+"""
+    基于 aiohttp 的异步服务 (可选依赖: pip install watchdog[async])
+
+    单个事件循环服务 /stream(/stream/<camera>)、/check_records、/check_video、
+    /check_detections，
+    每个 MJPEG 连接只是一个协程，不再占用一个线程:
+        - 新帧通知来自 WorkShop.live_ring，由生产线程投递到事件循环
+        - JPEG 编码仍在少量线程中完成，同一帧同一规格只编码一次
+"""
+import os
+import asyncio
+import logging
+from typing import *
+from concurrent.futures import ThreadPoolExecutor
+
+from watchdog.configs.constants import PathConfig
+from watchdog.services.workshop import WorkShop, LiveFrameRing
+from watchdog.services.live_viewer import LiveViewer
+from watchdog.services.path_service import get_cache_videos
+from watchdog.services.record_catalog import (RecordCatalog,
+                                              get_record_catalog)
+from watchdog.services.record_sidecar import (get_sidecar_filepath,
+                                              read_sidecar)
+from watchdog.server.custom_server import EnhanceThreadedWSGIServer
+
+try:
+    from aiohttp import web
+except ImportError:
+    web = None
+
+
+class AsyncLiveNotifier(object):
+    """将直播环形缓冲区的新帧通知转到事件循环中"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop,
+                 live_ring: LiveFrameRing):
+        self._loop = loop
+        self._live_ring = live_ring
+        self._event = asyncio.Event()
+        live_ring.add_listener(self._on_push)
+
+    def _on_push(self, generation):
+        # 在生产线程中调用
+        self._loop.call_soon_threadsafe(self._notify)
+
+    def _notify(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait_after(self, generation: Optional[int], timeout=None):
+        """等待代数大于 generation 的帧，超时抛出 asyncio.TimeoutError"""
+        while True:
+            event = self._event
+            if (self._live_ring.generation > 0
+                    and (generation is None
+                         or self._live_ring.generation > generation)):
+                return
+            await asyncio.wait_for(event.wait(), timeout=timeout)
+
+
+class AsyncWatchServer(object):
+    # 编码线程数
+    ENCODE_THREADS = 4
+    # 服务动作(如重启相机)检查间隔
+    SERVICE_ACTION_INTERVAL = 0.5
+
+    def __init__(self, work_shop: WorkShop,
+                 work_shops: Optional[Dict[str, WorkShop]] = None):
+        """
+        :param work_shop: 默认相机
+        :param work_shops: 多路相机 {相机名: WorkShop}
+        """
+        if web is None:
+            raise ImportError("aiohttp is required for the async server, "
+                              "install it by: pip install watchdog[async]")
+        self.work_shop = work_shop
+        self.work_shops = work_shops or {"": work_shop}
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.ENCODE_THREADS,
+            thread_name_prefix="async_stream_encode")
+        self.notifiers: Dict[str, AsyncLiveNotifier] = {}
+
+    def make_app(self) -> "web.Application":
+        app = web.Application()
+        app.router.add_get("/stream", self.stream)
+        app.router.add_get("/stream/{camera}", self.stream)
+        app.router.add_get("/check_records", self.check_records)
+        app.router.add_get("/check_video/{video_name}", self.check_video)
+        app.router.add_get("/check_detections/{video_name}",
+                           self.check_detections)
+        app.on_startup.append(self._on_startup)
+        app.on_cleanup.append(self._on_cleanup)
+        return app
+
+    async def _on_startup(self, app):
+        loop = asyncio.get_running_loop()
+        self.notifiers = {
+            name: AsyncLiveNotifier(loop, work_shop.live_ring)
+            for name, work_shop in self.work_shops.items()}
+        app["service_actions"] = asyncio.create_task(self._service_actions())
+
+    async def _on_cleanup(self, app):
+        app["service_actions"].cancel()
+        self.executor.shutdown(wait=False)
+
+    async def _service_actions(self):
+        """与线程服务一致，在主线程执行 WorkShop 投递的服务动作"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.SERVICE_ACTION_INTERVAL)
+            if EnhanceThreadedWSGIServer.SERVICE_ACTION_QUEUE.qsize() > 0:
+                await loop.run_in_executor(
+                    None, EnhanceThreadedWSGIServer.custom_service_actions)
+
+    @classmethod
+    def _query_number(cls, request: "web.Request", name, default,
+                      value_processor: Callable = int):
+        try:
+            return value_processor(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"Invalid argument: {name}")
+
+    def _request_camera(self, request: "web.Request") -> str:
+        """路径参数或请求参数 camera 指定的相机名，不指定时为默认相机"""
+        camera = (request.match_info.get("camera")
+                  or request.query.get("camera"))
+        if camera is None:
+            return next(name for name, work_shop in self.work_shops.items()
+                        if work_shop is self.work_shop)
+        if camera not in self.work_shops:
+            raise web.HTTPNotFound(text=f"camera {camera} not exist")
+        return camera
+
+    async def stream(self, request: "web.Request"):
+        camera = self._request_camera(request)
+        work_shop = self.work_shops[camera]
+        notifier = self.notifiers[camera]
+        viewer = LiveViewer(
+            work_shop, client_id=f"{request.remote}-{id(request)}",
+            width=self._query_number(request, "width", 0),
+            quality=self._query_number(request, "quality",
+                                       LiveViewer.DEFAULT_QUALITY),
+            max_fps=self._query_number(request, "max_fps", 0, float))
+        response = web.StreamResponse(headers={
+            "Content-Type": "multipart/x-mixed-replace; boundary=frame"})
+        await response.prepare(request)
+
+        loop = asyncio.get_running_loop()
+        viewer.open()
+        try:
+            while True:
+                work_shop.q_console.latest_view_time.update()
+                try:
+                    await notifier.wait_after(viewer.last_generation,
+                                                   timeout=5)
+                except asyncio.TimeoutError:
+                    continue
+                frame_box = viewer.select(*viewer.fetch(timeout=0))
+                if frame_box is None:
+                    continue
+                jpeg = viewer.cached_jpeg(frame_box)
+                if jpeg is None:
+                    jpeg = await loop.run_in_executor(
+                        self.executor, viewer.get_jpeg, frame_box)
+                else:
+                    jpeg = viewer.get_jpeg(frame_box)
+                if jpeg is None:
+                    continue
+                await response.write(
+                    b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n"
+                    + jpeg + b"\r\n\r\n")
+        except ConnectionResetError:
+            pass
+        finally:
+            viewer.close()
+        return response
+
+    async def check_records(self, request: "web.Request"):
+        """参数同 RecordHandler"""
+        if not any(name in request.query
+                   for name in RecordCatalog.QUERY_ARGS):
+            return web.json_response(dict(code=0, status="success",
+                                          data=get_cache_videos()))
+
+        page = max(self._query_number(request, "page", 1), 1)
+        page_size = self._query_number(request, "page_size",
+                                       RecordCatalog.DEFAULT_PAGE_SIZE)
+        total, records = get_record_catalog().query(
+            start_time=request.query.get("start"),
+            end_time=request.query.get("end"),
+            camera=request.query.get("camera"),
+            offset=(page - 1) * page_size, limit=page_size)
+        return web.json_response(dict(code=0, status="success", total=total,
+                                      page=page, page_size=page_size,
+                                      records=records))
+
+    async def check_video(self, request: "web.Request"):
+        video_name = os.path.basename(request.match_info["video_name"])
+        video_filepath = os.path.join(PathConfig.CACHE_DATAS_PATH, video_name)
+        if not os.path.exists(video_filepath):
+            raise web.HTTPNotFound(text=f"file {video_name} not exist")
+        # FileResponse 支持 Range 请求，并通过 sendfile 发送
+        return web.FileResponse(video_filepath)
+
+    async def check_detections(self, request: "web.Request"):
+        sidecar_filepath = get_sidecar_filepath(
+            os.path.basename(request.match_info["video_name"]))
+        if not os.path.exists(sidecar_filepath):
+            raise web.HTTPNotFound(text=f"file {sidecar_filepath} not exist")
+        return web.json_response(read_sidecar(sidecar_filepath))
+
+    def run(self, host="0.0.0.0", port=8000):
+        logging.info(f"[AsyncWatchServer] serving on {host}:{port}")
+        web.run_app(self.make_app(), host=host, port=port, print=None)
@@ -1,5 +1,6 @@
 import logging
 import time
+import socket
 import traceback
 from flask import Flask
 from queue import Queue, Empty
@@ -25,6 +26,56 @@ class CustomFlask(Flask):
         return rsp
 
 
+class SendfileWrapper(object):
+    """
+        WSGI 响应体：通过 socket.sendfile(os.sendfile) 零拷贝发送文件的
+        [offset, offset + count) 部分，拿不到连接 socket 时退化为分块读取
+
+        直接写 socket 会绕过服务器的分块编码与 TLS，只能用于 can_sendfile 的连接，
+        且响应必须带 Content-Length
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    @classmethod
+    def can_sendfile(cls, environ) -> bool:
+        """
+            服务器提供 wsgi.file_wrapper 时由服务器自己发送(如 gunicorn 的 sendfile)，
+            只有 werkzeug 开发服务器的明文连接才直接写 socket
+        """
+        if "wsgi.file_wrapper" in environ:
+            return False
+        sock = environ.get("werkzeug.socket")
+        # ssl.SSLSocket 是 socket.socket 的子类，这里要求类型完全一致
+        return (type(sock) is socket.socket
+                and environ.get("wsgi.url_scheme") == "http")
+
+    def __init__(self, filepath, offset, count, environ):
+        self.filepath = filepath
+        self.offset = offset
+        self.count = count
+        self.environ = environ
+
+    def _read_chunks(self, fp):
+        fp.seek(self.offset)
+        remain = self.count
+        while remain > 0:
+            data = fp.read(min(self.CHUNK_SIZE, remain))
+            if not data:
+                break
+            remain -= len(data)
+            yield data
+
+    def __iter__(self):
+        with open(self.filepath, "rb") as fp:
+            if not self.count or not self.can_sendfile(self.environ):
+                yield from self._read_chunks(fp)
+                return
+            sock = self.environ["werkzeug.socket"]
+            # 空数据触发服务器发送响应头，之后直接往 socket 写文件内容
+            yield b""
+            sock.sendfile(fp, offset=self.offset, count=self.count)
+
+
 class ActionBox(object):
     def __init__(self, action_callback: Callable, args=None, kwargs=None):
         if args is None:
@@ -83,11 +134,12 @@ class EnhanceThreadedWSGIServer(ThreadedWSGIServer):
             logging.warning(f"[Service_action] {action_box.action_name} "
                             f"not end in {timeout} second, pass")
 
-    def custom_service_actions(self):
+    @classmethod
+    def custom_service_actions(cls):
         action_callback = None
-        if self.SERVICE_ACTION_QUEUE.qsize() > 0:
+        if cls.SERVICE_ACTION_QUEUE.qsize() > 0:
             try:
-                ab: ActionBox = self.SERVICE_ACTION_QUEUE.get(timeout=1)
+                ab: ActionBox = cls.SERVICE_ACTION_QUEUE.get(timeout=1)
                 logging.info(f"[Service_action] handling action: "
                              f"{ab.action_name}")
                 ab.raise_if_not_callable()
@@ -99,7 +151,7 @@ class EnhanceThreadedWSGIServer(ThreadedWSGIServer):
                     f"[Service_actions] "
                     f"self._SERVICE_ACTION_QUEUE get empty, "
                     f"may be consumed by other threads? "
-                    f"now qsize: {self.SERVICE_ACTION_QUEUE.qsize()}")
+                    f"now qsize: {cls.SERVICE_ACTION_QUEUE.qsize()}")
             except Exception as exp:
                 raise type(exp)(f"[Service_action][{action_callback}] -{exp}")
 
@@ -0,0 +1,144 @@
+"""
+    自适应帧率：根据实测的检测能力调整相机激活时的帧率
+
+    每 INTERVAL_SECS 秒采样一次检测池:
+        - 检测耗时: 这段时间内每帧平均检测耗时(指数平滑)，换算成检测池每秒能处理的帧数
+        - 队列占用: 待检测帧数、超过最大等待时长被丢弃的帧数
+    有相机处于激活状态时:
+        - 过载(有丢帧 / 待检测帧超过 1 秒的处理量 / 帧率之和超过处理能力)时按比例降低
+        - 有富余(无丢帧、待检测帧很少且处理能力够再加一档)时逐档升高
+    都静止时直接按处理能力估算下次激活的帧率;
+    帧率限制在 [CameraConfig.ADAPTIVE_MIN_FPS, CameraConfig.ACTIVE_FPS] 内，
+    通过 q_console.set_active_fps 生效，每次调整都记录日志
+"""
+import time
+import logging
+import traceback
+from typing import *
+
+from watchdog.configs.constants import CameraConfig
+from watchdog.utils.util_thread import new_thread
+
+if TYPE_CHECKING:
+    from watchdog.services.workers.detect.detector_pool import DetectorPool
+
+
+class AdaptiveFpsController(object):
+    INTERVAL_SECS = 5
+    # 目标利用率，给突发留出余量
+    TARGET_UTILIZATION = 0.8
+    # 过载时的降低比例
+    DECREASE_RATIO = 0.75
+    # 有富余时每次升高的帧率
+    INCREASE_STEP = 1
+    # 检测耗时的平滑系数，越大越看重最近的采样
+    COST_SMOOTHING = 0.3
+
+    def __init__(self, detector_pool: "DetectorPool"):
+        self.detector_pool = detector_pool
+        self.fps_limit = CameraConfig.ACTIVE_FPS.value
+        self._cost_secs: Optional[float] = None
+        self._last_cost = detector_pool.detect_cost()
+        self._last_dropped_num = detector_pool.dropped_num()
+        # 最近一次的采样与决策，用于 /debug/fpsController
+        self.last_decision: Dict = {}
+
+    @classmethod
+    def fps_bounds(cls) -> Tuple[int, int]:
+        max_fps = max(CameraConfig.ACTIVE_FPS.value, 1)
+        return min(max(CameraConfig.ADAPTIVE_MIN_FPS.value, 1), max_fps), \
+            max_fps
+
+    def _sample_cost(self) -> Optional[float]:
+        """每帧平均检测耗时(秒)，这段时间没有检测时沿用之前的值"""
+        secs, frame_num = self.detector_pool.detect_cost()
+        last_secs, last_frame_num = self._last_cost
+        self._last_cost = (secs, frame_num)
+        if frame_num <= last_frame_num:
+            return self._cost_secs
+        cost = (secs - last_secs) / (frame_num - last_frame_num)
+        if self._cost_secs is None:
+            self._cost_secs = cost
+        else:
+            self._cost_secs = (self.COST_SMOOTHING * cost
+                               + (1 - self.COST_SMOOTHING) * self._cost_secs)
+        return self._cost_secs
+
+    def _sample_dropped_num(self) -> int:
+        dropped_num = self.detector_pool.dropped_num()
+        # 统计被清零时不算丢帧
+        delta = max(dropped_num - self._last_dropped_num, 0)
+        self._last_dropped_num = dropped_num
+        return delta
+
+    def decide(self) -> Dict:
+        q_consoles = self.detector_pool.stream_q_consoles.values()
+        cost = self._sample_cost()
+        dropped_num = self._sample_dropped_num()
+        pending_num = self.detector_pool.pending_num()
+        active_num = sum(1 for q_console in q_consoles
+                         if q_console.is_camera_active())
+        demand_fps = sum(q_console.camera.video_fps for q_console in q_consoles)
+        rest_fps = sum(q_console.camera.video_fps for q_console in q_consoles
+                       if not q_console.is_camera_active())
+        decision = dict(cost_ms=None, capacity_fps=None,
+                        demand_fps=demand_fps, pending_num=pending_num,
+                        dropped_num=dropped_num, active_num=active_num,
+                        fps_limit=self.fps_limit, new_fps_limit=self.fps_limit,
+                        reason="hold")
+        if cost is None or cost <= 0:
+            decision["reason"] = "no detection yet"
+            return decision
+
+        capacity = (self.detector_pool.worker_num / cost
+                    * self.TARGET_UTILIZATION)
+        # 静止的相机帧率不变，剩余能力由激活的相机平分
+        share = (capacity - rest_fps) / max(active_num, 1)
+        decision.update(cost_ms=round(cost * 1000, 2),
+                        capacity_fps=round(capacity, 2))
+
+        fps_limit = self.fps_limit
+        if not active_num:
+            fps_limit = int(share)
+            decision["reason"] = "estimate for next activation"
+        elif (dropped_num or pending_num > capacity
+              or demand_fps > capacity):
+            fps_limit = min(int(self.fps_limit * self.DECREASE_RATIO),
+                            int(share))
+            decision["reason"] = "overload"
+        elif (pending_num <= self.detector_pool.worker_num
+              and share >= self.fps_limit + self.INCREASE_STEP):
+            fps_limit = self.fps_limit + self.INCREASE_STEP
+            decision["reason"] = "headroom"
+
+        min_fps, max_fps = self.fps_bounds()
+        decision["new_fps_limit"] = min(max(fps_limit, min_fps), max_fps)
+        return decision
+
+    def step(self) -> Dict:
+        decision = self.decide()
+        self.last_decision = dict(decision, time=time.time())
+        new_fps_limit = decision["new_fps_limit"]
+        if new_fps_limit == self.fps_limit:
+            logging.debug(f"[fps controller] {decision}")
+            return decision
+
+        logging.info(f"[fps controller] active fps {self.fps_limit} -> "
+                     f"{new_fps_limit}, {decision}")
+        self.fps_limit = new_fps_limit
+        for q_console in self.detector_pool.stream_q_consoles.values():
+            q_console.set_active_fps(new_fps_limit, tag="adaptive fps")
+        return decision
+
+    @new_thread
+    def start(self):
+        min_fps, max_fps = self.fps_bounds()
+        logging.info(f"[fps controller] started, active fps bounds: "
+                     f"[{min_fps}, {max_fps}]")
+        while True:
+            time.sleep(self.INTERVAL_SECS)
+            try:
+                self.step()
+            except Exception as exp:
+                logging.error(f"[fps controller] {exp}, "
+                              f"{traceback.format_exc()}")
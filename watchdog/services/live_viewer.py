@@ -0,0 +1,156 @@
+"""
+    直播观看者：规格选择、共享编码、限速与丢帧统计
+
+    线程版 /stream(WatchStream) 与异步服务(async_server) 共用
+"""
+import time
+from typing import *
+from queue import Empty
+
+import numpy as np
+import cv2
+
+from watchdog.configs.constants import FrameStage
+from watchdog.utils.util_camera import FrameBox
+
+if TYPE_CHECKING:
+    from watchdog.services.workshop import WorkShop
+
+
+class LiveViewer(object):
+    """
+        支持参数:
+            width: 输出宽度，按 RENDITION_WIDTHS 向下取档，0 为原始尺寸
+            quality: JPEG 质量，按 RENDITION_QUALITIES 取最接近的档位
+            max_fps: 最大帧率，0 为不限制
+        同一规格(宽度, 质量)的帧只编码一次，所有观看者共享
+    """
+    RENDITION_WIDTHS = (320, 480, 640, 960, 1280)
+    RENDITION_QUALITIES = (10, 17, 30, 50, 70, 90)
+    DEFAULT_QUALITY = 17
+    # 客户端拿到的帧比最新帧落后超过此时间，直接跳到最新帧
+    MAX_LAG_SECS = 0.5
+
+    def __init__(self, work_shop: "WorkShop", client_id: str, width=0,
+                 quality=DEFAULT_QUALITY, max_fps=0):
+        self.work_shop = work_shop
+        self.live_ring = work_shop.live_ring
+        self.stats = work_shop.live_stream_stats
+        self.client_id = client_id
+        self.rendition = self.parse_rendition(width=width, quality=quality)
+        self.send_interval = 1 / max_fps if max_fps > 0 else 0
+        self.next_send_time = 0
+        # 上一次推送的帧在直播环形缓冲区中的代数
+        self.last_generation: Optional[int] = None
+
+    @classmethod
+    def parse_rendition(cls, width=0, quality=DEFAULT_QUALITY) \
+            -> Tuple[int, int]:
+        """将任意参数归到有限的档位上，保证不同客户端能共用同一份编码结果"""
+        if width > 0:
+            width = max([w for w in cls.RENDITION_WIDTHS if w <= width],
+                        default=cls.RENDITION_WIDTHS[0])
+        else:
+            width = 0
+        quality = min(cls.RENDITION_QUALITIES, key=lambda q: abs(q - quality))
+        return width, quality
+
+    @classmethod
+    def encode(cls, frame: np.ndarray, quality=DEFAULT_QUALITY):
+        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+        result, jpeg = cv2.imencode('.jpg', frame, encode_param)
+        return jpeg.tobytes()
+
+    @classmethod
+    def render(cls, frame: np.ndarray, rendition: Tuple[int, int]) -> bytes:
+        width, quality = rendition
+        frame_height, frame_width = frame.shape[:2]
+        if 0 < width < frame_width:
+            height = int(frame_height * width / frame_width)
+            frame = cv2.resize(frame, (width, height),
+                               interpolation=cv2.INTER_AREA)
+        return cls.encode(frame, quality=quality)
+
+    def open(self):
+        self.stats.add_client(self.client_id)
+
+    def close(self):
+        self.stats.remove_client(self.client_id)
+
+    def cached_jpeg(self, frame_box: FrameBox) -> Optional[bytes]:
+        return frame_box.jpeg_renditions.get(self.rendition)
+
+    def get_jpeg(self, frame_box: FrameBox) -> Optional[bytes]:
+        """
+            每帧每种规格只编码一次，缓存在直播帧上，所有观看者共用
+        """
+        jpeg = self.cached_jpeg(frame_box)
+        if jpeg is None:
+            with frame_box.jpeg_lock:
+                jpeg = self.cached_jpeg(frame_box)
+                if jpeg is None:
+                    frame = frame_box.frame
+                    if frame is None:
+                        return None
+                    jpeg = self.render(frame, self.rendition)
+                    frame_box.jpeg_renditions[self.rendition] = jpeg
+                    self.stats.plus_encode()
+                    self.work_shop.q_console.latency_stats.observe(
+                        FrameStage.ENCODE,
+                        (time.perf_counter() - frame_box.frame_ctime) * 1000)
+        self.stats.plus_served()
+        self.stats.plus_client(self.client_id, served_num=1)
+        return jpeg
+
+    def _pace(self) -> bool:
+        """
+            客户端限速：未到发送时间的帧直接跳过(不编码)，不阻塞生成器
+        :return: 是否发送该帧
+        """
+        if not self.send_interval:
+            return True
+        now = time.perf_counter()
+        if now < self.next_send_time:
+            return False
+        # 以发送间隔为步长推进，长时间无帧时不累积欠账
+        self.next_send_time = max(self.next_send_time + self.send_interval,
+                                  now)
+        return True
+
+    def select(self, generation: int,
+               frame_box: FrameBox) -> Optional[FrameBox]:
+        """
+            确定要推送的帧: 落后太多时跳到最新帧，并统计丢帧
+        :return: 需要推送的帧，被限速跳过时返回 None
+        """
+        if self.last_generation is not None:
+            latest_generation, live_frame = self.live_ring.latest()
+            if ((self.cached_jpeg(frame_box) is None
+                 and frame_box.frame is None)
+                    or live_frame.frame_ctime - frame_box.frame_ctime
+                    > self.MAX_LAG_SECS):
+                # 落后太多(帧已归还或延迟过大)，直接跳到最新帧
+                generation, frame_box = latest_generation, live_frame
+            dropped_num = generation - self.last_generation - 1
+            if dropped_num > 0:
+                self.stats.plus_skipped(dropped_num)
+                self.stats.plus_client(self.client_id, dropped_num=dropped_num)
+        self.last_generation = generation
+
+        if not self._pace():
+            self.stats.plus_skipped()
+            self.stats.plus_client(self.client_id, dropped_num=1)
+            return None
+        return frame_box
+
+    def fetch(self, timeout=None) -> Tuple[int, FrameBox]:
+        """阻塞获取下一帧，超时抛出 Empty"""
+        if self.last_generation is None:
+            return self.live_ring.latest(timeout=timeout)
+        return self.live_ring.get_after(self.last_generation, timeout=timeout)
+
+    def next_frame(self, timeout=None) -> Optional[FrameBox]:
+        try:
+            return self.select(*self.fetch(timeout=timeout))
+        except Empty:
+            return None
@@ -1,6 +1,7 @@
 import os
 from watchdog.configs.constants import PathConfig
 from watchdog.utils.util_path import ensure_dir_exist
+from watchdog.services.record_catalog import get_record_catalog
 
 
 def get_hc_sdk_lib_path():
@@ -31,15 +32,18 @@ def get_cache_filepath(filename):
     return os.path.join(get_cache_path(), filename)
 
 
+def get_segment_path(camera=""):
+    """
+        连续录像分段目录，位于录像目录下，不出现在录像列表中，
+        多路相机时每路相机一个子目录
+    """
+    return ensure_dir_exist(os.path.join(get_cache_path(), "segments",
+                                         camera))
+
+
 def get_cache_videos():
-    try:
-        _, _, videos = next(os.walk(PathConfig.CACHE_DATAS_PATH))
-    except StopIteration:
-        return []
-
-    videos = [v for v in videos if v.endswith(".mp4")]
-    videos.sort(key=lambda v: v[:v.rindex("-")], reverse=True)
-    return videos
+    """所有录像文件名，按开始时间倒序，来自录像索引"""
+    return get_record_catalog().filenames()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+"""
+    录像目录索引 (SQLite)
+
+    录像开始/结束时由录像进程增量写入，查询与过期清理都走 start_time 索引，
+    不再每次请求都扫描整个缓存目录；启动时与磁盘做一次对账，补录/剔除不一致的记录
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+from typing import *
+
+from watchdog.configs.constants import PathConfig
+from watchdog.utils.util_path import ensure_dir_exist
+from watchdog.services.camera_sources import CAMERA_NAME_PATTERN
+
+# 录像文件名中的时间长度，格式同 get_bj_time_str: %Y-%m-%d-%H-%M-%S-%f
+RECORD_TIME_LEN = 26
+
+
+class RecordCatalog(object):
+    DB_FILENAME = "record_catalog.db"
+    DEFAULT_PAGE_SIZE = 50
+    # /check_records 的分页查询参数
+    QUERY_ARGS = ("start", "end", "camera", "page", "page_size")
+
+    def __init__(self, db_path=None):
+        if db_path is None:
+            db_path = os.path.join(
+                ensure_dir_exist(PathConfig.PROJECT_CACHE_PATH),
+                self.DB_FILENAME)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=10,
+                                     check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            # 录像进程写、服务进程读，WAL 下读写互不阻塞
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS records (
+                    filename TEXT PRIMARY KEY,
+                    camera TEXT NOT NULL DEFAULT '',
+                    start_time TEXT NOT NULL,
+                    end_time TEXT,
+                    duration REAL NOT NULL DEFAULT 0,
+                    size INTEGER NOT NULL DEFAULT 0,
+                    tag TEXT NOT NULL DEFAULT '',
+                    detect_summary TEXT NOT NULL DEFAULT '{}'
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_start_time "
+                               "ON records (start_time)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_camera_start "
+                               "ON records (camera, start_time)")
+            # 连续录像的分段，事件录像从中剪出
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS segments (
+                    filename TEXT PRIMARY KEY,
+                    camera TEXT NOT NULL DEFAULT '',
+                    start_time TEXT NOT NULL,
+                    end_time TEXT,
+                    duration REAL NOT NULL DEFAULT 0,
+                    size INTEGER NOT NULL DEFAULT 0
+                )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS "
+                               "idx_segment_start ON segments (start_time)")
+
+    @classmethod
+    def parse_filename(cls, filename) -> Tuple[str, str, str]:
+        """
+            录像文件名: 多路相机时为 {start_time}-{camera}-{tag}.mp4，
+            否则为 {start_time}-{tag}.mp4 (录像 tag 中不含 '-')
+        :return: (start_time, camera, tag)
+        """
+        name = filename[:-len(".mp4")] if filename.endswith(".mp4") \
+            else filename
+        start_time, tag = name[:RECORD_TIME_LEN], name[RECORD_TIME_LEN + 1:]
+        camera, sep, camera_tag = tag.partition("-")
+        if sep and CAMERA_NAME_PATTERN.match(camera):
+            return start_time, camera, camera_tag
+        return start_time, "", tag
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        record = dict(row)
+        record["detect_summary"] = json.loads(record["detect_summary"])
+        return record
+
+    def add_record(self, filename, start_time=None, tag=None, camera=None):
+        """录像开始时登记，未给出的字段从文件名中解析"""
+        name_start_time, name_camera, name_tag = self.parse_filename(filename)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO records "
+                "(filename, camera, start_time, tag) VALUES (?, ?, ?, ?)",
+                (filename, name_camera if camera is None else camera,
+                 start_time or name_start_time,
+                 name_tag if tag is None else tag))
+
+    def finish_record(self, filename, end_time, duration, size,
+                      detect_summary: Optional[Dict] = None):
+        """录像结束时补充时长、大小与检测摘要"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE records SET end_time = ?, duration = ?, size = ?, "
+                "detect_summary = ? WHERE filename = ?",
+                (end_time, duration, size,
+                 json.dumps(detect_summary or {}, ensure_ascii=False),
+                 filename))
+
+    def query(self, start_time=None, end_time=None, camera=None, offset=0,
+              limit=DEFAULT_PAGE_SIZE) -> Tuple[int, List[Dict]]:
+        """
+            按开始时间倒序分页查询
+        :param start_time: 包含，格式同文件名时间，可只给前缀，如 2023-05-01
+        :param end_time: 不包含
+        :param camera:
+        :param offset:
+        :param limit: <= 0 时不限制
+        :return: (总数, 当前页)
+        """
+        conditions, params = [], []
+        if start_time:
+            conditions.append("start_time >= ?")
+            params.append(start_time)
+        if end_time:
+            conditions.append("start_time < ?")
+            params.append(end_time)
+        if camera is not None:
+            conditions.append("camera = ?")
+            params.append(camera)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            total = self._conn.execute(
+                f"SELECT COUNT(*) FROM records {where}", params).fetchone()[0]
+            rows = self._conn.execute(
+                f"SELECT * FROM records {where} "
+                f"ORDER BY start_time DESC LIMIT ? OFFSET ?",
+                params + [limit if limit > 0 else -1, max(offset, 0)]
+            ).fetchall()
+        return total, [self._to_dict(row) for row in rows]
+
+    def filenames(self) -> List[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM records ORDER BY start_time DESC"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def delete_before(self, start_time: str) -> List[str]:
+        """删除开始时间早于 start_time 的记录，返回被删除的文件名"""
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                "SELECT filename FROM records WHERE start_time < ?",
+                (start_time,)).fetchall()
+            self._conn.execute("DELETE FROM records WHERE start_time < ?",
+                               (start_time,))
+        return [row[0] for row in rows]
+
+    def add_segment(self, filename, start_time, end_time, duration, size,
+                    camera=""):
+        """分段关闭时登记"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO segments "
+                "(filename, camera, start_time, end_time, duration, size) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (filename, camera, start_time, end_time, duration, size))
+
+    def query_segments(self, start_time=None, end_time=None,
+                       camera=None) -> List[Dict]:
+        """与 [start_time, end_time) 有重叠的分段，按开始时间正序"""
+        conditions, params = [], []
+        if start_time:
+            conditions.append("(end_time IS NULL OR end_time >= ?)")
+            params.append(start_time)
+        if end_time:
+            conditions.append("start_time < ?")
+            params.append(end_time)
+        if camera is not None:
+            conditions.append("camera = ?")
+            params.append(camera)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT * FROM segments {where} ORDER BY start_time",
+                params).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete_segments_before(self, start_time: str,
+                               camera=None) -> List[str]:
+        """删除开始时间早于 start_time 的分段，返回被删除的文件名"""
+        where, params = "WHERE start_time < ?", [start_time]
+        if camera is not None:
+            where += " AND camera = ?"
+            params.append(camera)
+        with self._lock, self._conn:
+            rows = self._conn.execute(
+                f"SELECT filename FROM segments {where}", params).fetchall()
+            self._conn.execute(f"DELETE FROM segments {where}", params)
+        return [row[0] for row in rows]
+
+    def _repair_cameras(self) -> int:
+        """早期补录的多路相机录像 camera 为空，从文件名中重新解析"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename FROM records WHERE camera = ''").fetchall()
+        repaired = []
+        for row in rows:
+            _, camera, tag = self.parse_filename(row[0])
+            if camera:
+                repaired.append((camera, tag, row[0]))
+        if repaired:
+            with self._lock, self._conn:
+                self._conn.executemany(
+                    "UPDATE records SET camera = ?, tag = ? "
+                    "WHERE filename = ?", repaired)
+        return len(repaired)
+
+    def remove(self, filename):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM records WHERE filename = ?",
+                               (filename,))
+
+    def sync_dir(self, dir_path=None) -> Tuple[int, int]:
+        """
+            与录像目录对账：补录目录中未登记的录像，剔除文件已不存在的记录
+        :return: (补录数, 剔除数)
+        """
+        if dir_path is None:
+            dir_path = PathConfig.CACHE_DATAS_PATH
+        try:
+            _, _, files = next(os.walk(dir_path))
+        except StopIteration:
+            files = []
+        on_disk = {f for f in files if f.endswith(".mp4")}
+        indexed = set(self.filenames())
+
+        added = on_disk - indexed
+        for filename in added:
+            filepath = os.path.join(dir_path, filename)
+            self.add_record(filename)
+            self.finish_record(filename, end_time=None, duration=0,
+                               size=os.path.getsize(filepath))
+        removed = indexed - on_disk
+        for filename in removed:
+            self.remove(filename)
+        repaired_num = self._repair_cameras()
+        if added or removed or repaired_num:
+            logging.info(f"[RecordCatalog] synced with {dir_path}, "
+                         f"added: {len(added)}, removed: {len(removed)}, "
+                         f"repaired: {repaired_num}")
+        return len(added), len(removed)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+_CATALOGS: Dict[int, RecordCatalog] = {}
+
+
+def get_record_catalog() -> RecordCatalog:
+    """每个进程各自持有连接，SQLite 连接不能跨 fork 使用"""
+    pid = os.getpid()
+    if pid not in _CATALOGS:
+        _CATALOGS[pid] = RecordCatalog()
+    return _CATALOGS[pid]
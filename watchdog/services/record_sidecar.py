@@ -0,0 +1,89 @@
+"""
+    录像检测结果旁路文件 (JSONL)
+
+    录制原始画面(RecordConfig.RAW_FRAMES)时，检测框不再画进录像，
+    而是逐帧写入与录像同名的 .detections.jsonl，由网页播放器叠加绘制:
+        第一行为文件头: {"version": 1, "width": 1280, "height": 720}
+        之后每帧一行:   {"t": 1.24, "d": [[label, confidence, x, y, w, h], ...]}
+    t 为该帧在录像中的时间(秒)，坐标为录像画面上的像素坐标
+"""
+import os
+import json
+from typing import *
+from collections import deque
+
+from watchdog.configs.constants import PathConfig
+
+SIDECAR_SUFFIX = ".detections.jsonl"
+SIDECAR_VERSION = 1
+
+
+def get_sidecar_filename(rec_filename) -> str:
+    name = rec_filename[:-len(".mp4")] if rec_filename.endswith(".mp4") \
+        else rec_filename
+    return f"{name}{SIDECAR_SUFFIX}"
+
+
+def get_sidecar_filepath(rec_filename) -> str:
+    return os.path.join(PathConfig.CACHE_DATAS_PATH,
+                        get_sidecar_filename(rec_filename))
+
+
+def read_sidecar(filepath) -> Dict:
+    """读取旁路文件，返回 {"version", "width", "height", "frames": [...]}"""
+    with open(filepath, "r") as fp:
+        header = json.loads(fp.readline() or "{}")
+        header["frames"] = [json.loads(line) for line in fp if line.strip()]
+    return header
+
+
+class DetectionSidecar(object):
+    """
+        缓存录像期间(以及触发前预录时长内)每帧的检测结果，
+        录像结束、视频起始时间确定后一次性写出
+    """
+
+    def __init__(self):
+        # [(采集时间, [[label, confidence, x, y, w, h], ...]), ...]
+        self._entries: Deque[Tuple[float, List[List]]] = deque()
+        self.frame_size: Optional[Tuple[int, int]] = None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, frame_time: float, detections: List[List],
+            frame_size: Tuple[int, int]):
+        self.frame_size = frame_size
+        self._entries.append((frame_time, detections))
+
+    def trim(self, keep_secs: float):
+        """只保留最近 keep_secs 秒，用于未录像时的预录"""
+        if not self._entries:
+            return
+        latest_time = self._entries[-1][0]
+        while self._entries and latest_time - self._entries[0][0] > keep_secs:
+            self._entries.popleft()
+
+    def clear(self):
+        self._entries.clear()
+
+    def write(self, filepath, video_start_time: float) -> int:
+        """
+        :param filepath:
+        :param video_start_time: 录像第一帧的采集时间，早于它的结果被丢弃
+        :return: 写入的帧数
+        """
+        frame_num = 0
+        width, height = self.frame_size or (0, 0)
+        with open(filepath, "w") as fp:
+            fp.write(json.dumps(dict(version=SIDECAR_VERSION, width=width,
+                                     height=height)) + "\n")
+            for frame_time, detections in self._entries:
+                t = frame_time - video_start_time
+                if t < 0:
+                    continue
+                fp.write(json.dumps(dict(t=round(t, 3), d=detections),
+                                    ensure_ascii=False) + "\n")
+                frame_num += 1
+        self.clear()
+        return frame_num
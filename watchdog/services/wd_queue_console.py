@@ -7,10 +7,13 @@ from multiprocessing.synchronize import Event as MEvent
 import cv2
 
 from watchdog.configs.constants import (CarMonitorState, PersonMonitorState,
-                                        CameraConfig)
+                                        CameraConfig, VideoEncodeStage)
 
 from watchdog.utils.util_multiprocess.queue import FastQueue
+from watchdog.utils.util_multiprocess.frame_bus import (FrameBus,
+                                                       FrameBusSubscriber)
 from watchdog.utils.util_camera import MultiprocessCamera, FrameBox
+from watchdog.utils.util_latency import StageLatencyStats
 from watchdog.utils.util_multiprocess.queue_console import QueueConsole
 from watchdog.models.worker_req import WorkerEndReq, VidRecStartReq
 
@@ -53,7 +56,8 @@ class WdQueueConsole(QueueConsole):
 
     def __init__(self, camera: "MultiprocessCamera",
                  global_worker_task: Optional["MultiShareObject"] = None,
-                 console_id: str = "", detect_worker_num=1):
+                 console_id: str = "", detect_worker_num=1,
+                 camera_name: str = ""):
         if global_worker_task is None:
             global_worker_task = mp.Manager().TaskInfo(task_name="")
         super().__init__(global_worker_task=global_worker_task,
@@ -63,6 +67,12 @@ class WdQueueConsole(QueueConsole):
 
         # 相机对象
         self.camera = camera
+        # 多路相机时的相机名, 用于区分录像, 单路相机时为空
+        self.camera_name = camera_name
+
+        # 帧广播总线，为 None 时由 FrameDistributor 分发帧
+        self.frame_bus: Optional[FrameBus] = (
+            camera.frame_bus if camera is not None else None)
 
         # 相机重启信号
         self.camera_restart_sig: MEvent = mp.Event()
@@ -99,6 +109,29 @@ class WdQueueConsole(QueueConsole):
 
         self._cam_adj_value = mp.Value("i", 0)
         self._cam_adj_lock = mp.Lock()
+        # 激活时的帧率，默认为 CameraConfig.ACTIVE_FPS，启用自适应帧率时
+        # 由 AdaptiveFpsController 在 [ADAPTIVE_MIN_FPS, ACTIVE_FPS] 内调整
+        self.active_fps = mp.Value("i", CameraConfig.ACTIVE_FPS.value)
+
+        # 各阶段延迟统计，用于 /debug/latency
+        self.latency_stats = StageLatencyStats()
+        # 录像每帧格式转换与编码耗时
+        self.record_encode_stats = StageLatencyStats(
+            stages=VideoEncodeStage.ORDERED)
+
+    def subscribe_frames(self, name, policy=FrameBus.POLICY_SEQUENTIAL,
+                         reuse_buffer=False,
+                         partition: Optional[Tuple[int, int]] = None
+                         ) -> Optional[FrameBusSubscriber]:
+        """
+            订阅相机帧, 未启用帧广播总线时返回 None
+        """
+        if self.frame_bus is None:
+            return None
+        return self.frame_bus.subscribe(name, policy=policy,
+                                        reuse_buffer=reuse_buffer,
+                                        item_factory=FrameBox.from_bus_item,
+                                        partition=partition)
 
     def cam_viewing(self):
         return self.latest_view_time.is_live()
@@ -109,11 +142,11 @@ class WdQueueConsole(QueueConsole):
             logging.info(
                 f"[camera adjust][active camera][{tag}]: "
                 f"self._cam_adj_value.value: {self._cam_adj_value.value}, "
-                f"request adjust fsp: {CameraConfig.ACTIVE_FPS.value}, "
+                f"request adjust fsp: {self.active_fps.value}, "
                 f"(only execute adjust when self._cam_adj_value.value == 1, "
                 f"prevent multi adjust)")
             if self._cam_adj_value.value == 1:
-                self.camera.adjust_camera_fps(CameraConfig.ACTIVE_FPS.value)
+                self.camera.adjust_camera_fps(self.active_fps.value)
 
     def rest_camera(self, tag=""):
         with self._cam_adj_lock:
@@ -127,6 +160,18 @@ class WdQueueConsole(QueueConsole):
             if self._cam_adj_value.value == 0:
                 self.camera.adjust_camera_fps(CameraConfig.REST_FPS.value)
 
+    def is_camera_active(self):
+        return self._cam_adj_value.value > 0
+
+    def set_active_fps(self, fps, tag=""):
+        """调整激活时的帧率，相机正处于激活状态时立即生效"""
+        with self._cam_adj_lock:
+            self.active_fps.value = fps
+            if self._cam_adj_value.value > 0:
+                logging.info(f"[camera adjust][active fps][{tag}]: "
+                             f"request adjust fsp: {fps}")
+                self.camera.adjust_camera_fps(fps)
+
     def restart_camera(self, proxy=True):
         if not proxy:
             self.camera.restart()
@@ -139,7 +184,8 @@ class WdQueueConsole(QueueConsole):
             发送开始信号给录制器, 如果录制已开始, 则录制器会根据规则, 增加录制时间
         """
         print("start recording")
-        self.recorder_req_queue.put(VidRecStartReq(tag=tag))
+        self.recorder_req_queue.put(VidRecStartReq(tag=tag,
+                                                   camera=self.camera_name))
 
     def stop_vid_record(self):
         """
@@ -152,7 +198,10 @@ class WdQueueConsole(QueueConsole):
     def init_default(cls, console_id="console_id", camera_address=None,
                      fps=None, video_width=None,
                      video_height=None,
-                     detect_worker_num=1) -> "WdQueueConsole":
+                     detect_worker_num=1,
+                     use_frame_bus=False, camera_name="",
+                     global_worker_task: Optional["MultiShareObject"] = None
+                     ) -> "WdQueueConsole":
         if camera_address is None:
             camera_address = 0
 
@@ -169,10 +218,17 @@ class WdQueueConsole(QueueConsole):
             set_params[cv2.CAP_PROP_FRAME_HEIGHT] = video_height
 
         test_camera = MultiprocessCamera(camera_address, set_params=set_params)
+        if use_frame_bus:
+            # 需在相机进程启动前创建
+            test_camera.frame_bus = FrameBus(
+                name=f"camera_frame_bus-{camera_name}" if camera_name
+                else "camera_frame_bus")
         test_camera.start()
         print(f"inited default q_console")
         return WdQueueConsole(camera=test_camera,
-                              detect_worker_num=detect_worker_num)
+                              global_worker_task=global_worker_task,
+                              detect_worker_num=detect_worker_num,
+                              camera_name=camera_name)
 
 
 if __name__ == "__main__":
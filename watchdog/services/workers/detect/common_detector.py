@@ -1,42 +1,329 @@
+import os
+import copy
+import time
 from typing import *
+import multiprocessing as mp
 
+import cv2
+
+from watchdog.configs.constants import (DetectConfig, MotionConfig,
+                                        DetectPriority)
 from watchdog.utils.util_camera import FrameBox
 from watchdog.ai.yolo_detector import YoloDetector
+from watchdog.ai.motion_filter import MotionFilter
 from watchdog.models.detect_info import DetectInfo
+from watchdog.services.sensors import PersonSensor, CarSensor
 from watchdog.models.worker_req import WorkerEndReq, WorkerStartReq
 from watchdog.services.base.wd_base_worker import WDBaseWorker
+from watchdog.services.wd_queue_console import WdQueueConsole
+from watchdog.services.workers.detect.detect_scheduler import (
+    FpsWeightedRoundRobin, DetectPriorityStats, detect_priority, max_age_ms)
+
+
+class DetectStream(object):
+    """检测器消费的一路相机帧，以及这一路的运动预过滤状态"""
+
+    def __init__(self, name: str, q_console: WdQueueConsole, worker_id=0):
+        self.name = name
+        self.q_console = q_console
+        self.frame_box_queue = q_console.frame4common_detect_queue
+        # 启用帧广播总线时直接订阅相机帧，逐帧检测时检测完即丢弃，可复用缓冲区，
+        # 多个检测器按帧序号分摊
+        self.frame_sub = q_console.subscribe_frames(
+            f"common_detector-{worker_id}",
+            reuse_buffer=DetectConfig.BATCH_SIZE.value <= 1,
+            partition=(worker_id, q_console.detect_worker_num.value))
+        # 运动预过滤，静止画面复用上一次的检测结果
+        self.motion_filter: Optional[MotionFilter] = None
+        self.last_d_infos: List[DetectInfo] = []
+
+    @property
+    def fps(self) -> int:
+        return max(1, self.q_console.camera.video_fps)
+
+    @property
+    def priority(self) -> str:
+        return detect_priority(self.q_console)
+
+    def pending_num(self) -> int:
+        if self.frame_sub is not None:
+            return self.frame_sub.pending_num()
+        return self.frame_box_queue.qsize()
 
 
 class CommonDetector(WDBaseWorker):
-    def __sub_init__(self, **kwargs):
+    """
+        目标检测进程；传入 q_consoles 时为多路相机共用的检测器，
+        按优先级(active > viewed > rest)取帧，同一优先级内按帧率加权轮询，
+        结果放回对应相机的队列；
+        等待超过其优先级最大等待时长的帧不再推理，沿用上一次的结果给标注器
+    """
+    # 多路相机时，各路都没有帧的轮询间隔
+    STREAM_POLL_SECS = 0.005
+
+    def __sub_init__(self, worker_id=0,
+                     q_consoles: Optional[Dict[str, WdQueueConsole]] = None,
+                     priority_stats: Optional[DetectPriorityStats] = None,
+                     **kwargs):
         self.detector: Optional[YoloDetector] = None
-        self.frame_box_queue = self.q_console.frame4common_detect_queue
+        # 检测池中的编号，多个检测器共同消费同一路帧
+        self.worker_id = worker_id
+        # 本检测器产出结果的序号
+        self._detect_seq = 0
+        if q_consoles is None:
+            q_consoles = {self.q_console.camera_name: self.q_console}
+        self.streams: Dict[str, DetectStream] = {
+            name: DetectStream(name, q_console, worker_id=worker_id)
+            for name, q_console in q_consoles.items()}
+        self.stream_scheduler = FpsWeightedRoundRobin(self.streams)
+        # 各优先级的待检测帧数、等待时长与丢弃数，检测池内共用
+        self.priority_stats = priority_stats
+        if self.priority_stats is None:
+            self.priority_stats = DetectPriorityStats()
+        # 运动预过滤命中(需推理)/跳过次数
+        self.motion_hit_num = mp.Value("Q", 0)
+        self.motion_skip_num = mp.Value("Q", 0)
+        # 累计检测耗时(秒)与帧数，用于估算检测池的处理能力
+        self.detect_secs = mp.Value("d", 0)
+        self.detect_frame_num = mp.Value("Q", 0)
 
     def _sub_work_before_cleaned_up(self, work_req):
         pass
 
     def _sub_init_work(self, work_req):
         if self.detector is None:
+            worker_num = self.q_console.detect_worker_num.value
+            if worker_num > 1:
+                # 多个检测进程平分 CPU，避免推理线程争抢
+                cv2.setNumThreads(max(1, os.cpu_count() // worker_num))
             self.detector = YoloDetector()
+        for stream in self.streams.values():
+            if stream.motion_filter is None and MotionConfig.ENABLE.value:
+                stream.motion_filter = MotionFilter()
 
-    def _handle_start_req(self, work_req: WorkerStartReq) -> bool:
-        frame_box: FrameBox = self.get_queue_item(self.frame_box_queue,
-                                                  timeout=5, wait_item=True)
-        if frame_box is None:
-            return False
-
-        d_infos = self.detector.detect(frame_box)
+    def _get_frame_box(self, stream: DetectStream,
+                       timeout) -> Optional[FrameBox]:
+        if stream.frame_sub is not None:
+            return stream.frame_sub.get(timeout=timeout)
+        return self.get_queue_item(stream.frame_box_queue, timeout=timeout,
+                                   wait_item=True, lease=True)
 
+    def _skip_stale(self, stream: DetectStream, frame_box: FrameBox):
+        """
+            超时的帧不推理，沿用上一次的检测结果，只发给标注器，
+            标注器不必等待这一帧的结果，监控器只根据真实的检测结果判断
+        """
+        frame_box.release()
+        d_infos = self._restamp(stream.last_d_infos, frame_box)
         if not d_infos:
             d_infos.append(DetectInfo(frame_box.frame_id, fps=frame_box.fps,
                                       is_detected=False))
-
-        self.put_queue_item(self.q_console.detect_infos_queue, d_infos,
+        self._stamp(d_infos)
+        self.put_queue_item(stream.q_console.detect_infos_queue, d_infos,
                             force_put=True)
-        self.put_queue_item(self.q_console.detect_infos_sense_queue,
-                            d_infos, force_put=True)
 
-        self.plus_working_handled_num()
+    def _take_frame_box(self, stream: DetectStream, priority: str,
+                        timeout) -> Optional[FrameBox]:
+        """取一帧，等待超过优先级最大等待时长的帧丢弃，继续取下一帧"""
+        deadline = time.perf_counter() + timeout
+        while True:
+            frame_box = self._get_frame_box(
+                stream, timeout=max(deadline - time.perf_counter(), 0))
+            if frame_box is None:
+                return None
+            wait_ms = (time.perf_counter() - frame_box.frame_ctime) * 1000
+            age_limit_ms = max_age_ms(priority)
+            if age_limit_ms and wait_ms > age_limit_ms:
+                self.priority_stats.plus_dropped(priority)
+                self._skip_stale(stream, frame_box)
+                continue
+            self.priority_stats.plus_served(priority, wait_ms)
+            return frame_box
+
+    def _group_streams(self) -> List[Tuple[str, List[DetectStream]]]:
+        """按优先级从高到低分组，同时更新各优先级的待检测帧数"""
+        groups: Dict[str, List[DetectStream]] = {
+            priority: [] for priority in DetectPriority.ORDERED}
+        for stream in self.streams.values():
+            groups[stream.priority].append(stream)
+        for priority, streams in groups.items():
+            self.priority_stats.set_depth(
+                priority, sum(stream.pending_num() for stream in streams))
+        return [(priority, streams) for priority, streams in groups.items()
+                if streams]
+
+    def _get_stream_frame_box(self, timeout) \
+            -> Tuple[Optional[DetectStream], Optional[FrameBox], str]:
+        """
+            多路相机时按优先级从高到低，同一优先级内按帧率加权轮询，
+            取到第一个有帧的一路
+        :return: (stream, frame_box, priority)
+        """
+        if len(self.streams) == 1:
+            (priority, (stream,)), = self._group_streams()
+            return (stream,
+                    self._take_frame_box(stream, priority, timeout=timeout),
+                    priority)
+
+        deadline = time.perf_counter() + timeout
+        while True:
+            for priority, streams in self._group_streams():
+                weights = {stream.name: stream.fps for stream in streams}
+                idle_names = []
+                for name in self.stream_scheduler.schedule(weights):
+                    stream = self.streams[name]
+                    frame_box = self._take_frame_box(stream, priority,
+                                                     timeout=0)
+                    if frame_box is not None:
+                        self.stream_scheduler.settle(weights, name,
+                                                     idle_names)
+                        return stream, frame_box, priority
+                    idle_names.append(name)
+                self.stream_scheduler.settle(weights, None, idle_names)
+            if time.perf_counter() >= deadline:
+                return None, None, DetectPriority.REST
+            time.sleep(self.STREAM_POLL_SECS)
+
+    def _get_frame_boxes(self) -> Tuple[Optional[DetectStream],
+                                        List[FrameBox]]:
+        """
+            批量模式下，拿到第一帧后，继续攒同一路的帧，
+            直到攒够 BATCH_SIZE 帧或等待超过 BATCH_WAIT_MS
+        """
+        stream, frame_box, priority = self._get_stream_frame_box(timeout=5)
+        if frame_box is None:
+            return None, []
+
+        frame_boxes = [frame_box]
+        batch_size = DetectConfig.BATCH_SIZE.value
+        deadline = (time.perf_counter()
+                    + DetectConfig.BATCH_WAIT_MS.value / 1000)
+        while len(frame_boxes) < batch_size:
+            remain = deadline - time.perf_counter()
+            if remain <= 0:
+                break
+            frame_box = self._take_frame_box(stream, priority, timeout=remain)
+            if frame_box is None:
+                break
+            frame_boxes.append(frame_box)
+        return stream, frame_boxes
+
+    @classmethod
+    def _motion_roi(cls, stream: DetectStream):
+        roi = tuple(MotionConfig.ROI[:])
+        if any(roi):
+            return roi
+        return stream.q_console.camera.center_box
+
+    @classmethod
+    def _restamp(cls, d_infos: List[DetectInfo],
+                 frame_box: FrameBox) -> List[DetectInfo]:
+        restamped = []
+        for d_info in d_infos:
+            d_info = copy.copy(d_info)
+            d_info.frame_id = frame_box.frame_id
+            d_info.fps = frame_box.fps
+            restamped.append(d_info)
+        return restamped
+
+    @classmethod
+    def _inference_roi(cls, stream: DetectStream, frame_box: FrameBox) \
+            -> Optional[Tuple[int, int, int, int]]:
+        """
+            所有感应器关注区域的并集，向外扩 ROI_MARGIN，
+            目标中心在区域内、但身体超出区域的情况也能完整检测到
+        """
+        if not DetectConfig.ROI_INFERENCE.value:
+            return None
+        areas = [stream.q_console.camera.center_box]
+        areas.extend(sensor.TARGET_AREA for sensor in (PersonSensor, CarSensor)
+                     if any(sensor.TARGET_AREA))
+        x1 = min(x for x, _, _, _ in areas)
+        y1 = min(y for _, y, _, _ in areas)
+        x2 = max(x + w for x, _, w, _ in areas)
+        y2 = max(y + h for _, y, _, h in areas)
+
+        margin = DetectConfig.ROI_MARGIN.value
+        width, height = frame_box.frame_size()
+        mx, my = int((x2 - x1) * margin), int((y2 - y1) * margin)
+        x1, y1 = max(0, x1 - mx), max(0, y1 - my)
+        x2, y2 = min(width, x2 + mx), min(height, y2 + my)
+        if x2 <= x1 or y2 <= y1 or (x2 - x1, y2 - y1) == (width, height):
+            return None
+        return x1, y1, x2 - x1, y2 - y1
+
+    def _detect(self, stream: DetectStream,
+                frame_boxes: List[FrameBox]) -> List[List[DetectInfo]]:
+        roi = self._inference_roi(stream, frame_boxes[0])
+        if stream.motion_filter is None:
+            batch_d_infos = self.detector.detect_batch(frame_boxes, roi=roi)
+            stream.last_d_infos = batch_d_infos[-1]
+            return batch_d_infos
+
+        motion_roi = self._motion_roi(stream)
+        motions = [stream.motion_filter.has_motion(frame_box.frame,
+                                                   motion_roi)
+                   for frame_box in frame_boxes]
+        motion_d_infos = iter(self.detector.detect_batch(
+            [frame_box for frame_box, motion in zip(frame_boxes, motions)
+             if motion], roi=roi))
+
+        batch_d_infos = []
+        for frame_box, motion in zip(frame_boxes, motions):
+            if motion:
+                self.motion_hit_num.value += 1
+                stream.last_d_infos = next(motion_d_infos)
+                batch_d_infos.append(stream.last_d_infos)
+            else:
+                # 静止画面，沿用上一次的检测结果
+                self.motion_skip_num.value += 1
+                batch_d_infos.append(
+                    self._restamp(stream.last_d_infos, frame_box))
+        return batch_d_infos
+
+    def motion_stats(self) -> Dict:
+        return {
+            "hit_num": self.motion_hit_num.value,
+            "skip_num": self.motion_skip_num.value,
+        }
+
+    def _stamp(self, d_infos: List[DetectInfo]):
+        self._detect_seq += 1
+        detect_time = time.perf_counter()
+        for d_info in d_infos:
+            d_info.worker_id = self.worker_id
+            d_info.seq = self._detect_seq
+            d_info.detect_time = detect_time
+
+    def _handle_start_req(self, work_req: WorkerStartReq) -> bool:
+        stream, frame_boxes = self._get_frame_boxes()
+        if not frame_boxes:
+            return False
+
+        # 租借模式，直接在共享内存上检测，检测完立即归还
+        start = time.perf_counter()
+        try:
+            batch_d_infos = self._detect(stream, frame_boxes)
+        finally:
+            for frame_box in frame_boxes:
+                frame_box.release()
+        with self.detect_secs.get_lock():
+            self.detect_secs.value += time.perf_counter() - start
+            self.detect_frame_num.value += len(frame_boxes)
+
+        for frame_box, d_infos in zip(frame_boxes, batch_d_infos):
+            if not d_infos:
+                d_infos.append(DetectInfo(frame_box.frame_id,
+                                          fps=frame_box.fps,
+                                          is_detected=False))
+            self._stamp(d_infos)
+
+            self.put_queue_item(stream.q_console.detect_infos_queue, d_infos,
+                                force_put=True)
+            self.put_queue_item(stream.q_console.detect_infos_sense_queue,
+                                d_infos, force_put=True)
+
+            self.plus_working_handled_num()
         return False
 
     def _handle_end_req(self, work_req: WorkerEndReq) -> bool:
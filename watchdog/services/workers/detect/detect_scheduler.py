@@ -0,0 +1,118 @@
+"""
+    检测器在各路相机帧之间的调度:
+        - 按优先级 active > viewed > rest 取帧，同一优先级内按帧率加权轮询
+        - 帧等待超过其优先级的最大等待时长(DetectConfig.MAX_AGE_MS)时直接丢弃
+"""
+import multiprocessing as mp
+from typing import *
+
+from watchdog.configs.constants import DetectConfig, DetectPriority
+from watchdog.utils.util_latency import StageLatencyStats
+
+if TYPE_CHECKING:
+    from watchdog.services.wd_queue_console import WdQueueConsole
+
+
+def detect_priority(q_console: "WdQueueConsole") -> str:
+    if q_console.monitor_states.is_now_active():
+        return DetectPriority.ACTIVE
+    if q_console.cam_viewing():
+        return DetectPriority.VIEWED
+    return DetectPriority.REST
+
+
+def max_age_ms(priority: str) -> int:
+    """0 为不丢弃"""
+    return DetectConfig.MAX_AGE_MS[DetectPriority.ORDERED.index(priority)]
+
+
+class FpsWeightedRoundRobin(object):
+    """
+        平滑加权轮询(同 nginx upstream)，权重为各路相机当前帧率:
+            - 每轮各路 current 加上自身权重，按 current 从大到小依次尝试取帧
+            - 取到帧的一路 current 减去本轮参与(有帧)各路的权重总和
+        帧率高的相机按比例多分到检测，但不会连续独占检测器；
+        暂时没有帧的相机不累积额度，来帧后不会突发抢占其他相机
+    """
+
+    def __init__(self, names: Iterable[str]):
+        self._current: Dict[str, float] = {name: 0 for name in names}
+
+    def schedule(self, weights: Dict[str, float]) -> List[str]:
+        """本轮参与(weights 中)各路尝试取帧的顺序"""
+        for name, weight in weights.items():
+            self._current[name] += weight
+        return sorted(weights, key=lambda name: self._current[name],
+                      reverse=True)
+
+    def settle(self, weights: Dict[str, float], served: Optional[str],
+               idle_names: Iterable[str] = ()):
+        """
+        :param weights: 与 schedule 相同的权重
+        :param served: 本轮取到帧的一路，都没有帧时为 None
+        :param idle_names: 本轮尝试过但没有帧的各路
+        """
+        idle_names = list(idle_names)
+        # 没有帧的不参与本轮，退回本轮加上的权重，且不保留之前的额度
+        for name in idle_names:
+            self._current[name] = min(self._current[name] - weights[name], 0)
+        if served is not None:
+            self._current[served] -= (sum(weights.values())
+                                      - sum(weights[n] for n in idle_names))
+
+    def to_dict(self) -> Dict[str, float]:
+        return dict(self._current)
+
+
+class DetectPriorityStats(object):
+    """
+        各优先级的调度统计，存放在共享内存中，检测进程写入，主进程读取:
+            depth: 最近一次调度时该优先级各路相机待检测的帧数
+            wait: 帧从相机读取到被检测器取走的时长分布
+            served_num / dropped_num: 检测 / 超时丢弃的帧数
+    """
+
+    def __init__(self):
+        self.priorities = DetectPriority.ORDERED
+        self.wait_stats = StageLatencyStats(stages=self.priorities)
+        self._depths = mp.Array("i", len(self.priorities))
+        self._served_nums = mp.Array("Q", len(self.priorities))
+        self._dropped_nums = mp.Array("Q", len(self.priorities))
+
+    def set_depth(self, priority: str, depth: int):
+        self._depths[self.priorities.index(priority)] = depth
+
+    def plus_served(self, priority: str, wait_ms: float):
+        self.wait_stats.observe(priority, wait_ms)
+        with self._served_nums.get_lock():
+            self._served_nums[self.priorities.index(priority)] += 1
+
+    def plus_dropped(self, priority: str):
+        with self._dropped_nums.get_lock():
+            self._dropped_nums[self.priorities.index(priority)] += 1
+
+    def summary(self) -> Dict:
+        wait_summary = self.wait_stats.summary()
+        summary = {}
+        for index, priority in enumerate(self.priorities):
+            served_num = self._served_nums[index]
+            dropped_num = self._dropped_nums[index]
+            total = served_num + dropped_num
+            summary[priority] = {
+                "depth": self._depths[index],
+                "served_num": served_num,
+                "dropped_num": dropped_num,
+                "drop_ratio": round(dropped_num / total, 4) if total else 0,
+                "max_age_ms": max_age_ms(priority),
+                "wait": wait_summary.get(priority, {}),
+            }
+        return summary
+
+    def reset(self):
+        self.wait_stats.reset()
+        with self._served_nums.get_lock():
+            for index in range(len(self.priorities)):
+                self._served_nums[index] = 0
+        with self._dropped_nums.get_lock():
+            for index in range(len(self.priorities)):
+                self._dropped_nums[index] = 0
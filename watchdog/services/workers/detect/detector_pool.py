@@ -0,0 +1,130 @@
+"""
+    检测池：启动多个 CommonDetector 进程共同消费同一路帧，
+    检测结果带上 worker_id / seq，下游丢弃迟到的旧结果，保证 frame_id 递增
+
+    多路相机时所有相机共用一个检测池，每个检测进程按帧率加权轮询各路相机，
+    模型只在检测进程中加载，数量与相机数无关
+"""
+from typing import *
+
+from watchdog.configs.constants import MotionConfig
+from watchdog.ai.yolo_detector import YoloDetector
+from watchdog.models.detect_info import DetectInfo
+from watchdog.services.wd_queue_console import WdQueueConsole
+from watchdog.services.workers.detect.common_detector import CommonDetector
+from watchdog.services.workers.detect.detect_scheduler import (
+    DetectPriorityStats, detect_priority)
+
+
+class DetectorPool(object):
+
+    def __init__(self, q_console: WdQueueConsole,
+                 q_consoles: Optional[Dict[str, WdQueueConsole]] = None):
+        """
+        :param q_console: 单路相机
+        :param q_consoles: 多路相机 {相机名: q_console}，
+                           各路的 detect_worker_num 需与检测池大小一致
+        """
+        self.q_console = q_console
+        self.q_consoles = q_consoles
+        self.worker_num = self.q_console.detect_worker_num.value
+        self.priority_stats = DetectPriorityStats()
+        self.workers: List[CommonDetector] = [
+            CommonDetector(q_console=self.q_console, worker_id=worker_id,
+                           q_consoles=q_consoles,
+                           priority_stats=self.priority_stats)
+            for worker_id in range(self.worker_num)
+        ]
+
+    @classmethod
+    def shared(cls, q_consoles: Dict[str, WdQueueConsole]) -> "DetectorPool":
+        """多路相机共用的检测池"""
+        first_q_console = next(iter(q_consoles.values()))
+        return cls(first_q_console, q_consoles=q_consoles)
+
+    def send_start_work_req(self):
+        for worker in self.workers:
+            worker.send_start_work_req()
+
+    def start_work_in_subprocess(self):
+        # 自动选择推理引擎时只在这里测速一次，检测进程直接创建选中的引擎
+        YoloDetector.resolve_engine()
+        for worker in self.workers:
+            worker.start_work_in_subprocess()
+
+    def health_check(self):
+        return [worker.health_check() for worker in self.workers]
+
+    def motion_stats(self) -> Dict:
+        """运动预过滤命中/跳过次数, 用于衡量节省的推理量"""
+        workers_stats = [worker.motion_stats() for worker in self.workers]
+        hit_num = sum(stats["hit_num"] for stats in workers_stats)
+        skip_num = sum(stats["skip_num"] for stats in workers_stats)
+        total = hit_num + skip_num
+        return {
+            "enabled": bool(MotionConfig.ENABLE.value),
+            "roi": list(MotionConfig.ROI),
+            "hit_num": hit_num,
+            "skip_num": skip_num,
+            "skip_ratio": round(skip_num / total, 4) if total else 0,
+        }
+
+    @property
+    def stream_q_consoles(self) -> Dict[str, WdQueueConsole]:
+        """检测池服务的各路相机 {相机名: q_console}"""
+        return self.q_consoles or {self.q_console.camera_name: self.q_console}
+
+    def schedule_stats(self) -> Dict:
+        """各优先级的待检测帧数/等待时长/丢弃数，以及各路相机当前的优先级"""
+        return {
+            "priorities": self.priority_stats.summary(),
+            "cameras": {name: detect_priority(q_console)
+                        for name, q_console in self.stream_q_consoles.items()},
+        }
+
+    def detect_cost(self) -> Tuple[float, int]:
+        """所有检测器累计的检测耗时(秒)与帧数"""
+        return (sum(worker.detect_secs.value for worker in self.workers),
+                sum(worker.detect_frame_num.value for worker in self.workers))
+
+    def dropped_num(self) -> int:
+        """超过最大等待时长被丢弃的帧数"""
+        return sum(stats["dropped_num"] for stats
+                   in self.priority_stats.summary().values())
+
+    def pending_num(self) -> int:
+        """各路相机待检测的帧数"""
+        return sum(stats["depth"] for stats
+                   in self.priority_stats.summary().values())
+
+    @property
+    def working_handled_num(self):
+        return sum(worker.working_handled_num for worker in self.workers)
+
+
+class DetectInfosReorderBuffer(object):
+    """
+        多个检测器的结果会乱序到达，只保证输出的 frame_id(帧采集时间)递增：
+            - 比已输出的结果都新的结果立即输出，不等待中间缺失的帧
+            - 迟到的、比已输出的结果还旧的结果直接丢弃
+    """
+
+    def __init__(self):
+        self._ready: List[List[DetectInfo]] = []
+        self._last_frame_id = None
+        self.dropped_num = 0
+
+    def __len__(self):
+        return len(self._ready)
+
+    def push(self, d_infos: List[DetectInfo]):
+        frame_id = d_infos[0].frame_id
+        if self._last_frame_id is not None and frame_id <= self._last_frame_id:
+            self.dropped_num += 1
+            return
+        self._last_frame_id = frame_id
+        self._ready.append(d_infos)
+
+    def pop_ready(self) -> List[List[DetectInfo]]:
+        ready, self._ready = self._ready, []
+        return ready
@@ -1,3 +1,4 @@
+from watchdog.configs.constants import FrameStage
 from watchdog.utils.util_camera import FrameBox
 from watchdog.models.worker_req import WorkerEndReq, WorkerStartReq
 from watchdog.services.base.wd_base_worker import WDBaseWorker
@@ -23,6 +24,7 @@ class FrameDistributor(WDBaseWorker):
                                                   timeout=5, wait_item=True)
         if frame_box is not None:
             self.cam_fetch_failed_count = 0
+            frame_box.mark_stage(FrameStage.DISTRIBUTE)
             frame_box.put_delay_text(tag="import")
             self.put_queue_item(self.q_console.frame4mark_queue, frame_box,
                                 force_put=True)
@@ -8,6 +8,7 @@ from threading import Thread
 import numpy as np
 import cv2
 
+from watchdog.configs.constants import FrameStage, RecordConfig
 from watchdog.utils.util_log import time_cost_log
 from watchdog.utils.util_camera import FrameBox
 from watchdog.models.detect_info import DetectInfo
@@ -18,9 +19,14 @@ from watchdog.services.base.wd_base_worker import WDBaseWorker
 class Marker(WDBaseWorker):
     # 检测到的物体 bbox 面积小于次时， 则不会显示出来
     MIN_AREA = 0.02
+    MAX_CAM_FETCH_FAILED = 3
 
     def __sub_init__(self):
         self.frame_box_queue = self.q_console.frame4mark_queue
+        # 启用帧广播总线时直接订阅相机帧，不再经过 FrameDistributor
+        self.frame_sub = self.q_console.subscribe_frames("marker")
+        # 总线模式下由标注器负责判断相机是否需要重启
+        self.cam_fetch_failed_count = 0
         self.d_infos_map: Dict[str, List[DetectInfo]] = {}
         self.d_infos_list = []
 
@@ -52,6 +58,11 @@ class Marker(WDBaseWorker):
         cv2.line(frame, (x + w, y + h), (x + w, y - line_width + h),
                  color, thickness)
 
+    @classmethod
+    def _is_visible(cls, detect_info: DetectInfo) -> bool:
+        whole_area = detect_info.width * detect_info.height
+        return detect_info.area >= whole_area * cls.MIN_AREA
+
     def _landmarks(self, frame: np.ndarray, detect_infos: List[DetectInfo]):
         cx, cy, cw, ch = self.q_console.camera.center_box
 
@@ -66,8 +77,7 @@ class Marker(WDBaseWorker):
                             f"{round(detect_info.confidence, 4)}")
             x, y, w, h = detect_info.bbox
 
-            whole_area = detect_info.width * detect_info.height
-            if detect_info.area < whole_area * self.MIN_AREA:
+            if not self._is_visible(detect_info):
                 continue
 
             # 标记中心点
@@ -90,40 +100,86 @@ class Marker(WDBaseWorker):
 
     # @time_cost_log
     def _select_d_infos(self, frame_id):
-        if frame_id not in self.d_infos_map:
-            self.d_infos_map.clear()
-
-        select_num = 0
-        while True:
+        """
+            多个检测器的结果乱序到达，按 frame_id 缓存，
+            直到拿到当前帧的结果，或者所有检测器都已输出了更新的帧(当前帧的结果不会再来)
+        """
+        passed_worker_ids = {
+            d_infos[0].worker_id
+            for d_frame_id, d_infos in self.d_infos_map.items()
+            if d_frame_id > frame_id and d_infos}
+        while (frame_id not in self.d_infos_map
+               and len(passed_worker_ids)
+               < self.q_console.detect_worker_num.value):
             d_infos: List[DetectInfo] = self.get_queue_item(
                 self.q_console.detect_infos_queue, timeout=5, wait_item=True)
+            if d_infos is None:
+                break
             if not d_infos:
                 continue
 
             d_frame_id = d_infos[0].frame_id
             self.d_infos_map.setdefault(d_frame_id, [])
             self.d_infos_map[d_frame_id].extend(d_infos)
-            if d_frame_id != frame_id:
-                break
-            select_num += 1
-            if select_num >= self.q_console.detect_worker_num.value:
-                break
+            if d_frame_id > frame_id:
+                passed_worker_ids.add(d_infos[0].worker_id)
+
+        # 清理过期结果
+        for d_frame_id in [d_frame_id for d_frame_id in self.d_infos_map
+                           if d_frame_id < frame_id]:
+            self.d_infos_map.pop(d_frame_id)
 
         return [d_info for d_info in
                 self.d_infos_map.get(frame_id, [])
                 if d_info.is_detected]
 
+    def _get_frame_box(self) -> Optional[FrameBox]:
+        if self.frame_sub is None:
+            return self.get_queue_item(
+                self.q_console.frame4mark_queue, timeout=5, wait_item=True)
+
+        frame_box: FrameBox = self.frame_sub.get(timeout=5)
+        if frame_box is not None:
+            self.cam_fetch_failed_count = 0
+            return frame_box
+
+        self.cam_fetch_failed_count += 1
+        if self.cam_fetch_failed_count >= self.MAX_CAM_FETCH_FAILED:
+            # 重启相机
+            self.q_console.restart_camera(proxy=True)
+            self.cam_fetch_failed_count = 0
+        return None
+
     def _handle_start_req(self, work_req: WorkerStartReq) -> bool:
-        frame_box: FrameBox = self.get_queue_item(
-            self.q_console.frame4mark_queue, timeout=5, wait_item=True)
+        frame_box = self._get_frame_box()
         if frame_box is None:
             return False
 
         frame_box.put_delay_text(tag="markB")
         d_infos: List[DetectInfo] = self._select_d_infos(frame_box.frame_id)
-
-        marked_frame = self._landmarks(frame_box.frame, d_infos)
-        frame_box.update(marked_frame, is_marked=True)
+        detect_times = [d_info.detect_time for d_info in
+                        self.d_infos_map.get(frame_box.frame_id, [])
+                        if d_info.detect_time is not None]
+        if detect_times:
+            frame_box.mark_stage(FrameStage.DETECT,
+                                 stage_time=max(detect_times))
+
+        frame_box.detect_labels = sorted({d_info.label for d_info in d_infos})
+        frame_box.detections = [
+            [d_info.label, round(float(d_info.confidence), 4),
+             *[int(v) for v in d_info.bbox]]
+            for d_info in d_infos if self._is_visible(d_info)]
+
+        raw_frames = RecordConfig.RAW_FRAMES.value
+        if not raw_frames:
+            marked_frame = self._landmarks(frame_box.frame, d_infos)
+            frame_box.update(marked_frame, is_marked=True)
+        elif self.q_console.cam_viewing():
+            # 录制原始画面时，只在有人观看时标注，且标注在副本上，
+            # 原始画面入队后是异步序列化的，不能原地修改
+            marked_frame = self._landmarks(frame_box.frame.copy(), d_infos)
+            frame_box.update(marked_frame, is_marked=True)
+        frame_box.mark_stage(FrameStage.MARK)
 
         if frame_box.frame_id in self.d_infos_map:
             self.d_infos_map.pop(frame_box.frame_id)
@@ -132,8 +188,10 @@ class Marker(WDBaseWorker):
         # print(f"{len(self.d_infos_map)}")
         self.put_queue_item(self.q_console.render_frame_queue, frame_box,
                             force_put=True)
+        # 录制原始画面时，录像队列只发送原始画面
         self.put_queue_item(self.q_console.frame4record_queue,
-                            frame_box, force_put=True)
+                            frame_box.copy_raw() if raw_frames else frame_box,
+                            force_put=True)
 
         return False
 
@@ -13,6 +13,8 @@ from watchdog.services.op_inst import (OpInst, CarWarningInst,
 from watchdog.models.worker_req import WorkerEndReq, WorkerStartReq
 from watchdog.services.sensors import CarSensor, PersonSensor
 from watchdog.services.base.wd_base_worker import WDBaseWorker
+from watchdog.services.workers.detect.detector_pool import (
+    DetectInfosReorderBuffer)
 
 
 class Monitor(WDBaseWorker):
@@ -25,6 +27,9 @@ class Monitor(WDBaseWorker):
 
         self._car_pos_time = mp.Value("d", 0)
 
+        # 多个检测器的结果乱序到达，丢弃迟到的旧结果
+        self._reorder_buffer = DetectInfosReorderBuffer()
+
     @property
     def car_state(self):
         return self._car_state.value
@@ -154,9 +159,15 @@ class Monitor(WDBaseWorker):
             self.q_console.detect_infos_sense_queue, timeout=5,
             wait_item=True)
 
-        if not d_infos:
-            return False
+        if d_infos:
+            self._reorder_buffer.push(d_infos)
+
+        for ready_d_infos in self._reorder_buffer.pop_ready():
+            self._sense(ready_d_infos)
+
+        return False
 
+    def _sense(self, d_infos: List[DetectInfo]):
         fps = d_infos[0].fps
         center_box = self.q_console.camera.center_box
         has_person = self._person_sensor.senses(d_infos, fps, center_box)
@@ -190,8 +201,6 @@ class Monitor(WDBaseWorker):
 --------------------------------------------------------------
             """)
 
-        return False
-
     def _handle_end_req(self, work_req: WorkerEndReq) -> bool:
         pass
 
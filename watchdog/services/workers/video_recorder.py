@@ -1,15 +1,26 @@
 import os
 import logging
 from typing import *
+from collections import Counter
 from datetime import datetime, timedelta
 
 import numpy as np
 import cv2
 
 from watchdog.utils.util_camera import FrameBox
-from watchdog.utils.util_video import H264Writer
-from watchdog.configs.constants import PathConfig, CameraConfig
-from watchdog.services.path_service import get_cache_videos
+from watchdog.utils.util_video import (H264Writer, H264StreamEncoder,
+                                       H264EncoderOptions, PacketPreRoll,
+                                       H264PacketMuxer,
+                                       VideoSegment, SegmentWriter,
+                                       SegmentClipWriter)
+from watchdog.configs.constants import (PathConfig, CameraConfig, FrameStage,
+                                        RecordConfig)
+from watchdog.utils.util_time import get_bj_time_str
+from watchdog.services.record_catalog import get_record_catalog
+from watchdog.services.path_service import get_segment_path
+from watchdog.services.record_sidecar import (DetectionSidecar,
+                                              get_sidecar_filepath,
+                                              get_sidecar_filename)
 from watchdog.models.worker_req import WorkerEndReq, VidRecStartReq
 from watchdog.services.base.wd_base_worker import WDBaseWorker
 
@@ -27,6 +38,12 @@ class VidRec(WDBaseWorker):
 
         self.rec_req: Optional[VidRecStartReq] = None
         self.record_fps = 25
+        # 当前录像中各类别目标出现的帧数
+        self.detect_summary: Counter = Counter()
+        # 录制原始画面时的检测结果旁路文件
+        self.sidecar = DetectionSidecar()
+        self._first_frame_time: Optional[float] = None
+        self._last_frame_time: Optional[float] = None
 
     def _sub_work_before_cleaned_up(self, work_req):
         pass
@@ -55,7 +72,7 @@ class VidRec(WDBaseWorker):
         if not work_req.is_new:
             return
 
-        now_rec_secs = self.working_handled_num / self.rec_req.active_fps
+        now_rec_secs = self._elapsed_secs()
         left_secs = self.rec_req.rec_secs - now_rec_secs
 
         plus_rec_secs = work_req.rec_secs - left_secs
@@ -75,7 +92,14 @@ class VidRec(WDBaseWorker):
         self._clean_expired_videos()
         self.q_console.active_camera(tag="start record video")
         self._update_vid_rec_req_info(work_req)
+        self._first_frame_time = None
+        self._last_frame_time = None
         self._update_video_writer()
+        self.detect_summary = Counter()
+        get_record_catalog().add_record(self.rec_req.rec_filename,
+                                        start_time=self.rec_req.start_time,
+                                        tag=self.rec_req.raw_tag,
+                                        camera=self.q_console.camera_name)
 
     def _handle_start_req(self, work_req: VidRecStartReq) -> bool:
         """
@@ -86,6 +110,39 @@ class VidRec(WDBaseWorker):
         self._update_vid_rec_req_info(work_req)
         return self._write_one()
 
+    def _write_frame(self, frame_box: FrameBox):
+        self.video_writer.write(frame_box.frame)
+
+    def _record_secs(self) -> float:
+        video_fps = self.q_console.camera.video_fps or self.record_fps
+        return self.working_handled_num / video_fps
+
+    def _elapsed_secs(self) -> float:
+        """
+            已录制的时长，按帧的采集时间计算，
+            自适应帧率调整激活帧率后依旧准确(不能用帧数 / 帧率)
+        """
+        if self._first_frame_time is None:
+            return 0
+        return self._last_frame_time - self._first_frame_time
+
+    def _video_start_time(self) -> Optional[float]:
+        """录像第一帧的采集时间，用于换算旁路文件中的时间"""
+        return self._first_frame_time
+
+    def _add_sidecar_entry(self, frame_box: FrameBox):
+        if RecordConfig.RAW_FRAMES.value:
+            self.sidecar.add(frame_box.frame_ctime, frame_box.detections,
+                             frame_box.frame_size())
+
+    def _write_sidecar(self):
+        video_start_time = self._video_start_time()
+        if not len(self.sidecar) or video_start_time is None:
+            self.sidecar.clear()
+            return
+        self.sidecar.write(get_sidecar_filepath(self.rec_req.rec_filename),
+                           video_start_time=video_start_time)
+
     def _write_one(self) -> bool:
         """
         :return: 返回是否停止录制工作
@@ -93,26 +150,34 @@ class VidRec(WDBaseWorker):
 
         frame_box: FrameBox = self.get_queue_item(
             self.frame_queue, queue_name="frame_queue",
-            timeout=0.2)
+            timeout=0.2, lease=True)
 
         if frame_box is None:
             return False
-        elif isinstance(frame_box.frame, np.ndarray):
-            self.video_writer.write(frame_box.frame)
-            self.plus_working_handled_num()
-        else:
-            logging.warning(f"[{self.worker_name}] Wrong type frame, "
-                            f"not ndarray but {type(frame_box.frame)}")
-
-        target_frame_num = self.rec_req.rec_secs * self.rec_req.active_fps
-        if (self.working_handled_num >= target_frame_num
+
+        with frame_box:
+            if isinstance(frame_box.frame, np.ndarray):
+                if self._first_frame_time is None:
+                    self._first_frame_time = frame_box.frame_ctime
+                self._last_frame_time = frame_box.frame_ctime
+                self._write_frame(frame_box)
+                self._add_sidecar_entry(frame_box)
+                frame_box.mark_stage(FrameStage.RECORD)
+                self.detect_summary.update(frame_box.detect_labels)
+                self.q_console.latency_stats.observe_frame(
+                    frame_box, stages=(FrameStage.RECORD,))
+                self.plus_working_handled_num()
+            else:
+                logging.warning(f"[{self.worker_name}] Wrong type frame, "
+                                f"not ndarray but {type(frame_box.frame)}")
+
+        if (self._elapsed_secs() >= self.rec_req.rec_secs
                 and self.q_console.monitor_states.is_now_active()):
             work_req = VidRecStartReq(tag="still active")
             work_req.is_new = True
             self._update_vid_rec_req_info(work_req)
 
-        target_frame_num = self.rec_req.rec_secs * self.rec_req.active_fps
-        return self.working_handled_num >= target_frame_num
+        return self._elapsed_secs() >= self.rec_req.rec_secs
 
     def _handle_end_req(self, work_req: WorkerEndReq) -> bool:
         """
@@ -124,28 +189,39 @@ class VidRec(WDBaseWorker):
     def _sub_work_done_cleaned_up(self, work_req):
         if self.video_writer is not None and self.video_writer.isOpened():
             self.video_writer.release()
+            self._finish_catalog_record()
+            self._write_sidecar()
             self.video_writer = None
             logging.info(f"[{self.worker_name}] End of recording："
                          f"{self.rec_req.write_filepath}, "
-                         f"remain: {self.frame_queue.qsize()}")
+                         f"remain: {self.frame_queue.qsize()}"
+                         f"{self._encode_summary()}")
 
         if self.rec_req is not None:
             self.q_console.rest_camera(tag="video record end")
             self.rec_req: Optional[VidRecStartReq] = None
 
+    def _encode_summary(self) -> str:
+        return ""
+
     def _sub_clear_all_output_queues(self):
         self._sub_work_done_cleaned_up(None)
 
+    def _finish_catalog_record(self):
+        filepath = self.rec_req.write_filepath
+        size = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+        get_record_catalog().finish_record(
+            self.rec_req.rec_filename, end_time=get_bj_time_str(),
+            duration=round(self._record_secs(), 2),
+            size=size, detect_summary=dict(
+                self.detect_summary, frames=self.working_handled_num))
+
     def _clean_expired_videos(self):
-        videos = get_cache_videos()
         tt = datetime.now() - timedelta(
             days=CameraConfig.CACHE_DAYS.value)
         tt_str = tt.strftime("%Y-%m-%d-%H-%M-%S-%f")
-        removes = []
-        for t in videos:
-            _t = t[:t.rindex("-")]
-            if _t < tt_str:
-                removes.append(t)
+        # 索引上的范围删除，不再扫描目录
+        removes = get_record_catalog().delete_before(tt_str)
 
         for r in removes:
             filepath = os.path.join(PathConfig.CACHE_DATAS_PATH, r)
@@ -153,14 +229,169 @@ class VidRec(WDBaseWorker):
                 os.remove(filepath)
                 logging.info(f"[{self.worker_name}] remove expired video: "
                              f"{filepath}")
+            sidecar_filepath = os.path.join(PathConfig.CACHE_DATAS_PATH,
+                                            get_sidecar_filename(r))
+            if os.path.exists(sidecar_filepath):
+                os.remove(sidecar_filepath)
 
 
 class VidRecH264(VidRec):
     """
         H264编码视频：存储占用小，主流播放格式
+
+        编码器长期存在，未录像时也持续编码，最近 RecordConfig.PRE_ROLL_SECS
+        秒的 packet 保存在预录缓冲中，触发录像时先写入，录像能包含触发前的画面
+
+        连续录像(RecordConfig.CONTINUOUS)时，所有帧只编码一次，写入固定时长的
+        分段；事件录像结束时从分段中剪出(重新封装，不重新编码)，
+        预录画面直接取自分段
+
+        编码参数(preset/tune/线程数/GOP/CRF 或码率)来自 RecordConfig，
+        每帧耗时记录在 q_console.record_encode_stats
     """
 
+    def __sub_init__(self, **kwargs):
+        super().__sub_init__(**kwargs)
+        # 编码器在工作进程中创建
+        self.encoder: Optional[H264StreamEncoder] = None
+        self.pre_roll = PacketPreRoll()
+        # 新文件没有预录画面时，第一帧需要强制为关键帧
+        self._need_keyframe = True
+        self.segment_writer: Optional[SegmentWriter] = None
+
+    def _get_encoder(self) -> H264StreamEncoder:
+        if self.encoder is None:
+            options = H264EncoderOptions.from_record_config()
+            self.encoder = H264StreamEncoder(
+                fps=self.q_console.camera.video_fps, options=options,
+                cost_stats=self.q_console.record_encode_stats)
+            logging.info(f"[{self.worker_name}] h264 encoder options: "
+                         f"{options.to_dict()}")
+        return self.encoder
+
+    @classmethod
+    def _is_continuous(cls):
+        return bool(RecordConfig.CONTINUOUS.value)
+
+    def _get_segment_writer(self) -> SegmentWriter:
+        if self.segment_writer is None:
+            self.segment_writer = SegmentWriter(
+                get_segment_path(self.q_console.camera_name),
+                encoder=self._get_encoder(),
+                on_segment_closed=self._on_segment_closed)
+        self.segment_writer.segment_secs = RecordConfig.SEGMENT_SECS.value
+        return self.segment_writer
+
+    def _on_segment_closed(self, segment: VideoSegment):
+        get_record_catalog().add_segment(
+            segment.filename, start_time=segment.wall_start_time,
+            end_time=get_bj_time_str(), duration=round(segment.duration, 2),
+            size=os.path.getsize(segment.path),
+            camera=self.q_console.camera_name)
+        self._clean_expired_segments()
+
+    def _clean_expired_segments(self):
+        tt = datetime.now() - timedelta(
+            hours=RecordConfig.SEGMENT_KEEP_HOURS.value)
+        removes = get_record_catalog().delete_segments_before(
+            tt.strftime("%Y-%m-%d-%H-%M-%S-%f"),
+            camera=self.q_console.camera_name)
+        for r in removes:
+            filepath = os.path.join(
+                get_segment_path(self.q_console.camera_name), r)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+                logging.info(f"[{self.worker_name}] remove expired segment: "
+                             f"{filepath}")
+
+    def _drain_frame_queue(self, write_func: Callable):
+        for _ in range(self.frame_queue.qsize()):
+            frame_box: FrameBox = self.get_queue_item(
+                self.frame_queue, queue_name="frame_queue", timeout=0.01,
+                lease=True)
+            if frame_box is None:
+                break
+            with frame_box:
+                if isinstance(frame_box.frame, np.ndarray):
+                    write_func(frame_box)
+                    self._add_sidecar_entry(frame_box)
+
+    def _sub_side_work(self):
+        """
+            未录像时，将录像帧编码进预录缓冲；连续录像时写入分段
+        """
+        if self.video_writer is not None:
+            return
+        # 预录画面的检测结果，多保留一个 GOP(预录/剪辑起点向前对齐到关键帧)
+        self.sidecar.trim(RecordConfig.PRE_ROLL_SECS.value
+                          + self._get_encoder().gop_secs)
+        if self._is_continuous():
+            self.pre_roll.clear()
+            segment_writer = self._get_segment_writer()
+            self._drain_frame_queue(lambda frame_box: segment_writer.write(
+                frame_box.frame, frame_box.frame_ctime))
+            return
+        if self.segment_writer is not None:
+            # 关闭连续录像
+            self.segment_writer.close()
+            self.segment_writer = None
+
+        self.pre_roll.max_secs = RecordConfig.PRE_ROLL_SECS.value
+        self.pre_roll.max_bytes = (RecordConfig.PRE_ROLL_MAX_MB.value
+                                   * 1024 * 1024)
+        if self.pre_roll.max_secs <= 0:
+            self.pre_roll.clear()
+            return
+
+        encoder = self._get_encoder()
+        self._drain_frame_queue(lambda frame_box: self.pre_roll.push(
+            encoder.encode(frame_box.frame, frame_box.frame_ctime)))
+
     def _update_video_writer(self):
-        self.video_writer = H264Writer(self.rec_req.write_filepath,
-                                       fps=self.q_console.camera.video_fps,
-                                       bit_rate=1024 * 500)
+        if self._is_continuous():
+            # 触发时间与帧采集时间同为 perf_counter
+            self.video_writer = SegmentClipWriter(
+                self.rec_req.write_filepath,
+                segment_writer=self._get_segment_writer(),
+                start_time=(self.rec_req.c_time
+                            - RecordConfig.PRE_ROLL_SECS.value))
+            return
+
+        self.video_writer = H264PacketMuxer(self.rec_req.write_filepath,
+                                            encoder=self._get_encoder())
+        pre_roll_secs = self.pre_roll.secs
+        packets = self.pre_roll.drain()
+        self.video_writer.mux(packets)
+        self._need_keyframe = not packets
+        if packets:
+            logging.info(f"[{self.worker_name}] pre-roll: "
+                         f"{round(pre_roll_secs, 2)} secs, "
+                         f"{len(packets)} packets")
+
+    def _write_frame(self, frame_box: FrameBox):
+        if isinstance(self.video_writer, SegmentClipWriter):
+            self.video_writer.write(frame_box.frame, frame_box.frame_ctime)
+            return
+        packets = self._get_encoder().encode(
+            frame_box.frame, frame_box.frame_ctime,
+            force_keyframe=self._need_keyframe)
+        self._need_keyframe = False
+        self.video_writer.mux(packets)
+
+    def _record_secs(self) -> float:
+        if isinstance(self.video_writer, (H264PacketMuxer,
+                                          SegmentClipWriter)):
+            return self.video_writer.duration
+        return super()._record_secs()
+
+    def _encode_summary(self) -> str:
+        if self.encoder is None:
+            return ""
+        return f", encoder: {self.encoder.stats()}"
+
+    def _video_start_time(self) -> Optional[float]:
+        if isinstance(self.video_writer, H264PacketMuxer):
+            return self.video_writer.start_time
+        if isinstance(self.video_writer, SegmentClipWriter):
+            return self.video_writer.video_start_time
+        return super()._video_start_time()
@@ -1,19 +1,24 @@
 import time
 from typing import *
+import multiprocessing as mp
 from queue import Empty, Queue as TQueue
-from threading import Event as TEvent
+from collections import deque
+from threading import Lock as TLock, Condition as TCondition
 
 from watchdog.server.custom_server import EnhanceThreadedWSGIServer
-from watchdog.configs.constants import CameraConfig
+from watchdog.configs.constants import CameraConfig, FrameStage
 
 from watchdog.utils.util_camera import FrameBox
 from watchdog.utils.util_thread import new_thread
 from watchdog.services.workers.marker import Marker
 from watchdog.services.workers.video_recorder import VidRecH264
 from watchdog.services.wd_queue_console import WdQueueConsole
+from watchdog.services.record_catalog import get_record_catalog
+from watchdog.services.camera_sources import CameraSource
+from watchdog.services.fps_controller import AdaptiveFpsController
 from watchdog.services.workers.monitor import Monitor
 from watchdog.services.workers.frame_distributor import FrameDistributor
-from watchdog.services.workers.detect.common_detector import CommonDetector
+from watchdog.services.workers.detect.detector_pool import DetectorPool
 
 
 class TimeTQueue(TQueue):
@@ -33,38 +38,184 @@ class TimeTQueue(TQueue):
         return time.perf_counter() - self.mtime
 
 
+class LiveFrameRing(object):
+    """
+        直播帧环形缓冲区，只保留最新的 capacity 帧，内存占用与观看者快慢无关
+
+        每帧带一个递增的代数(generation)，观看者记录自己上一次读到的代数，
+        下一帧已被覆盖时直接跳到最新帧，跳过的帧数计入该观看者的丢帧数
+    """
+
+    def __init__(self, capacity=8):
+        self.capacity = capacity
+        self._frames: List[Optional[FrameBox]] = [None] * capacity
+        self._generation = 0
+        self._cond = TCondition()
+        # 新帧通知回调 callback(generation)，供异步服务唤醒事件循环
+        self._listeners: List[Callable[[int], Any]] = []
+
+    @property
+    def generation(self):
+        return self._generation
+
+    def add_listener(self, callback: Callable[[int], Any]):
+        self._listeners.append(callback)
+
+    def push(self, frame_box: FrameBox) -> int:
+        with self._cond:
+            self._generation += 1
+            generation = self._generation
+            self._frames[generation % self.capacity] = frame_box
+            self._cond.notify_all()
+        for callback in self._listeners:
+            callback(generation)
+        return generation
+
+    def latest(self, timeout=None) -> Tuple[int, FrameBox]:
+        """最新帧，还没有帧时等待，超时抛出 Empty"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._generation > 0,
+                                       timeout=timeout):
+                raise Empty
+            return (self._generation,
+                    self._frames[self._generation % self.capacity])
+
+    def get_after(self, generation: int,
+                  timeout=None) -> Tuple[int, FrameBox]:
+        """
+            generation 的下一帧，已被覆盖时返回最新帧，超时抛出 Empty
+        :return: (generation, frame_box)，调用方可根据代数差计算丢帧数
+        """
+        with self._cond:
+            if not self._cond.wait_for(
+                    lambda: self._generation > generation, timeout=timeout):
+                raise Empty
+            next_generation = generation + 1
+            if self._generation - next_generation >= self.capacity:
+                next_generation = self._generation
+            return (next_generation,
+                    self._frames[next_generation % self.capacity])
+
+
+class LiveStreamStats(object):
+    """
+        直播 JPEG 编码统计：编码次数 / 推送帧数 / 跳过帧数，
+        同一帧的同一规格只编码一次，观看者越多 encode_ratio 越低，
+        另外记录当前每个观看者的推送帧数与丢帧数
+    """
+
+    def __init__(self):
+        self._lock = TLock()
+        self.encode_num = 0
+        self.served_num = 0
+        self.skipped_num = 0
+        self.clients: Dict[str, Dict[str, int]] = {}
+
+    def add_client(self, client_id: str):
+        with self._lock:
+            self.clients[client_id] = dict(served_num=0, dropped_num=0)
+
+    def remove_client(self, client_id: str):
+        with self._lock:
+            self.clients.pop(client_id, None)
+
+    def plus_client(self, client_id: str, served_num=0, dropped_num=0):
+        with self._lock:
+            client = self.clients.get(client_id)
+            if client is not None:
+                client["served_num"] += served_num
+                client["dropped_num"] += dropped_num
+
+    def plus_encode(self):
+        with self._lock:
+            self.encode_num += 1
+
+    def plus_served(self):
+        with self._lock:
+            self.served_num += 1
+
+    def plus_skipped(self, num=1):
+        with self._lock:
+            self.skipped_num += num
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "encode_num": self.encode_num,
+                "served_num": self.served_num,
+                "skipped_num": self.skipped_num,
+                "encode_ratio": (round(self.encode_num / self.served_num, 4)
+                                 if self.served_num else 0),
+                "clients": {client_id: dict(client)
+                            for client_id, client in self.clients.items()},
+            }
+
+
 class WorkShop(object):
+    # 直播环形缓冲区保留的帧数量，环中的帧都是租借帧(直接引用共享内存)，
+    # 需小于 render_frame_queue 的共享内存槽位数
+    LIVE_RING_CAPACITY = 3
 
     def __init__(self, camera_address, video_width=None,
-                 video_height=None):
+                 video_height=None, use_frame_bus=False, detect_worker_num=1,
+                 camera_name="", shared_detector=False,
+                 global_worker_task=None):
+        """
+        :param camera_name: 多路相机时的相机名
+        :param shared_detector: 多路相机共用检测池时不创建自己的检测池，
+                                由 MultiWorkShop 创建后赋值给 detector_pool
+        :param global_worker_task: 多路相机共用的任务信息
+        """
+        self.camera_name = camera_name
         self.q_console = WdQueueConsole.init_default(
             camera_address=camera_address,
-            fps=CameraConfig.REST_FPS.value, detect_worker_num=1,
+            fps=CameraConfig.REST_FPS.value,
+            detect_worker_num=detect_worker_num,
             video_width=video_width,
-            video_height=video_height)
+            video_height=video_height,
+            use_frame_bus=use_frame_bus,
+            camera_name=camera_name,
+            global_worker_task=global_worker_task)
+        # 录像索引与磁盘对账，之后由录像进程增量维护
+        get_record_catalog().sync_dir()
 
-        self.frame_dst = FrameDistributor(q_console=self.q_console)
+        # 启用帧广播总线时，各个消费者直接订阅相机帧，无需分发器
+        self.frame_dst: Optional[FrameDistributor] = None
+        if self.q_console.frame_bus is None:
+            self.frame_dst = FrameDistributor(q_console=self.q_console)
 
         self.marker = Marker(q_console=self.q_console)
-        self.c_detector = CommonDetector(q_console=self.q_console)
+        self.detector_pool: Optional[DetectorPool] = None
+        if not shared_detector:
+            self.detector_pool = DetectorPool(q_console=self.q_console)
         self.monitor = Monitor(q_console=self.q_console)
         self.vid_recorder = VidRecH264(
             q_console=self.q_console,
             work_req_queue=self.q_console.recorder_req_queue)
 
         self.marker.send_start_work_req()
-        self.c_detector.send_start_work_req()
+        if self.detector_pool is not None:
+            self.detector_pool.send_start_work_req()
         self.monitor.send_start_work_req()
-        self.frame_dst.send_start_work_req()
+        if self.frame_dst is not None:
+            self.frame_dst.send_start_work_req()
 
         self.marker.start_work_in_subprocess()
         self.monitor.start_work_in_subprocess()
-        self.c_detector.start_work_in_subprocess()
-        self.frame_dst.start_work_in_subprocess()
+        if self.detector_pool is not None:
+            self.detector_pool.start_work_in_subprocess()
+        if self.frame_dst is not None:
+            self.frame_dst.start_work_in_subprocess()
         self.vid_recorder.start_work_in_subprocess()
 
-        self._live_frame: Optional[FrameBox] = None
-        self._live_frame_come = TEvent()
+        self.live_ring = LiveFrameRing(capacity=self.LIVE_RING_CAPACITY)
+        self.live_stream_stats = LiveStreamStats()
+
+        # 自适应帧率，共用检测池时由 MultiWorkShop 创建
+        self.fps_controller: Optional[AdaptiveFpsController] = None
+        if self.detector_pool is not None and CameraConfig.ADAPTIVE_FPS.value:
+            self.fps_controller = AdaptiveFpsController(self.detector_pool)
+            self.fps_controller.start()
 
         # self.preloading_live_frame()
         self.preloading_live_frame2()
@@ -83,13 +234,14 @@ class WorkShop(object):
 
     @property
     def live_frame(self) -> FrameBox:
-        if not self._live_frame_come.wait(timeout=5):
-            raise Empty
-        return self._live_frame
+        _, frame_box = self.live_ring.latest(timeout=5)
+        return frame_box
 
     @new_thread
     def preloading_live_frame2(self):
         render_frame_queue = self.q_console.render_frame_queue
+        # 租借的帧直接引用共享内存，与直播环形缓冲区保留相同的帧，被挤出环的帧归还
+        leased_frames: Deque[FrameBox] = deque()
 
         camera_active = False
         while True:
@@ -100,16 +252,18 @@ class WorkShop(object):
                 self.q_console.rest_camera(tag="view request end")
                 camera_active = False
 
-            frame_box: FrameBox = render_frame_queue.get()
+            frame_box: FrameBox = render_frame_queue.get(lease=True)
+            frame_box.mark_stage(FrameStage.RENDER)
+            self.q_console.latency_stats.observe_frame(frame_box)
             frame_box.put_delay_text("final")
-            frame_box.next_come = TEvent()
-            if self._live_frame is None:
-                self._live_frame = frame_box
-                self._live_frame_come.set()
-                continue
-            self._live_frame.next = frame_box
-            self._live_frame.next_come.set()
-            self._live_frame = frame_box
+            frame_box.jpeg_lock = TLock()
+            leased_frames.append(frame_box)
+            self.live_ring.push(frame_box)
+            while len(leased_frames) > self.live_ring.capacity:
+                evicted_frame_box = leased_frames.popleft()
+                # 观看者正在编码该帧时，等编码完成再归还，避免编码到被覆盖的画面
+                with evicted_frame_box.jpeg_lock:
+                    evicted_frame_box.release()
 
     def test_monitor(self):
         from cv2 import cv2
@@ -118,3 +272,40 @@ class WorkShop(object):
             frame_box.put_delay_text("final")
             cv2.imshow("frame", frame_box.frame)
             cv2.waitKey(1)
+
+
+class MultiWorkShop(object):
+    """
+        多路相机：每路相机各自一个 WorkShop(相机进程/标注/监控/录像)，
+        所有相机共用一个固定大小的检测池，检测进程按各路帧率加权轮询取帧，
+        模型只加载 detect_worker_num 份
+    """
+
+    def __init__(self, sources: List[CameraSource], use_frame_bus=False,
+                 detect_worker_num=1):
+        # 所有相机共用一个任务信息管理进程
+        global_worker_task = mp.Manager().TaskInfo(task_name="")
+        self.work_shops: Dict[str, WorkShop] = {}
+        for source in sources:
+            self.work_shops[source.name] = WorkShop(
+                source.address, video_width=source.video_width,
+                video_height=source.video_height,
+                use_frame_bus=use_frame_bus,
+                detect_worker_num=detect_worker_num,
+                camera_name=source.name, shared_detector=True,
+                global_worker_task=global_worker_task)
+
+        self.detector_pool = DetectorPool.shared(
+            {name: work_shop.q_console
+             for name, work_shop in self.work_shops.items()})
+        for work_shop in self.work_shops.values():
+            work_shop.detector_pool = self.detector_pool
+        self.detector_pool.send_start_work_req()
+        self.detector_pool.start_work_in_subprocess()
+
+        self.fps_controller: Optional[AdaptiveFpsController] = None
+        if CameraConfig.ADAPTIVE_FPS.value:
+            self.fps_controller = AdaptiveFpsController(self.detector_pool)
+            for work_shop in self.work_shops.values():
+                work_shop.fps_controller = self.fps_controller
+            self.fps_controller.start()
@@ -1,11 +1,12 @@
 import os
+import copy
 import json
 import time
 import logging
 import traceback
 from typing import *
 from queue import Empty
-from threading import Event as TEvent
+from threading import Lock as TLock
 import multiprocessing as mp
 from urllib.parse import urlparse
 
@@ -15,6 +16,7 @@ import setproctitle
 from hikvisionapi import Client
 from tqdm import tqdm
 
+from watchdog.configs.constants import DebugConfig, FrameStage
 from watchdog.utils.util_time import Timer
 from watchdog.utils.util_uuid import unique_time_id
 from watchdog.utils.util_rtsp import RTSPCapture
@@ -28,6 +30,7 @@ from watchdog.utils.util_multiprocess.process import (
 from watchdog.utils.util_multiprocess.queue import (clear_queue, FastQueue,
                                                     clear_queue_cache)
 from watchdog.utils.util_multiprocess.lock import BetterRLock
+from watchdog.utils.util_multiprocess.frame_bus import FrameBus
 from watchdog.utils.util_net import is_connected, get_host_name
 from watchdog.utils.util_hik_net_audio_controller import HIKNetAudioController
 from watchdog.models.health_info import HealthRspInfo
@@ -94,10 +97,98 @@ class FrameBox(object):
         self._last_delay_y = 0
         self.last_xy = (0, 0)
 
-        # 用于在多线程中赋值/获取 下一帧，不支持多进程共享
-        self.next: Optional[FrameBox] = None
-        # 用于在多线程中判断下一帧是否已存在
-        self.next_come: Optional[TEvent] = None
+        # 各阶段完成时间(perf_counter)，随帧在进程间传递，用于统计端到端延迟
+        self.stage_times: Dict[str, float] = {}
+        # 标注时该帧检测到的目标类别，用于录像检测摘要
+        self.detect_labels: List[str] = []
+        # 标注时该帧的检测结果 [[label, confidence, x, y, w, h], ...]，
+        # 录制原始画面时写入录像旁路文件
+        self.detections: List[List] = []
+
+        # 直播 JPEG 缓存，{(宽度, 质量): jpeg}，每种规格只编码一次，所有观看者复用，
+        # 不支持多进程共享
+        self.jpeg_renditions: Dict[Tuple[int, int], bytes] = {}
+        self.jpeg_lock: Optional[TLock] = None
+
+        # 租借模式(FastQueue.get(lease=True))下归还共享内存的回调
+        self._lease: Optional[Callable] = None
+        self._released = False
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_lease", None)
+        state.pop("_released", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__dict__.setdefault("stage_times", {})
+        self.__dict__.setdefault("detect_labels", [])
+        self.__dict__.setdefault("detections", [])
+        self._lease = None
+        self._released = False
+
+    def bus_meta(self) -> Dict:
+        """发布到 FrameBus 的元数据, 帧数据单独写入共享内存"""
+        state = self.__getstate__()
+        for key in ("_raw_frame", "_marked_frame", "jpeg_renditions",
+                    "jpeg_lock"):
+            state.pop(key, None)
+        return state
+
+    @classmethod
+    def from_bus_item(cls, meta: Dict, frame: np.ndarray) -> "FrameBox":
+        frame_box = cls.__new__(cls)
+        frame_box.__setstate__(dict(meta, _raw_frame=None, _marked_frame=None,
+                                    jpeg_renditions={}, jpeg_lock=None))
+        frame_box.frame = frame
+        return frame_box
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+    def attach_lease(self, release_callback: Callable):
+        """
+            帧数据直接引用共享内存, 使用完毕后须调用 release 归还;
+            租借中的帧不能再放入其他队列
+        """
+        self._lease = release_callback
+
+    @property
+    def is_leased(self):
+        return self._lease is not None
+
+    @property
+    def is_released(self):
+        return self._released
+
+    def release(self):
+        if self._lease is None:
+            return
+        release_callback, self._lease = self._lease, None
+        # 先丢掉对共享内存的引用, 再归还
+        self._raw_frame = None
+        self._marked_frame = None
+        self._released = True
+        release_callback()
+
+    def copy_raw(self) -> "FrameBox":
+        """
+            浅拷贝，只带原始画面(不带标注画面与 JPEG 缓存)，
+            用于原始画面与标注画面分别发往不同队列
+        """
+        frame_box = copy.copy(self)
+        frame_box.is_marked = False
+        frame_box._marked_frame = None
+        frame_box.stage_times = dict(self.stage_times)
+        frame_box.jpeg_renditions = {}
+        frame_box.jpeg_lock = None
+        frame_box._lease = None
+        frame_box._released = False
+        return frame_box
 
     def update(self, frame: Optional[np.ndarray] = None, is_marked=False):
         self.is_marked = is_marked
@@ -128,7 +219,24 @@ class FrameBox(object):
     def frame_size(self):
         return self.frame.shape[1], self.frame.shape[0]
 
+    def mark_stage(self, stage: str, stage_time: Optional[float] = None):
+        """记录帧完成某个阶段(FrameStage)的时间"""
+        self.stage_times[stage] = (time.perf_counter() if stage_time is None
+                                   else stage_time)
+
+    def stage_ms(self, stage: str) -> Optional[float]:
+        """从相机读取到完成该阶段的耗时"""
+        stage_time = self.stage_times.get(stage)
+        if stage_time is None:
+            return None
+        return (stage_time - self.frame_ctime) * 1000
+
     def put_delay_text(self, tag="_____"):
+        """
+            仅用于调试：将当前延迟画到帧上，DebugConfig.DELAY_TEXT 开启时生效
+        """
+        if not DebugConfig.DELAY_TEXT.value:
+            return
         frame = self.frame
         height = frame.shape[0]
         width = frame.shape[1]
@@ -361,6 +469,9 @@ class MultiprocessCamera(object):
     VIDEO_PATH_TEST_FPS = 30
     # 读取帧失败的容忍值，超过这个值，则重连
     READ_FRAME_FAILED_TOLERATE = 5
+    # 目标帧率不高于此值时(如休息帧率)，网络摄像头跳过的帧连解码也跳过，
+    # 只解码关键帧，实际帧率受摄像头关键帧间隔限制
+    KEYFRAME_SKIP_MAX_FPS = 2
 
     DEFAULT_SET_PARAMS = {
         cv2.CAP_PROP_FOURCC: cv2.VideoWriter_fourcc(*"MJPG"),
@@ -386,6 +497,8 @@ class MultiprocessCamera(object):
         # self.store_queue: mp.Queue = mp.Queue(15)
         self.store_queue: FastQueue = FastQueue(
             15, name="camera_store_queue")
+        # 帧广播总线，设置后帧只发布到总线，不再放入 store_queue
+        self.frame_bus: Optional[FrameBus] = None
 
         # 切换摄像头信号，其中存放新的摄像机地址
         self._switch_camera_signal = mp.Queue(10)
@@ -496,8 +609,42 @@ class MultiprocessCamera(object):
         # if address:
         #     logger.debug(f"read frame from {address}")
         with self.butcher_knife:
+            if isinstance(stream, RTSPCapture):
+                # 解码时直接缩放到设置的分辨率，_frame_resize_filter 无需再缩放
+                setting_param = self.get_setting_camera_param()
+                return stream.read(width=setting_param.video_width,
+                                   height=setting_param.video_height)
             return stream.read()
 
+    def grab_frame(self, stream, address=None) -> bool:
+        """跳过一帧: 只读取不转换(cv2 为 grab 不 retrieve)"""
+        if CameraAddressUtil.is_file_address(address):
+            self._fake_read_time()
+        with self.butcher_knife:
+            if isinstance(stream, RTSPCapture):
+                skip_decode = self.video_fps <= self.KEYFRAME_SKIP_MAX_FPS
+                if skip_decode:
+                    self._check_keyframe_interval(stream)
+                return stream.grab(skip_decode=skip_decode)
+            return stream.grab()
+
+    def _check_keyframe_interval(self, stream: RTSPCapture):
+        """
+            只解码关键帧时实际帧率不高于关键帧频率，
+            关键帧间隔长于目标(休息)帧率的帧间隔时提示，每个连接只提示一次
+        """
+        interval = stream.keyframe_interval
+        if (interval is None or stream.keyframe_interval_warned
+                or interval <= 1 / max(self.video_fps, 1)):
+            return
+        stream.keyframe_interval_warned = True
+        logging.warning(
+            f"[camera] keyframe interval {round(interval, 2)}s is longer "
+            f"than the target frame interval "
+            f"{round(1 / max(self.video_fps, 1), 2)}s, frames are only "
+            f"decoded at keyframes, actual fps: {round(1 / interval, 2)}, "
+            f"shorten the camera GOP to get {self.video_fps} fps")
+
     def is_ip_camera(self):
         return not str(self.address).isdigit()
 
@@ -782,10 +929,13 @@ class MultiprocessCamera(object):
             cv2.imshow(self.address, frame_box.frame)
             cv2.waitKey(1)
 
+    def _next_frame_fps_index(self):
+        if self._frame_fsp_index + 1 > self.stream_video_fps:
+            return 1
+        return self._frame_fsp_index + 1
+
     def _plus_frame_fps_index(self):
-        self._frame_fsp_index += 1
-        if self._frame_fsp_index > self.stream_video_fps:
-            self._frame_fsp_index = 1
+        self._frame_fsp_index = self._next_frame_fps_index()
 
     def reading_frames(self):
         try:
@@ -802,35 +952,38 @@ class MultiprocessCamera(object):
                 self._check_camera_params_adjust_signal()
                 self._check_switch_camera_signal()
                 self._ensure_stream_opened()
-                grabbed, _frame = self.read_frame(self.stream, self.address)
+                if self._drop_frame_index_map.get(
+                        self._next_frame_fps_index()):
+                    # 要丢弃的帧在解码/转换前跳过
+                    grabbed, _frame = self.grab_frame(self.stream,
+                                                      self.address), None
+                    if grabbed:
+                        self._plus_frame_fps_index()
+                        continue
+                else:
+                    grabbed, _frame = self.read_frame(self.stream,
+                                                      self.address)
                 if grabbed:
                     self._plus_frame_fps_index()
-                    if self._drop_frame_index_map.get(self._frame_fsp_index):
-                        # print(f"drop: {self._frame_fsp_index}")
-                        continue
                     frame_box = FrameBox(_frame, fps=self.video_fps)
+                    frame_box.mark_stage(FrameStage.READ,
+                                         stage_time=frame_box.frame_ctime)
 
                     # 无条件转为 设置的 分辨率
                     resized_frame = self._frame_resize_filter(frame_box.frame)
+                    frame_box.mark_stage(FrameStage.RESIZE)
                     # 成功读取到视频帧，才视作已连接
                     self._confirm_connected()
                     self._check_camera_params_adjust_result(resized_frame)
 
                     frame_box.frame = resized_frame
                     last_frame = frame_box
-                    if self.store_queue.full():
-                        # 保持读取摄像头最新的数据
-                        self.store_queue.abandon_one()
-                    with self.butcher_knife:
-                        self.store_queue.put(frame_box)
+                    self._output_frame(frame_box)
                 elif (CameraAddressUtil.is_file_address(self.address)
                       and last_frame is not None):
-                    if self.store_queue.full():
-                        self.store_queue.abandon_one()
                     last_frame.frame_id = unique_time_id()
                     last_frame.frame_ctime = time.perf_counter()
-                    with self.butcher_knife:
-                        self.store_queue.put(last_frame)
+                    self._output_frame(last_frame)
                 elif self.read_failed_count > self.READ_FRAME_FAILED_TOLERATE:
                     logging.warning(
                         f"[camera]: read frame failed, "
@@ -856,6 +1009,19 @@ class MultiprocessCamera(object):
             """)
             self.release()
 
+    def _output_frame(self, frame_box: FrameBox):
+        if self.frame_bus is not None:
+            with self.butcher_knife:
+                self.frame_bus.publish(frame_box.frame,
+                                       meta=frame_box.bus_meta())
+            return
+
+        if self.store_queue.full():
+            # 保持读取摄像头最新的数据
+            self.store_queue.abandon_one()
+        with self.butcher_knife:
+            self.store_queue.put(frame_box)
+
     def clear_buffer(self):
         buffer_size = self.store_queue.qsize()
         if not buffer_size:
@@ -0,0 +1,102 @@
+"""
+    流水线各阶段延迟直方图
+
+    计数存放在共享内存(mp.Array)中，在主进程创建后，各个工作进程都可以直接写入，
+    主进程可随时读取汇总，用于 /debug/latency
+"""
+import bisect
+import multiprocessing as mp
+from typing import *
+
+from watchdog.configs.constants import FrameStage
+
+if TYPE_CHECKING:
+    from watchdog.utils.util_camera import FrameBox
+
+
+class StageLatencyStats(object):
+    # 直方图桶上限(ms)，最后还有一个 +inf 桶
+    BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self, stages: Sequence[str] = FrameStage.ORDERED):
+        self.stages = list(stages)
+        self._stage_index = {stage: i for i, stage in enumerate(self.stages)}
+        self._bucket_num = len(self.BUCKETS_MS) + 1
+        self._counts = mp.Array("Q", len(self.stages) * self._bucket_num)
+        self._sums = mp.Array("d", len(self.stages))
+        self._maxs = mp.Array("d", len(self.stages))
+
+    def observe(self, stage: str, cost_ms: float):
+        """
+        :param stage: 阶段
+        :param cost_ms: 从相机读取到该阶段完成的耗时
+        """
+        index = self._stage_index.get(stage)
+        if index is None:
+            return
+        bucket = bisect.bisect_left(self.BUCKETS_MS, cost_ms)
+        with self._counts.get_lock():
+            self._counts[index * self._bucket_num + bucket] += 1
+            self._sums[index] += cost_ms
+            if cost_ms > self._maxs[index]:
+                self._maxs[index] = cost_ms
+
+    def observe_frame(self, frame_box: "FrameBox",
+                      stages: Optional[Sequence[str]] = None):
+        """记录帧上已打点的各阶段耗时, stages 为空时记录全部"""
+        for stage in (stages if stages is not None
+                      else list(frame_box.stage_times)):
+            cost_ms = frame_box.stage_ms(stage)
+            if cost_ms is not None:
+                self.observe(stage, cost_ms)
+
+    def _stage_counts(self, index) -> List[int]:
+        start = index * self._bucket_num
+        return list(self._counts[start: start + self._bucket_num])
+
+    def _percentile(self, counts: List[int], q) -> float:
+        """根据直方图估算分位数，在桶内做线性插值"""
+        total = sum(counts)
+        if not total:
+            return 0
+        target = total * q / 100
+        passed = 0
+        for bucket, count in enumerate(counts):
+            if passed + count >= target and count:
+                low = self.BUCKETS_MS[bucket - 1] if bucket > 0 else 0
+                high = (self.BUCKETS_MS[bucket]
+                        if bucket < len(self.BUCKETS_MS)
+                        else self.BUCKETS_MS[-1] * 2)
+                return round(low + (high - low) * (target - passed) / count,
+                             2)
+            passed += count
+        return self.BUCKETS_MS[-1]
+
+    def summary(self) -> Dict:
+        summary = {}
+        with self._counts.get_lock():
+            for index, stage in enumerate(self.stages):
+                counts = self._stage_counts(index)
+                total = sum(counts)
+                if not total:
+                    continue
+                bucket_names = [f"<={b}ms" for b in self.BUCKETS_MS]
+                bucket_names.append(f">{self.BUCKETS_MS[-1]}ms")
+                summary[stage] = {
+                    "count": total,
+                    "avg_ms": round(self._sums[index] / total, 2),
+                    "max_ms": round(self._maxs[index], 2),
+                    "p50_ms": self._percentile(counts, 50),
+                    "p95_ms": self._percentile(counts, 95),
+                    "p99_ms": self._percentile(counts, 99),
+                    "buckets": dict(zip(bucket_names, counts)),
+                }
+        return summary
+
+    def reset(self):
+        with self._counts.get_lock():
+            for i in range(len(self._counts)):
+                self._counts[i] = 0
+            for i in range(len(self.stages)):
+                self._sums[i] = 0
+                self._maxs[i] = 0
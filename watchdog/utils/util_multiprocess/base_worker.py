@@ -348,7 +348,16 @@ class BaseWorker(ABC):
         return self._worker
 
     def get_queue_item(self, queue: mp.Queue, queue_name="", timeout=None,
-                       wait_item=False):
+                       wait_item=False, lease=False):
+        """
+
+        :param queue:
+        :param queue_name:
+        :param timeout:
+        :param wait_item:
+        :param lease: 仅 FastQueue 支持，租借模式获取，使用完毕后需调用 release()
+        :return:
+        """
 
         if queue.qsize() == 0:
             if timeout is None or not wait_item:
@@ -361,7 +370,10 @@ class BaseWorker(ABC):
         timeout = self.Q_GET_TIMEOUT if timeout is None else timeout
         with self.butcher_knife:
             try:
-                queue_item = queue.get(timeout=timeout)
+                if lease:
+                    queue_item = queue.get(timeout=timeout, lease=True)
+                else:
+                    queue_item = queue.get(timeout=timeout)
             except Empty:
                 if queue.qsize() > 0:
                     logging.warning(
@@ -0,0 +1,362 @@
+"""
+    单生产者多消费者的帧广播总线
+
+    生产者(相机进程)每一帧只写一次共享内存, 任意数量的订阅者各自维护读取游标与丢帧策略,
+    新增消费者不再需要额外的一次整帧 pickle + 共享内存拷贝
+
+    共享内存布局: slot_num 个槽位, 第 seq 帧写入 seq % slot_num 号槽位
+        | seq(Q) | meta_len(Q) | data_len(Q) | meta(pickle) | frame bytes |
+
+    槽位 seq 作为顺序锁(seqlock): 写入前置 0, 写完置为帧序号,
+    读者拷贝前后各读一次, 两次都等于期望序号才算读到完整的一帧
+
+    读者每帧拷贝一次: 生产者从不等待读者(慢消费者不能拖慢相机), 槽位随时可能被覆盖,
+    而检测/标注持有帧的时间(几十到几百毫秒)远超过生产者绕回同一槽位的间隔,
+    直接引用槽位无法保证帧完整; 这一次拷贝替代了队列方式下每个消费者的
+    pickle + 写共享内存 + deepcopy, 逐帧检测时复用缓冲区(reuse_buffer)也不再分配内存;
+    标注器要把帧继续放入异步序列化的队列, 需持有自己的一份, 不能复用缓冲区
+"""
+import os
+import time
+import pickle
+import struct
+import logging
+import multiprocessing as mp
+from typing import *
+
+import numpy as np
+
+from watchdog.utils.util_multiprocess.shared_memory import EnhanceSharedMemory
+
+
+class FrameBus(object):
+    # 总是读取最新帧, 中间的帧直接跳过
+    POLICY_LATEST = "latest"
+    # 按顺序逐帧读取, 只有落后超过槽位数时才丢帧
+    POLICY_SEQUENTIAL = "sequential"
+
+    SLOT_HEADER_FMT = "QQQ"
+    SLOT_HEADER_SIZE = struct.calcsize(SLOT_HEADER_FMT)
+    # 为帧元数据预留的空间
+    META_RESERVE = 4096
+    ALIGNMENT = 64
+
+    def __init__(self, slot_num=16, name="frame_bus"):
+        self.name = name
+        self.slot_num = slot_num
+
+        # 最新发布的帧序号, 从 1 开始
+        self._seq = mp.Value("Q", 0)
+        # 共享内存段信息, 帧尺寸变大时, 生产者会重新申请, generation + 1
+        self._generation = mp.Value("i", 0)
+        self._shm_name = mp.Array("c", 64)
+        self._slot_size = mp.Value("Q", 0)
+        self._cond = mp.Condition()
+
+        self._subscribers: Dict[str, "FrameBusSubscriber"] = {}
+
+        # 以下为进程内状态
+        self._shm: Optional[EnhanceSharedMemory] = None
+        self._shm_pid = None
+        self._shm_generation = -1
+        self._shm_slot_size = 0
+        self._is_owner = False
+
+    @property
+    def latest_seq(self):
+        return self._seq.value
+
+    @classmethod
+    def _align(cls, size):
+        return (size + cls.ALIGNMENT - 1) // cls.ALIGNMENT * cls.ALIGNMENT
+
+    def _slot_start(self, seq):
+        return (seq % self.slot_num) * self._shm_slot_size
+
+    def _close_shm(self):
+        if self._shm is None:
+            return
+        if self._shm_pid == os.getpid():
+            try:
+                self._shm.close()
+            except BufferError:
+                pass
+            if self._is_owner:
+                try:
+                    self._shm.unlink()
+                except FileNotFoundError:
+                    pass
+        self._shm = None
+        self._is_owner = False
+
+    def _unlink_previous_segment(self):
+        """
+            生产进程(相机进程)重启后, 上一个生产进程的共享内存段不会再写入,
+            且该进程被强制结束时没有删除, 由新的生产进程删除
+        """
+        with self._cond:
+            shm_name = self._shm_name.value.decode()
+        if not shm_name:
+            return
+        try:
+            shm = EnhanceSharedMemory(name=shm_name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        logging.info(f"[{self.name}] previous frame bus segment unlinked: "
+                     f"{shm_name}")
+
+    def _ensure_segment(self, need_size):
+        """生产者: 确保槽位足够放下当前帧"""
+        is_producing = self._is_owner and self._shm_pid == os.getpid()
+        if (self._shm is not None and is_producing
+                and self._shm_slot_size >= need_size):
+            return
+
+        self._close_shm()
+        if not is_producing:
+            self._unlink_previous_segment()
+        slot_size = self._align(need_size + self.META_RESERVE)
+        self._shm = EnhanceSharedMemory(create=True,
+                                        size=slot_size * self.slot_num)
+        self._shm_pid = os.getpid()
+        self._shm_slot_size = slot_size
+        self._is_owner = True
+        with self._cond:
+            self._shm_name.value = self._shm.name.lstrip("/").encode()
+            self._slot_size.value = slot_size
+            self._generation.value += 1
+            self._shm_generation = self._generation.value
+        logging.info(f"[{self.name}] frame bus segment created, "
+                     f"slot_size: {slot_size}, slot_num: {self.slot_num}")
+
+    def _attach(self) -> bool:
+        """订阅者: 挂载(或重新挂载)生产者当前的共享内存段"""
+        if (self._shm is not None and self._shm_pid == os.getpid()
+                and self._shm_generation == self._generation.value):
+            return True
+        with self._cond:
+            generation = self._generation.value
+            shm_name = self._shm_name.value.decode()
+            slot_size = self._slot_size.value
+        if not shm_name:
+            return False
+
+        self._close_shm()
+        try:
+            self._shm = EnhanceSharedMemory(name=shm_name)
+        except FileNotFoundError:
+            # 生产者刚好在重新申请, 下次再挂载
+            return False
+        self._shm_pid = os.getpid()
+        self._shm_generation = generation
+        self._shm_slot_size = slot_size
+        return True
+
+    def publish(self, frame: np.ndarray, meta=None) -> int:
+        """
+            发布一帧, 只能在单个生产进程中调用
+        :param frame:
+        :param meta: 帧的元数据, 需可 pickle
+        :return: 帧序号
+        """
+        frame = np.ascontiguousarray(frame)
+        meta_bytes = pickle.dumps((meta, frame.shape, frame.dtype.str),
+                                  protocol=pickle.HIGHEST_PROTOCOL)
+        meta_len = len(meta_bytes)
+        data_len = frame.nbytes
+        self._ensure_segment(self.SLOT_HEADER_SIZE + meta_len + data_len)
+
+        seq = self._seq.value + 1
+        buf = self._shm.buf
+        slot_start = self._slot_start(seq)
+        meta_start = slot_start + self.SLOT_HEADER_SIZE
+        data_start = meta_start + meta_len
+
+        struct.pack_into("Q", buf, slot_start, 0)
+        struct.pack_into("QQ", buf, slot_start + 8, meta_len, data_len)
+        buf[meta_start: data_start] = meta_bytes
+        buf[data_start: data_start + data_len] = memoryview(frame).cast("B")
+        struct.pack_into("Q", buf, slot_start, seq)
+
+        with self._cond:
+            self._seq.value = seq
+            self._cond.notify_all()
+        return seq
+
+    def wait_seq(self, after: int, timeout=None) -> Optional[int]:
+        """等待序号大于 after 的帧发布, 超时返回 None"""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq.value > after,
+                                       timeout=timeout):
+                return None
+            return self._seq.value
+
+    def read(self, seq: int,
+             out: Optional[np.ndarray] = None) -> Optional[Tuple[Any,
+                                                                np.ndarray]]:
+        """
+            读取指定序号的帧(拷贝), 该槽位已被覆盖或正在写入时返回 None
+        :param seq:
+        :param out: 可复用的帧缓冲区, 形状与类型一致时直接拷贝到其中
+        :return: (meta, frame)
+        """
+        if not self._attach():
+            return None
+        buf = self._shm.buf
+        slot_start = self._slot_start(seq)
+        if struct.unpack_from("Q", buf, slot_start)[0] != seq:
+            return None
+        meta_len, data_len = struct.unpack_from("QQ", buf, slot_start + 8)
+        meta_start = slot_start + self.SLOT_HEADER_SIZE
+        data_start = meta_start + meta_len
+        if data_start + data_len > slot_start + self._shm_slot_size:
+            return None
+        try:
+            meta, shape, dtype = pickle.loads(buf[meta_start: data_start])
+        except Exception:
+            # 正在被覆盖的槽位
+            return None
+
+        if (out is None or out.shape != tuple(shape)
+                or out.dtype.str != dtype):
+            out = np.empty(shape, dtype=dtype)
+        memoryview(out).cast("B")[:] = buf[data_start: data_start + data_len]
+
+        if struct.unpack_from("Q", buf, slot_start)[0] != seq:
+            return None
+        return meta, out
+
+    def subscribe(self, name, policy=POLICY_LATEST, reuse_buffer=False,
+                  item_factory: Optional[Callable] = None,
+                  partition: Optional[Tuple[int, int]] = None
+                  ) -> "FrameBusSubscriber":
+        """
+        :param name: 订阅者名称
+        :param policy: 丢帧策略, POLICY_LATEST / POLICY_SEQUENTIAL
+        :param reuse_buffer: 复用帧缓冲区, 上一次返回的帧会被下一次读取覆盖,
+                             只适合读完即丢弃的消费者
+        :param item_factory: item_factory(meta, frame), 构造返回对象
+        :param partition: (index, num), 多个订阅者分摊同一路帧时使用,
+                          只读取 seq % num == index 的帧
+        :return:
+        """
+        subscriber = FrameBusSubscriber(self, name=name, policy=policy,
+                                        reuse_buffer=reuse_buffer,
+                                        item_factory=item_factory,
+                                        partition=partition)
+        self._subscribers[name] = subscriber
+        return subscriber
+
+    def stats(self) -> Dict:
+        return {
+            "latest_seq": self.latest_seq,
+            "generation": self._generation.value,
+            "slot_num": self.slot_num,
+            "slot_size": self._slot_size.value,
+            "subscribers": {name: sub.stats()
+                            for name, sub in self._subscribers.items()}
+        }
+
+
+class FrameBusSubscriber(object):
+
+    def __init__(self, bus: FrameBus, name, policy=FrameBus.POLICY_LATEST,
+                 reuse_buffer=False, item_factory: Optional[Callable] = None,
+                 partition: Optional[Tuple[int, int]] = None):
+        if policy not in (FrameBus.POLICY_LATEST, FrameBus.POLICY_SEQUENTIAL):
+            raise TypeError(f"Unknown frame bus policy: {policy}")
+        self.bus = bus
+        self.name = name
+        self.policy = policy
+        self.reuse_buffer = reuse_buffer
+        self.item_factory = item_factory
+        self.partition_index, self.partition_num = (
+            partition if partition is not None else (0, 1))
+
+        self.received_num = mp.Value("Q", 0)
+        self.dropped_num = mp.Value("Q", 0)
+
+        # 进程内读取游标, 第一次读取从最新帧开始
+        self._cursor: Optional[int] = None
+        self._buffer: Optional[np.ndarray] = None
+
+    def _align_up(self, seq):
+        """不小于 seq 且属于本分区的最小序号"""
+        return seq + (self.partition_index - seq) % self.partition_num
+
+    def _align_down(self, seq):
+        """不大于 seq 且属于本分区的最大序号"""
+        return seq - (seq - self.partition_index) % self.partition_num
+
+    def _min_seq(self):
+        """下一次允许读取的最小序号"""
+        return self._align_up(1 if self._cursor is None else self._cursor + 1)
+
+    def _next_seq(self, latest_seq):
+        if self._cursor is None or self.policy == FrameBus.POLICY_LATEST:
+            return self._align_down(latest_seq)
+        # 生产者下一帧会覆盖 latest_seq - slot_num + 1 号槽位, 再往后一帧才安全
+        oldest_seq = max(latest_seq - self.bus.slot_num + 2, 1)
+        seq = self._align_up(max(self._cursor + 1, oldest_seq))
+        if seq > latest_seq:
+            seq = self._align_down(latest_seq)
+        return seq
+
+    def pending_num(self) -> int:
+        """本分区已发布但还未读取的帧数, 不超过总线中能保留的帧数"""
+        latest_seq = self.bus.latest_seq
+        min_seq = self._min_seq()
+        if latest_seq < min_seq:
+            return 0
+        if self._cursor is None:
+            # 第一次读取从最新帧开始
+            return 1
+        return min((latest_seq - min_seq) // self.partition_num + 1,
+                   max(self.bus.slot_num // self.partition_num, 1))
+
+    def get(self, timeout=None):
+        """
+            读取下一帧, 超时返回 None
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            remain = (None if deadline is None
+                      else max(deadline - time.perf_counter(), 0))
+            min_seq = self._min_seq()
+            latest_seq = self.bus.wait_seq(min_seq - 1, timeout=remain)
+            if latest_seq is None:
+                return None
+
+            seq = self._next_seq(latest_seq)
+            if self._cursor is not None and seq > min_seq:
+                self.dropped_num.value += (seq - min_seq) // self.partition_num
+
+            item = self.bus.read(
+                seq, out=self._buffer if self.reuse_buffer else None)
+            self._cursor = seq
+            if item is None:
+                # 读取过程中被覆盖
+                self.dropped_num.value += 1
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return None
+                continue
+
+            meta, frame = item
+            if self.reuse_buffer:
+                self._buffer = frame
+            self.received_num.value += 1
+            if self.item_factory is not None:
+                return self.item_factory(meta, frame)
+            return meta, frame
+
+    def stats(self) -> Dict:
+        return {
+            "policy": self.policy,
+            "received_num": self.received_num.value,
+            "dropped_num": self.dropped_num.value,
+        }
@@ -29,6 +29,8 @@ def new_process(pro_cls=mp.Process, daemon=None, join=False):
 
 class ProcessController(object):
     """控制进程：可以暂停、恢复、杀死、重启"""
+    # 退出时等待子进程结束的秒数
+    EXIT_KILL_TIMEOUT = 3
 
     @classmethod
     def pause_process(cls, pid: int):
@@ -40,6 +42,14 @@ class ProcessController(object):
         os.system(f"kill -CONT {pid}")
         logging.info(f"resumed process from pause: {pid}")
 
+    @classmethod
+    def is_process_alive(cls, pid: int) -> bool:
+        """进程存在且不是僵尸进程"""
+        try:
+            return psutil.Process(pid).status() != psutil.STATUS_ZOMBIE
+        except NoSuchProcess:
+            return False
+
     @classmethod
     @ignore_assigned_error((FileNotFoundError, NoSuchProcess))
     def kill_sub_processes(cls, pid=None, excludes=None, timeout=0):
@@ -113,8 +123,10 @@ class ProcessController(object):
 
     @classmethod
     def register_kill_all_subprocess_at_exit(cls):
-        # kill all sub process at exit
-        atexit.register(cls.kill_sub_processes, pid=os.getpid())
+        # kill all sub process at exit,
+        # 忽略 SIGINT 的子进程(如 mp.Manager 的服务进程)超时后强制杀死，避免退出时卡住
+        atexit.register(cls.kill_sub_processes, pid=os.getpid(),
+                        timeout=cls.EXIT_KILL_TIMEOUT)
 
 
 @ignore_assigned_error((FileNotFoundError, NoSuchProcess))
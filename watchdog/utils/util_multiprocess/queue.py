@@ -23,8 +23,10 @@ from multiprocessing.util import debug, info, Finalize, is_exiting
 
 from watchdog.utils.util_log import set_scripts_logging, time_cost_log
 from watchdog.utils.util_stack import find_caller
-from watchdog.utils.util_multiprocess.process import new_process
+from watchdog.utils.util_multiprocess.process import (new_process,
+                                                      ProcessController)
 from watchdog.utils.util_multiprocess.shared_memory import EnhanceSharedMemory
+from watchdog.utils.util_multiprocess.ring_buffer import ShmRingBuffer
 
 
 @new_process()
@@ -155,26 +157,113 @@ class Pickle5(object):
         return pickle.Unpickler(file, buffers=buffers).load()
 
 
+# close 时仍有外部引用(如租借出去的帧)的共享内存, [(shm, on_closed)]
+_deferred_closes: List[Tuple[Any, Optional[Callable]]] = []
+_deferred_closes_lock = threading.Lock()
+
+
+def close_or_defer(shm, on_closed: Optional[Callable] = None) -> bool:
+    """
+        关闭共享内存映射, 成功后才调用 on_closed (放回复用队列 / 删除);
+        仍有外部引用时 close 抛 BufferError, 此时推迟到引用释放后再关闭,
+        避免生产者覆盖仍在被读取的内存
+    """
+    try:
+        shm.close()
+    except BufferError:
+        with _deferred_closes_lock:
+            _deferred_closes.append((shm, on_closed))
+        return False
+    if on_closed is not None:
+        on_closed()
+    return True
+
+
+def retry_deferred_closes():
+    if not _deferred_closes:
+        return
+    with _deferred_closes_lock:
+        pending = _deferred_closes[:]
+        _deferred_closes.clear()
+    for shm, on_closed in pending:
+        close_or_defer(shm, on_closed)
+
+
+class ShmRingAttachments(object):
+    """
+        消费进程 attach 的环形缓冲区, 按名称缓存;
+        生产进程换用新的缓冲区(帧尺寸变大)后旧缓冲区不会再写入,
+        待其所有槽位释放后关闭映射
+    """
+
+    def __init__(self):
+        self._rings: Dict[str, ShmRingBuffer] = {}
+        # 缓冲区所属的生产进程
+        self._ring_pids: Dict[str, int] = {}
+        self._retired_rings: List[ShmRingBuffer] = []
+        self._lock = threading.Lock()
+
+    def get(self, name: str, pid: int = 0) -> ShmRingBuffer:
+        with self._lock:
+            ring = self._rings.get(name)
+            if ring is not None:
+                return ring
+            ring = ShmRingBuffer.attach(name)
+            if pid:
+                for old_name, old_pid in list(self._ring_pids.items()):
+                    if old_pid == pid:
+                        self._ring_pids.pop(old_name)
+                        self._retired_rings.append(self._rings.pop(old_name))
+            self._rings[name] = ring
+            self._ring_pids[name] = pid
+            return ring
+
+    def close_retired(self):
+        if not self._retired_rings:
+            return
+        with self._lock:
+            idle_rings = [ring for ring in self._retired_rings
+                          if ring.is_idle()]
+            for ring in idle_rings:
+                self._retired_rings.remove(ring)
+        for ring in idle_rings:
+            close_or_defer(ring)
+
+
 class SharedBufferHeader(object):
 
     def __init__(self, shared_name, shared_size,
                  memory_views_ranges: List[Tuple[int, int]],
                  shm_reuse_queue: Optional[mp.Queue] = None,
-                 is_shm_reuse=False,
+                 is_shm_reuse=False, ring_name=None, slot_index=None,
+                 ring_pid=0,
+                 ring_cache: Optional[ShmRingAttachments] = None,
                  **kwargs):
         self.shared_name = shared_name
         self.memory_views_ranges = memory_views_ranges
         self.shared_size = shared_size
         self.is_shm_reuse = is_shm_reuse
+        # 数据存放于环形缓冲区时, 记录缓冲区名称与槽位
+        self.ring_name = ring_name
+        self.slot_index = slot_index
+        self.ring_pid = ring_pid
 
         self._buf_memory_views: List[memoryview] = None
         self._shared_mem: Optional[EnhanceSharedMemory] = None
         self._recv_datas = None
         self._shm_reuse_queue: Optional[mp.Queue] = shm_reuse_queue
+        # 当前进程已 attach 的环形缓冲区
+        self._ring_cache: Optional[ShmRingAttachments] = ring_cache
+        self._ring: Optional[ShmRingBuffer] = None
 
-    # @time_cost_log_with_desc(min_cost=0.5)
     def __enter__(self):
-        self._buf_memory_views, self._shared_mem = self.recv_from_shared_mem()
+        if self.ring_name is not None:
+            self._buf_memory_views = self.recv_from_ring()
+        elif self.shared_name is not None:
+            self._buf_memory_views, self._shared_mem = \
+                self.recv_from_shared_mem()
+        else:
+            self._buf_memory_views = []
 
     # @time_cost_log_with_desc(min_cost=0.5)
     def __exit__(self, exc_type, exc_val, exc_tb):
@@ -186,51 +275,85 @@ class SharedBufferHeader(object):
             del self._recv_datas
 
         # print(f"t2 cost: {round((time.perf_counter() - start) * 1000)} ms")
+        retry_deferred_closes()
+        if self.ring_name is not None:
+            # 环形缓冲区只需释放槽位，无需关闭/删除共享内存
+            (self._ring or self._get_ring()).release_slot(self.slot_index)
+            self._ring = None
+            self._get_ring_cache().close_retired()
+            return
 
-        def _release():
-            if self._shared_mem is not None:
-                self._shared_mem.close()
-                if self._shm_reuse_queue is not None:
+        def _recycle(shared_mem: EnhanceSharedMemory):
+            if self._shm_reuse_queue is not None:
+                try:
+                    self._shm_reuse_queue.put(shared_mem.name, timeout=0.3)
+                except Full:
                     try:
-                        self._shm_reuse_queue.put(self._shared_mem.name,
-                                                  timeout=0.3)
-                    except Full:
-                        try:
-                            self._shared_mem.unlink()
-                        except FileNotFoundError:
-                            pass
-                else:
-                    self._shared_mem.unlink()
+                        shared_mem.unlink()
+                    except FileNotFoundError:
+                        pass
+            else:
+                shared_mem.unlink()
+
+        def _release(shared_mem: EnhanceSharedMemory):
+            # 仍有外部引用(如租借帧的视图还在被读取)时推迟归还, 不能交给生产者复用
+            close_or_defer(shared_mem, on_closed=lambda: _recycle(shared_mem))
 
-        # _release()
-        threading.Thread(target=_release).start()
+        if self._shared_mem is not None:
+            shared_mem, self._shared_mem = self._shared_mem, None
+            threading.Thread(target=_release, args=(shared_mem,)).start()
         # print(f"t3 cost: {round((time.perf_counter() - start) * 1000)} ms")
 
     def pickle_load(self, pickle_engine: Pickle5, datas, abandon=False):
         """ call in `with context` """
+        if abandon:
+            return None
         self._recv_datas = pickle_engine.loads(
             datas, buffers=self._buf_memory_views)
         # start = time.perf_counter()
-        if abandon:
-            return None
 
         recv_datas = deepcopy(self._recv_datas)
         # print(f"copy cost: {round((time.perf_counter() - start) * 1000)} ms")
         return recv_datas
 
+    def lease_load(self, pickle_engine: Pickle5, datas):
+        """
+            租借模式: 不做 deepcopy, 返回的对象直接引用共享内存中的数据,
+            对象需实现 attach_lease, 使用完毕后由对象调用 release 归还共享内存;
+            不支持租借的对象, 依旧拷贝后立即归还
+        """
+        self.__enter__()
+        recv_datas = pickle_engine.loads(datas,
+                                         buffers=self._buf_memory_views)
+        if not self.memory_views_ranges:
+            self.release()
+        elif hasattr(recv_datas, "attach_lease"):
+            recv_datas.attach_lease(self.release)
+        else:
+            recv_datas = deepcopy(recv_datas)
+            self.release()
+        return recv_datas
+
+    def release(self):
+        self.__exit__(None, None, None)
+
     def pack_header(self):
-        buf_headers = json.dumps(self.__dict__).encode()
+        buf_headers = json.dumps(
+            {k: v for k, v in self.__dict__.items()
+             if not k.startswith("_")}).encode()
         buf_headers_len = len(buf_headers)
         buf_headers_len_pack = struct.pack("Q", buf_headers_len)
         return buf_headers_len_pack + buf_headers
 
     @classmethod
-    def unpack_header(cls, bytes_obj, shm_reuse_queue: mp.Queue) \
+    def unpack_header(cls, bytes_obj, shm_reuse_queue: mp.Queue,
+                      ring_cache: Optional[ShmRingAttachments] = None) \
             -> Tuple["SharedBufferHeader", bytes]:
         headers_len = struct.unpack("Q", bytes_obj[0:8])[0]
         try:
             headers = json.loads(bytes_obj[8: 8 + headers_len])
             headers["shm_reuse_queue"] = shm_reuse_queue
+            headers["ring_cache"] = ring_cache
         except Exception:
             print(bytes_obj)
             raise
@@ -273,7 +396,9 @@ class SharedBufferHeader(object):
         memory_views_ranges = []
         memory_views_size = sum(lengths)
         if memory_views_size == 0:
-            memory_views_size = 1
+            # 没有带外数据，无需共享内存
+            return SharedBufferHeader(shared_name=None, shared_size=0,
+                                      memory_views_ranges=[])
 
         shared_mem = cls.fetch_from_shm_reuse_queue(
             memory_views_size, shm_reuse_queue)
@@ -299,6 +424,38 @@ class SharedBufferHeader(object):
                                   memory_views_ranges=memory_views_ranges,
                                   is_shm_reuse=is_shm_reuse)
 
+    @classmethod
+    def create_in_ring(cls, mem_views: List[memoryview], lengths: List[int],
+                       ring: ShmRingBuffer) -> Optional["SharedBufferHeader"]:
+        """
+            将数据直接写入环形缓冲区的空闲槽位，没有空闲槽位时返回 None
+        """
+        slot_index = ring.acquire_slot()
+        if slot_index is None:
+            return None
+        memory_views_ranges = ring.write(slot_index, mem_views, lengths)
+        return SharedBufferHeader(shared_name=None,
+                                  shared_size=sum(lengths),
+                                  memory_views_ranges=memory_views_ranges,
+                                  ring_name=ring.name,
+                                  slot_index=slot_index,
+                                  ring_pid=os.getpid())
+
+    def _get_ring_cache(self) -> ShmRingAttachments:
+        if self._ring_cache is None:
+            self._ring_cache = ShmRingAttachments()
+        return self._ring_cache
+
+    def _get_ring(self) -> ShmRingBuffer:
+        return self._get_ring_cache().get(self.ring_name, self.ring_pid)
+
+    def recv_from_ring(self) -> List[memoryview]:
+        # 持有缓冲区引用, 缓冲区被停用后依旧能释放槽位
+        self._ring = self._get_ring()
+        self._ring.set_holder(self.slot_index, os.getpid())
+        return self._ring.slot_views(self.slot_index,
+                                     self.memory_views_ranges)
+
     # @time_cost_log_with_desc(min_cost=0, log_method=logging.info)
     def recv_from_shared_mem(self) \
             -> Tuple[List[memoryview], EnhanceSharedMemory]:
@@ -313,10 +470,20 @@ class SharedBufferHeader(object):
 
 class FastQueue(Queue):
     """
+        带外数据 (如 ndarray) 通过共享内存传输, 管道中只传输头信息与 pickle 数据
+
+        每个生产进程只申请一次固定槽位的共享内存环形缓冲区 (shm_ring_slots 个槽位),
+        数据直接写入空闲槽位; 槽位全部被占用时, 才退化为单独申请共享内存
+
+        各生产进程当前的缓冲区记录在共享内存中, 生产进程被杀死(如相机重启)后,
+        由下一个创建缓冲区的生产进程删除其留下的缓冲区
     """
+    # 记录缓冲区的生产进程数量上限
+    MAX_RING_PRODUCERS = 8
+    RING_NAME_SIZE = 32
 
     def __init__(self, maxsize=0, name="queue", use_out_band=True,
-                 shm_reuse_size=2):
+                 shm_reuse_size=2, shm_ring_slots=6):
         super().__init__(maxsize=maxsize, ctx=context._default_context)
         self.name = name
         self._use_out_band = use_out_band
@@ -324,10 +491,33 @@ class FastQueue(Queue):
         # 共享内存复用
         self._shm_reuse_queue = mp.Queue(maxsize=shm_reuse_size)
 
+        # 环形缓冲区槽位数量, 为 0 时不使用环形缓冲区
+        self._shm_ring_slots = shm_ring_slots
+        # 生产进程的环形缓冲区, 在 feed 线程中惰性创建
+        self._ring: Optional[ShmRingBuffer] = None
+        self._ring_pid = 0
+        # 各生产进程 pid 与其当前缓冲区名称
+        self._ring_owner_pids = mp.Array("i", self.MAX_RING_PRODUCERS)
+        self._ring_owner_names = mp.Array(
+            "c", self.MAX_RING_PRODUCERS * self.RING_NAME_SIZE, lock=False)
+        # 帧尺寸变大后被替换下来的缓冲区, 所有槽位释放后再删除
+        self._retired_rings: List[ShmRingBuffer] = []
+        # 消费进程已 attach 的环形缓冲区
+        self._ring_cache = ShmRingAttachments()
+
     def abandon_one(self, block=True, timeout=None):
         return self.get(block=block, timeout=timeout, abandon=True)
 
-    def get(self, block=True, timeout=None, abandon=False):
+    def get(self, block=True, timeout=None, abandon=False, lease=False):
+        """
+        :param block:
+        :param timeout:
+        :param abandon: 直接丢弃, 不反序列化
+        :param lease: 租借模式, 返回的对象(如 FrameBox)直接引用共享内存, 不拷贝,
+                      使用完毕后必须调用其 release() 或使用 with 语句归还;
+                      租借的对象不能再放入其他队列
+        :return:
+        """
 
         if self._closed:
             raise ValueError(f"Queue {self!r} is closed")
@@ -357,7 +547,10 @@ class FastQueue(Queue):
 
         if self._use_out_band:
             buf_header, real_datas = SharedBufferHeader.unpack_header(
-                res, self._shm_reuse_queue)
+                res, self._shm_reuse_queue, self._ring_cache)
+            if lease and not abandon:
+                return buf_header.lease_load(pickle_engine=self._pickler,
+                                             datas=real_datas)
 
             with buf_header:
                 recv_datas = buf_header.pickle_load(pickle_engine=self._pickler,
@@ -372,6 +565,79 @@ class FastQueue(Queue):
         #           f"\t\t\t unpickle cost: {cost} ms")
         return recv_datas
 
+    def _ring_owner_name(self, index: int) -> str:
+        start = index * self.RING_NAME_SIZE
+        return self._ring_owner_names[
+            start: start + self.RING_NAME_SIZE].rstrip(b"\0").decode()
+
+    def _register_ring(self, ring: ShmRingBuffer):
+        """
+            记录当前生产进程的缓冲区, 同时删除已退出的生产进程留下的缓冲区
+        """
+        pid = os.getpid()
+        with self._ring_owner_pids.get_lock():
+            index = None
+            for i in range(self.MAX_RING_PRODUCERS):
+                owner_pid = self._ring_owner_pids[i]
+                if owner_pid and owner_pid != pid:
+                    if ProcessController.is_process_alive(owner_pid):
+                        continue
+                    ShmRingBuffer.unlink_by_name(self._ring_owner_name(i))
+                    logging.info(f"[FastQueue-{self.name}] unlinked shm ring "
+                                 f"buffer of exited producer {owner_pid}: "
+                                 f"{self._ring_owner_name(i)}")
+                    self._ring_owner_pids[i] = 0
+                if index is None or owner_pid == pid:
+                    index = i
+            if index is None:
+                logging.warning(f"[FastQueue-{self.name}] too many producers, "
+                                f"shm ring buffer {ring.name} not registered")
+                return
+            name = ring.name.lstrip("/").encode()[:self.RING_NAME_SIZE]
+            start = index * self.RING_NAME_SIZE
+            self._ring_owner_names[start: start + self.RING_NAME_SIZE] = \
+                name.ljust(self.RING_NAME_SIZE, b"\0")
+            self._ring_owner_pids[index] = pid
+
+    def _ensure_ring(self, size) -> ShmRingBuffer:
+        if self._ring is not None and self._ring_pid != os.getpid():
+            # fork 继承下来的缓冲区属于其他生产进程，不能复用，
+            # 由其所属进程删除(该进程退出后由 _register_ring 删除)
+            self._ring = None
+            self._retired_rings = []
+
+        for ring in self._retired_rings[:]:
+            if ring.is_idle():
+                ring.close()
+                ring.unlink()
+                self._retired_rings.remove(ring)
+
+        if self._ring is None or self._ring.slot_size < size:
+            if self._ring is not None:
+                self._retired_rings.append(self._ring)
+            self._ring = ShmRingBuffer.create(self._shm_ring_slots, size)
+            self._ring_pid = os.getpid()
+            self._register_ring(self._ring)
+            logging.debug(f"[FastQueue-{self.name}] create shm ring buffer: "
+                          f"{self._ring.name}, slot_num: "
+                          f"{self._ring.slot_num}, slot_size: "
+                          f"{self._ring.slot_size}")
+        return self._ring
+
+    def _create_shared_buf_header(self, buf_mem_views: List[memoryview]) \
+            -> SharedBufferHeader:
+        lengths = [SharedBufferHeader.nbytes(memory_view)
+                   for memory_view in buf_mem_views]
+        if sum(lengths) > 0 and self._shm_ring_slots > 0:
+            ring = self._ensure_ring(sum(lengths))
+            shared_buf_header = SharedBufferHeader.create_in_ring(
+                buf_mem_views, lengths, ring)
+            if shared_buf_header is not None:
+                return shared_buf_header
+        # 环形缓冲区槽位已全部被占用, 单独申请共享内存
+        return SharedBufferHeader.create_one(buf_mem_views,
+                                             self._shm_reuse_queue)
+
     def _start_thread(self):
         debug('Queue._start_thread()')
 
@@ -445,8 +711,8 @@ class FastQueue(Queue):
 
                         # if buf_mem_views:
                         if self._use_out_band:
-                            shared_buf_header = SharedBufferHeader.create_one(
-                                buf_mem_views, self._shm_reuse_queue)
+                            shared_buf_header = \
+                                self._create_shared_buf_header(buf_mem_views)
                             buf_header_pack = shared_buf_header.pack_header()
                             p_obj = buf_header_pack + p_obj
 
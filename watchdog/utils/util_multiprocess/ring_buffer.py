@@ -0,0 +1,184 @@
+"""
+    基于共享内存的固定槽位环形缓冲区
+
+    每个队列在每个生产进程中只申请一次共享内存 (N 个槽位 × 单槽位最大字节数),
+    生产者直接把数据写入空闲槽位, 消费者通过槽位下标拿到零拷贝的 memoryview,
+    用完后释放槽位即可, 不再需要每一帧都 shm_open/mmap/unlink
+"""
+import time
+import struct
+from typing import *
+
+from watchdog.utils.util_multiprocess.process import ProcessController
+from watchdog.utils.util_multiprocess.shared_memory import EnhanceSharedMemory
+
+
+class ShmRingBuffer(object):
+    """
+        共享内存布局:
+            | slot_num(Q) | slot_size(Q) | head(Q) | slot_states(slot_num 字节) |
+            | holder_pids(slot_num × I) | slots... |
+
+        - head: 生产者下一次寻找空闲槽位的起点, 只由生产者更新
+        - slot_states: 每个槽位的占用状态, 生产者写入后置为占用, 消费者用完后置为空闲,
+                       逐个槽位记录状态, 多个消费者乱序释放也不会相互影响
+        - holder_pids: 读取该槽位的消费进程, 生产者写入时置 0;
+                       消费进程被杀死时槽位不会被释放, 没有空闲槽位时由生产者回收
+    """
+    HEADER_FMT = "QQQ"
+    HEADER_SIZE = struct.calcsize(HEADER_FMT)
+    # 槽位数据起始位置按 64 字节对齐
+    ALIGNMENT = 64
+    # 没有空闲槽位时, 检查持有者是否存活的最小间隔
+    RECLAIM_INTERVAL_SECS = 1
+
+    SLOT_FREE = 0
+    SLOT_BUSY = 1
+
+    def __init__(self, shm: EnhanceSharedMemory):
+        self._shm = shm
+        self.slot_num, self.slot_size, _ = struct.unpack_from(
+            self.HEADER_FMT, self._shm.buf, 0)
+        self._states_offset = self.HEADER_SIZE
+        self._pids_offset = self._align(self.HEADER_SIZE + self.slot_num)
+        self._slots_offset = self._align(self._pids_offset + 4 * self.slot_num)
+        self._last_reclaim_time = 0
+
+    @classmethod
+    def _align(cls, size):
+        return (size + cls.ALIGNMENT - 1) // cls.ALIGNMENT * cls.ALIGNMENT
+
+    @classmethod
+    def create(cls, slot_num: int, slot_size: int) -> "ShmRingBuffer":
+        slot_size = cls._align(max(int(slot_size), 1))
+        pids_offset = cls._align(cls.HEADER_SIZE + slot_num)
+        total_size = (cls._align(pids_offset + 4 * slot_num)
+                      + slot_num * slot_size)
+        shm = EnhanceSharedMemory(create=True, size=total_size)
+        struct.pack_into(cls.HEADER_FMT, shm.buf, 0, slot_num, slot_size, 0)
+        shm.buf[cls.HEADER_SIZE: pids_offset + 4 * slot_num] = \
+            bytes(pids_offset + 4 * slot_num - cls.HEADER_SIZE)
+        return cls(shm)
+
+    @classmethod
+    def attach(cls, name: str) -> "ShmRingBuffer":
+        return cls(EnhanceSharedMemory(name=name))
+
+    @classmethod
+    def unlink_by_name(cls, name: str):
+        """删除其他进程创建的缓冲区(如已被杀死的生产进程)"""
+        try:
+            shm = EnhanceSharedMemory(name=name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def head(self):
+        return struct.unpack_from("Q", self._shm.buf, 16)[0]
+
+    @head.setter
+    def head(self, value: int):
+        struct.pack_into("Q", self._shm.buf, 16, value)
+
+    def busy_num(self):
+        states = self._shm.buf[self._states_offset:
+                               self._states_offset + self.slot_num]
+        return self.slot_num - bytes(states).count(self.SLOT_FREE)
+
+    def is_idle(self):
+        return self.busy_num() == 0
+
+    def acquire_slot(self) -> Optional[int]:
+        """
+            从 head 开始寻找空闲槽位, 找到则标记为占用并返回槽位下标,
+            没有空闲槽位返回 None (只能在生产进程的单个线程中调用)
+        """
+        buf = self._shm.buf
+        head = self.head
+        for i in range(self.slot_num):
+            slot = (head + i) % self.slot_num
+            if buf[self._states_offset + slot] == self.SLOT_FREE:
+                buf[self._states_offset + slot] = self.SLOT_BUSY
+                self.set_holder(slot, 0)
+                self.head = (slot + 1) % self.slot_num
+                return slot
+        if self.reclaim_slots():
+            return self.acquire_slot()
+        return None
+
+    def release_slot(self, slot: int):
+        self.set_holder(slot, 0)
+        self._shm.buf[self._states_offset + slot] = self.SLOT_FREE
+
+    def holder(self, slot: int) -> int:
+        return struct.unpack_from("I", self._shm.buf,
+                                  self._pids_offset + 4 * slot)[0]
+
+    def set_holder(self, slot: int, pid: int):
+        """消费进程读取槽位时记录自己的 pid"""
+        struct.pack_into("I", self._shm.buf, self._pids_offset + 4 * slot,
+                         pid)
+
+    def reclaim_slots(self) -> int:
+        """
+            回收持有者已退出的槽位(消费进程被杀死时没有释放),
+            每 RECLAIM_INTERVAL_SECS 最多检查一次, 只能在生产进程中调用
+        :return: 回收的槽位数
+        """
+        now = time.monotonic()
+        if now - self._last_reclaim_time < self.RECLAIM_INTERVAL_SECS:
+            return 0
+        self._last_reclaim_time = now
+        reclaimed_num = 0
+        for slot in range(self.slot_num):
+            if self._shm.buf[self._states_offset + slot] == self.SLOT_FREE:
+                continue
+            pid = self.holder(slot)
+            if pid and not ProcessController.is_process_alive(pid):
+                self.release_slot(slot)
+                reclaimed_num += 1
+        return reclaimed_num
+
+    def _slot_start(self, slot: int):
+        return self._slots_offset + slot * self.slot_size
+
+    def write(self, slot: int, mem_views: List[memoryview],
+              lengths: List[int]) -> List[Tuple[int, int]]:
+        """
+            将多个 memoryview 依次写入槽位, 返回每个 memoryview 在槽位中的范围
+        """
+        buf = self._shm.buf
+        slot_start = self._slot_start(slot)
+        ranges = []
+        write_offset = 0
+        for mem_view, length in zip(mem_views, lengths):
+            write_end = write_offset + length
+            buf[slot_start + write_offset: slot_start + write_end] = mem_view
+            ranges.append((write_offset, write_end))
+            write_offset = write_end
+        return ranges
+
+    def slot_views(self, slot: int,
+                   ranges: List[Tuple[int, int]]) -> List[memoryview]:
+        """零拷贝读取槽位数据"""
+        slot_start = self._slot_start(slot)
+        return [self._shm.buf[slot_start + start: slot_start + end]
+                for start, end in ranges]
+
+    def close(self):
+        self._shm.close()
+
+    def unlink(self):
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
@@ -1,12 +1,30 @@
 import logging
-from typing import Any
+import traceback
+from typing import Any, Optional, Iterator
+from collections import deque
 
 import av
 import multiprocessing as mp
 import cv2
+from av.video.reformatter import VideoReformatter
 
 
 class RTSPCapture(object):
+    """
+        PyAV 读取网络摄像头
+
+        - 多线程解码(帧级 + 片级)
+        - read 指定 width/height 时，缩放与 BGR 转换在一次 libswscale 中完成，
+          不再先转出原始分辨率的 BGR 帧再 cv2.resize，4K 摄像头收益最大
+        - swscale 上下文在各帧间复用
+        - grab 跳帧: 不做格式转换；skip_decode 时连解码也跳过，
+          之后的 read 从下一个关键帧开始解码(被跳过的帧是后续帧的参考帧)
+    """
+    # 解码线程类型: AUTO(帧级 + 片级) / FRAME / SLICE / NONE
+    DECODE_THREAD_TYPE = "AUTO"
+    # 缩放插值，与原 cv2.resize 默认的双线性相当
+    SCALE_INTERPOLATION = "FAST_BILINEAR"
+
     def __init__(self, rtsp_path: str):
         self.__rtsp_path = rtsp_path
 
@@ -20,6 +38,19 @@ class RTSPCapture(object):
                                   metadata_errors="nostrict")
 
         self.stream = self._container.streams.video[0]
+        # 0 表示由 ffmpeg 按 CPU 核数决定
+        self.stream.codec_context.thread_count = 0
+        self.stream.codec_context.thread_type = self.DECODE_THREAD_TYPE
+        # demux 生成器跨 read 复用，同一个 packet 解出的多帧缓存在 _pending 中
+        self._packets: Optional[Iterator[av.Packet]] = None
+        self._pending: deque = deque()
+        # grab 跳过了未解码的 packet，需要等到下一个关键帧才能重新解码
+        self._wait_keyframe = False
+        # 实测的关键帧间隔(秒)，跳过解码时实际帧率不高于关键帧频率
+        self.keyframe_interval: Optional[float] = None
+        self.keyframe_interval_warned = False
+        self._last_keyframe_time: Optional[float] = None
+        self._reformatter = VideoReformatter()
 
         self._is_opened = mp.Value("d", 0)
         if self.stream.average_rate is not None:
@@ -61,54 +92,92 @@ class RTSPCapture(object):
 
         return 0
 
-    def read(self, width: int = None, height: int = None) -> (bool, Any):
-        # noinspection PyBroadException
-        # try:
-        #     av_frame = next(self._container.decode(self.stream))
-        #     cv_frame = av_frame.to_ndarray(
-        #         format='bgr24', interpolation=0x4, width=width,
-        #         height=height)  # BICUBIC
-        #     if self._video_height.value != cv_frame.shape[0]:
-        #         self._video_height.value = cv_frame.shape[0]
-        #
-        #     if self._video_width.value != cv_frame.shape[1]:
-        #         self._video_width.value = cv_frame.shape[1]
-        #     return True, cv_frame
-        # except Exception as exp:
-        #     return False, None
+    def _next_packet(self) -> av.Packet:
+        if self._packets is None:
+            self._packets = self._container.demux(self.stream)
+        packet = next(self._packets)
+        if packet.is_keyframe and packet.pts is not None:
+            keyframe_time = float(packet.pts * packet.time_base)
+            if (self._last_keyframe_time is not None
+                    and keyframe_time > self._last_keyframe_time):
+                self.keyframe_interval = (keyframe_time
+                                          - self._last_keyframe_time)
+            self._last_keyframe_time = keyframe_time
+        return packet
+
+    def _decode_keyframe(self) -> Optional[av.VideoFrame]:
+        """跳过非关键帧，只解码下一个关键帧"""
+        codec_ctx = self.stream.codec_context
+        while True:
+            packet = self._next_packet()
+            if packet.is_keyframe:
+                break
+        frames = codec_ctx.decode(packet)
+        if not frames:
+            # 多线程解码有延迟，清空解码器取出该帧，再重置解码器状态
+            frames = codec_ctx.decode(None)
+            codec_ctx.flush_buffers()
+        self._wait_keyframe = False
+        return frames[-1] if frames else None
+
+    def _decode_next(self) -> av.VideoFrame:
+        while not self._pending:
+            if self._wait_keyframe:
+                av_frame = self._decode_keyframe()
+                if av_frame is not None:
+                    return av_frame
+                continue
+            self._pending.extend(self._next_packet().decode())
+        return self._pending.popleft()
+
+    def grab(self, skip_decode=False) -> bool:
+        """
+            跳过一帧
+        :param skip_decode: 只读取 packet 不解码，适合大比例降帧(如休息帧率)；
+                            之后的 read 要等到下一个关键帧，实际帧率不高于关键帧频率
+        :return: 是否读取成功
+        """
         try:
-            # for packet in self._container.demux((self.stream,)):
-            #
-            #     for frame in packet.decode():
-            #         if packet.stream.type == "video":
-            #             cv_frame = frame.to_ndarray(format='bgr24')
-            #             if self._video_height.value != cv_frame.shape[0]:
-            #                 self._video_height.value = cv_frame.shape[0]
-            #
-            #             if self._video_width.value != cv_frame.shape[1]:
-            #                 self._video_width.value = cv_frame.shape[1]
-            #
-            #             return True, cv_frame
-            #         else:
-            #             print(packet.stream.type)
-
-            for packet in self._container.demux(video=0):
-                if packet.stream.type == "video":
-                    for frame in packet.decode():
-                        cv_frame = frame.to_ndarray(format='bgr24')
-                        if self._video_height.value != cv_frame.shape[0]:
-                            self._video_height.value = cv_frame.shape[0]
-
-                        if self._video_width.value != cv_frame.shape[1]:
-                            self._video_width.value = cv_frame.shape[1]
-                        return True, cv_frame
-                else:
-                    print(packet.stream.type)
+            if skip_decode:
+                self._pending.clear()
+                self._next_packet()
+                self._wait_keyframe = True
+            else:
+                self._decode_next()
+            return True
+        except Exception as exp:
+            logging.error(f"[RTSPCapture] grab failed: {exp!r}, "
+                          f"{traceback.format_exc()}")
+            self._packets = None
+            return False
 
+    def read(self, width: int = None, height: int = None) -> (bool, Any):
+        """
+        :param width: 输出宽度，与 height 同时指定时才缩放
+        :param height: 输出高度
+        :return: (是否读取成功, BGR 帧)
+        """
+        try:
+            av_frame = self._decode_next()
         except Exception as exp:
+            logging.error(f"[RTSPCapture] read failed: {exp!r}, "
+                          f"{traceback.format_exc()}")
+            self._packets = None
             return False, None
 
-        return False, None
+        # 记录的是源分辨率，与 cv2.VideoCapture 的 CAP_PROP_FRAME_* 含义一致
+        if self._video_height.value != av_frame.height:
+            self._video_height.value = av_frame.height
+        if self._video_width.value != av_frame.width:
+            self._video_width.value = av_frame.width
+
+        if not (width and height) or (width, height) == (av_frame.width,
+                                                         av_frame.height):
+            width, height = None, None
+        cv_frame = self._reformatter.reformat(
+            av_frame, width=width, height=height, format="bgr24",
+            interpolation=self.SCALE_INTERPOLATION).to_ndarray()
+        return True, cv_frame
 
     def release(self):
         if hasattr(self, "_container"):
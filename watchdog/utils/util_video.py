@@ -1,6 +1,18 @@
 import os
+import time
+from typing import *
+from fractions import Fraction
+from collections import deque
+
 import av
+import cv2
+import numpy as np
+from av.video.frame import PictureType
+
+from watchdog.configs.constants import VideoEncodeStage, RecordConfig
 from watchdog.utils.util_log import time_cost_log
+from watchdog.utils.util_latency import StageLatencyStats
+from watchdog.utils.util_time import get_bj_time_str
 
 
 @time_cost_log
@@ -10,11 +22,22 @@ def to_h264_video(source_video_path, output_video_path):
 
 
 class H264Writer(object):
-    def __init__(self, path, fps, bit_rate=1000000):
-        self.container = av.open(path, "w", "mp4")
+    def __init__(self, path, fps, bit_rate=1000000, faststart=True,
+                 encoder_options: Optional["H264EncoderOptions"] = None):
+        """
+        :param faststart: 开启时将 moov 移到文件头，浏览器无需下载完整文件即可拖动播放
+        :param encoder_options: 为空时使用 libx264 默认参数与 bit_rate
+        """
+        options = {"movflags": "+faststart"} if faststart else {}
+        self.container = av.open(path, "w", "mp4", options=options)
         self.stream = self.container.add_stream('h264', rate=round(fps))
         self.stream.pix_fmt = 'yuv420p'
         self.stream.bit_rate = bit_rate
+        if encoder_options is not None:
+            encoder_options.apply(self.stream.codec_context)
+            self.stream.codec_context.gop_size = max(
+                int(round(fps) * encoder_options.gop_secs), 1)
+        self.converter = YUVFrameConverter()
         self.is_open = True
         self.frame_num = 0
 
@@ -23,10 +46,11 @@ class H264Writer(object):
 
     def write(self, frame):
         # frame: [H, W, C]
-        self.stream.width = frame.shape[1]
-        self.stream.height = frame.shape[0]
-        frame = av.VideoFrame.from_ndarray(frame, format='bgr24')
-        self.container.mux(self.stream.encode(frame))
+        if not self.frame_num:
+            # 编码器打开后不能再修改尺寸
+            self.stream.width = frame.shape[1]
+            self.stream.height = frame.shape[0]
+        self.container.mux(self.stream.encode(self.converter.convert(frame)))
         self.frame_num += 1
 
     def release(self):
@@ -35,6 +59,483 @@ class H264Writer(object):
         self.is_open = False
 
 
+class H264EncoderOptions(object):
+    """
+        libx264 编码参数
+            preset/tune: 如 ultrafast/veryfast, zerolatency，tune 为空时不设置
+            threads: 编码线程数，0 为由 x264 自行决定
+            gop_secs: 关键帧间隔(秒)
+            crf: > 0 时为恒定质量模式(0~51，越小质量越高)，否则按 bit_rate 码率编码
+    """
+
+    def __init__(self, preset="veryfast", tune="zerolatency", threads=0,
+                 gop_secs=1.0, crf=0, bit_rate=1024 * 500):
+        self.preset = preset
+        self.tune = tune
+        self.threads = threads
+        self.gop_secs = gop_secs
+        self.crf = crf
+        self.bit_rate = bit_rate
+
+    @classmethod
+    def from_record_config(cls) -> "H264EncoderOptions":
+        return cls(preset=RecordConfig.ENCODER_PRESET,
+                   tune=RecordConfig.ENCODER_TUNE,
+                   threads=RecordConfig.ENCODER_THREADS,
+                   gop_secs=RecordConfig.GOP_SECS, crf=RecordConfig.CRF,
+                   bit_rate=RecordConfig.BIT_RATE)
+
+    def codec_options(self) -> Dict[str, str]:
+        options = {"preset": self.preset}
+        if self.tune:
+            options["tune"] = self.tune
+        if self.crf > 0:
+            options["crf"] = str(self.crf)
+        return options
+
+    def apply(self, codec_ctx: av.CodecContext):
+        """在编码器打开前调用"""
+        codec_ctx.options = self.codec_options()
+        codec_ctx.thread_count = self.threads
+        if self.crf <= 0:
+            codec_ctx.bit_rate = self.bit_rate
+
+    def to_dict(self) -> Dict:
+        return dict(preset=self.preset, tune=self.tune, threads=self.threads,
+                    gop_secs=self.gop_secs, crf=self.crf,
+                    bit_rate=self.bit_rate)
+
+
+class YUVFrameConverter(object):
+    """
+        BGR 转 yuv420p: cv2 直接写入复用的缓冲区，缓冲区只在尺寸变化时重新分配，
+        并一次性包装为 VideoFrame(不拷贝)，每帧不再新建帧、也不再由编码器内部转换；
+        x264 会拷贝输入画面，复用同一帧是安全的
+    """
+
+    def __init__(self):
+        self._buffer: Optional[np.ndarray] = None
+        self._frame: Optional[av.VideoFrame] = None
+
+    def convert(self, frame: np.ndarray) -> av.VideoFrame:
+        height, width = frame.shape[:2]
+        if width % 2 or height % 2:
+            # yuv420p 要求偶数尺寸，交给编码器转换
+            return av.VideoFrame.from_ndarray(frame, format="bgr24")
+        if self._buffer is None or self._buffer.shape != (height * 3 // 2,
+                                                           width):
+            self._buffer = np.empty((height * 3 // 2, width), dtype=np.uint8)
+            self._frame = av.VideoFrame.from_numpy_buffer(self._buffer,
+                                                          format="yuv420p")
+        cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=self._buffer)
+        self._frame.pict_type = PictureType.NONE
+        return self._frame
+
+
+class H264StreamEncoder(object):
+    """
+        长期存在的 H264 编码器，跨多个录像文件复用，输出可直接封装的 packet
+
+        默认使用 zerolatency，每帧立即输出一个 packet(无 B 帧)，
+        pts 取帧的采集时间，帧率变化(休息/活跃)不影响播放速度；
+        按时间(gop_secs)而不是帧数插入关键帧，低帧率时预录也能按秒对齐
+    """
+    TIME_BASE = Fraction(1, 90000)
+
+    def __init__(self, fps=25, options: Optional[H264EncoderOptions] = None,
+                 cost_stats: Optional[StageLatencyStats] = None):
+        """
+        :param fps:
+        :param options: 编码参数
+        :param cost_stats: 每帧格式转换与编码耗时，按 VideoEncodeStage 统计
+        """
+        self.fps = round(fps) or 25
+        self.options = options if options is not None \
+            else H264EncoderOptions()
+        self.gop_secs = self.options.gop_secs
+        self.cost_stats = cost_stats
+        self.codec_ctx: Optional[av.CodecContext] = None
+        self.converter = YUVFrameConverter()
+        self.frame_size: Optional[Tuple[int, int]] = None
+        self._start_time: Optional[float] = None
+        self._last_pts = -1
+        self._last_key_time: Optional[float] = None
+
+        self.frame_num = 0
+        self.convert_ms = 0.0
+        self.encode_ms = 0.0
+
+    def _open(self, width, height):
+        ctx = av.CodecContext.create("libx264", "w")
+        ctx.width = width
+        ctx.height = height
+        ctx.pix_fmt = "yuv420p"
+        ctx.time_base = self.TIME_BASE
+        ctx.framerate = Fraction(self.fps, 1)
+        # 关键帧由 encode 按时间强制插入，这里只作为上限
+        ctx.gop_size = max(int(self.fps * self.gop_secs), 1) * 10
+        self.options.apply(ctx)
+        ctx.open()
+        self.codec_ctx = ctx
+        self.frame_size = (width, height)
+
+    @property
+    def is_opened(self):
+        return self.codec_ctx is not None
+
+    def encode(self, frame: np.ndarray, frame_time: float,
+               force_keyframe=False) -> List[av.Packet]:
+        """
+        :param frame: BGR [H, W, C]
+        :param frame_time: 采集时间(秒)
+        :param force_keyframe: 强制输出关键帧，新文件的第一帧需要
+        :return:
+        """
+        height, width = frame.shape[:2]
+        if self.frame_size != (width, height):
+            # 分辨率变化，重新打开编码器，新编码器第一帧必为关键帧
+            self._open(width, height)
+            force_keyframe = True
+        if (self._last_key_time is None
+                or frame_time - self._last_key_time >= self.gop_secs):
+            force_keyframe = True
+        if force_keyframe:
+            self._last_key_time = frame_time
+        if self._start_time is None:
+            self._start_time = frame_time
+        pts = int((frame_time - self._start_time) / self.TIME_BASE)
+        # 保证 pts 单调递增
+        pts = max(pts, self._last_pts + 1)
+        self._last_pts = pts
+
+        start = time.perf_counter()
+        video_frame = self.converter.convert(frame)
+        video_frame.pts = pts
+        video_frame.time_base = self.TIME_BASE
+        if force_keyframe:
+            video_frame.pict_type = PictureType.I
+        converted = time.perf_counter()
+        packets = list(self.codec_ctx.encode(video_frame))
+        self._observe((converted - start) * 1000,
+                      (time.perf_counter() - converted) * 1000)
+        return packets
+
+    def _observe(self, convert_ms, encode_ms):
+        self.frame_num += 1
+        self.convert_ms += convert_ms
+        self.encode_ms += encode_ms
+        if self.cost_stats is not None:
+            self.cost_stats.observe(VideoEncodeStage.CONVERT, convert_ms)
+            self.cost_stats.observe(VideoEncodeStage.H264, encode_ms)
+
+    def stats(self) -> Dict:
+        return {
+            "frame_num": self.frame_num,
+            "avg_convert_ms": (round(self.convert_ms / self.frame_num, 3)
+                               if self.frame_num else 0),
+            "avg_encode_ms": (round(self.encode_ms / self.frame_num, 3)
+                              if self.frame_num else 0),
+        }
+
+    def packet_time(self, packet: av.Packet) -> float:
+        """packet 对应的采集时间(秒)，需在封装改写 pts 之前调用"""
+        return self._start_time + float(packet.pts * self.TIME_BASE)
+
+    def close(self):
+        self.codec_ctx = None
+        self.frame_size = None
+
+
+class PacketPreRoll(object):
+    """
+        预录缓冲：保存最近一段时间已编码的 packet，
+        总是从关键帧开始，按 GOP 整组淘汰，时长与内存均有上限
+    """
+
+    def __init__(self, max_secs=5.0, max_bytes=32 * 1024 * 1024):
+        self.max_secs = max_secs
+        self.max_bytes = max_bytes
+        # 每个元素是一个 GOP: [packet, ...]
+        self._gops: Deque[List[av.Packet]] = deque()
+        self.bytes = 0
+
+    @property
+    def packet_num(self):
+        return sum(len(gop) for gop in self._gops)
+
+    @property
+    def secs(self) -> float:
+        if not self._gops:
+            return 0
+        first, last = self._gops[0][0], self._gops[-1][-1]
+        return float((last.pts - first.pts) * first.time_base)
+
+    def push(self, packets: List[av.Packet]):
+        if self.max_secs <= 0:
+            return
+        for packet in packets:
+            if packet.is_keyframe:
+                self._gops.append([])
+            elif not self._gops:
+                # 还没有关键帧，无法独立解码，丢弃
+                continue
+            self._gops[-1].append(packet)
+            self.bytes += packet.size
+
+        # 至少保留最新的一个 GOP
+        while len(self._gops) > 1 and (self.secs > self.max_secs
+                                       or self.bytes > self.max_bytes):
+            self.bytes -= sum(p.size for p in self._gops.popleft())
+
+    def drain(self) -> List[av.Packet]:
+        packets = [packet for gop in self._gops for packet in gop]
+        self.clear()
+        return packets
+
+    def clear(self):
+        self._gops.clear()
+        self.bytes = 0
+
+
+class H264PacketMuxer(object):
+    """将 H264StreamEncoder 输出的 packet 封装为 mp4，pts 从 0 开始"""
+
+    def __init__(self, path, encoder: H264StreamEncoder, faststart=True):
+        options = {"movflags": "+faststart"} if faststart else {}
+        self.container = av.open(path, "w", "mp4", options=options)
+        self.encoder = encoder
+        self.stream = None
+        self._base_pts = None
+        self._last_pts = 0
+        self.is_open = True
+        self.packet_num = 0
+        # 第一个/最后一个 packet 的采集时间
+        self.start_time: Optional[float] = None
+        self.end_time: Optional[float] = None
+
+    def isOpened(self):
+        return self.is_open
+
+    @property
+    def duration(self) -> float:
+        """已封装的时长(秒)"""
+        return float(self._last_pts * self.encoder.TIME_BASE)
+
+    def _ensure_stream(self):
+        if self.stream is not None:
+            return
+        codec_ctx = self.encoder.codec_ctx
+        self.stream = self.container.add_stream("h264", rate=self.encoder.fps)
+        self.stream.width = codec_ctx.width
+        self.stream.height = codec_ctx.height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.time_base = codec_ctx.time_base
+        if codec_ctx.extradata:
+            self.stream.codec_context.extradata = codec_ctx.extradata
+
+    def mux(self, packets: List[av.Packet]):
+        for packet in packets:
+            if self._base_pts is None:
+                if not packet.is_keyframe:
+                    # 文件必须从关键帧开始
+                    continue
+                self._ensure_stream()
+                self._base_pts = packet.pts
+                self.start_time = self.encoder.packet_time(packet)
+            self.end_time = self.encoder.packet_time(packet)
+            packet.pts -= self._base_pts
+            packet.dts -= self._base_pts
+            packet.stream = self.stream
+            self.container.mux(packet)
+            self._last_pts = packet.pts
+            self.packet_num += 1
+
+    def release(self):
+        self.container.close()
+        self.is_open = False
+
+
+class VideoSegment(object):
+    """连续录像中已关闭的一个分段"""
+
+    def __init__(self, path, start_time, end_time, wall_start_time):
+        self.path = path
+        self.filename = os.path.basename(path)
+        # 采集时间(秒)，与 FrameBox.frame_ctime 同一时钟
+        self.start_time = start_time
+        self.end_time = end_time
+        # 北京时间字符串，用于索引与过期清理
+        self.wall_start_time = wall_start_time
+
+    @property
+    def duration(self) -> float:
+        return self.end_time - self.start_time
+
+
+class SegmentWriter(object):
+    """
+        连续分段录像：单个长期编码器的输出按固定时长切分为多个 mp4 分段
+
+        只在关键帧处切换分段，每个分段都能独立播放；
+        事件录像不再单独编码，而是由 remux_segments 从分段中剪出
+    """
+    # 内存中保留的分段索引时长，只用于剪辑，文件清理由调用方负责
+    INDEX_SECS = 6 * 3600
+
+    def __init__(self, dir_path, encoder: H264StreamEncoder, segment_secs=60,
+                 on_segment_closed: Optional[Callable] = None):
+        self.dir_path = dir_path
+        self.encoder = encoder
+        self.segment_secs = segment_secs
+        self.on_segment_closed = on_segment_closed
+        self.muxer: Optional[H264PacketMuxer] = None
+        self._muxer_path = ""
+        self._muxer_wall_start_time = ""
+        self.segments: Deque[VideoSegment] = deque()
+
+    def _open_muxer(self):
+        self._muxer_wall_start_time = get_bj_time_str()
+        self._muxer_path = os.path.join(
+            self.dir_path, f"{self._muxer_wall_start_time}-segment.mp4")
+        self.muxer = H264PacketMuxer(self._muxer_path, encoder=self.encoder)
+
+    def write(self, frame: np.ndarray, frame_time: float):
+        # 新分段的第一帧必须是关键帧
+        packets = self.encoder.encode(frame, frame_time,
+                                      force_keyframe=self.muxer is None)
+        for packet in packets:
+            if (packet.is_keyframe and self.muxer is not None
+                    and self.encoder.packet_time(packet)
+                    - self.muxer.start_time >= self.segment_secs):
+                self.rotate()
+            if self.muxer is None:
+                self._open_muxer()
+            self.muxer.mux([packet])
+
+    def rotate(self) -> Optional[VideoSegment]:
+        """关闭当前分段，下一帧开始新的分段"""
+        if self.muxer is None:
+            return None
+        muxer, self.muxer = self.muxer, None
+        muxer.release()
+        if muxer.start_time is None:
+            # 没有写入任何 packet
+            if os.path.exists(self._muxer_path):
+                os.remove(self._muxer_path)
+            return None
+
+        segment = VideoSegment(self._muxer_path, muxer.start_time,
+                               muxer.end_time, self._muxer_wall_start_time)
+        self.segments.append(segment)
+        while (self.segments
+               and segment.end_time - self.segments[0].end_time
+               > self.INDEX_SECS):
+            self.segments.popleft()
+        if self.on_segment_closed is not None:
+            self.on_segment_closed(segment)
+        return segment
+
+    def segments_between(self, start_time, end_time) -> List[VideoSegment]:
+        return [s for s in self.segments
+                if s.end_time >= start_time and s.start_time <= end_time]
+
+    def close(self):
+        self.rotate()
+
+
+class SegmentClipWriter(object):
+    """
+        连续录像模式下的事件录像：帧只写入分段，
+        release 时关闭当前分段，再从分段中剪出 [start_time, 最后一帧]
+    """
+
+    def __init__(self, path, segment_writer: SegmentWriter, start_time):
+        self.path = path
+        self.segment_writer = segment_writer
+        self.start_time = start_time
+        self.end_time = start_time
+        self.duration = 0
+        # 剪出的片段第一帧的采集时间(对齐到关键帧)，release 后才确定
+        self.video_start_time: Optional[float] = None
+        self.is_open = True
+
+    def isOpened(self):
+        return self.is_open
+
+    def write(self, frame: np.ndarray, frame_time: float):
+        self.segment_writer.write(frame, frame_time)
+        self.end_time = frame_time
+
+    def release(self):
+        self.segment_writer.rotate()
+        segments = self.segment_writer.segments_between(self.start_time,
+                                                        self.end_time)
+        clip_range = remux_segments(segments, self.start_time, self.end_time,
+                                    self.path)
+        if clip_range is not None:
+            self.video_start_time = clip_range[0]
+            self.duration = clip_range[1] - clip_range[0]
+        self.is_open = False
+
+
+def remux_segments(segments: List[VideoSegment], start_time, end_time, path,
+                   faststart=True) -> Optional[Tuple[float, float]]:
+    """
+        从分段中剪出 [start_time, end_time] 的片段，只重新封装 packet，不解码
+        起点向前对齐到最近的关键帧
+    :return: 片段第一帧与最后一帧的采集时间，没有可用画面时为 None 且不生成文件
+    """
+    options = {"movflags": "+faststart"} if faststart else {}
+    output = None
+    out_stream = None
+    base_time = None
+    last_time = None
+    last_pts = -1
+    # 起点之前最近一个 GOP 的 packet: [(采集时间, packet), ...]
+    gop: List[Tuple[float, av.Packet]] = []
+    try:
+        for segment in segments:
+            with av.open(segment.path) as source:
+                in_stream = source.streams.video[0]
+                for packet in source.demux(in_stream):
+                    if packet.dts is None:
+                        # 结束标记
+                        continue
+                    packet_time = segment.start_time + float(
+                        packet.pts * packet.time_base)
+                    if packet_time > end_time:
+                        break
+                    if base_time is None:
+                        if packet.is_keyframe:
+                            gop = []
+                        if packet.is_keyframe or gop:
+                            gop.append((packet_time, packet))
+                        if packet_time < start_time or not gop:
+                            continue
+                        output = av.open(path, "w", "mp4", options=options)
+                        out_stream = output.add_stream_from_template(
+                            in_stream)
+                        base_time = gop[0][0]
+                        pending, gop = gop, []
+                    else:
+                        pending = [(packet_time, packet)]
+
+                    for p_time, p in pending:
+                        # 无 B 帧，dts 与 pts 一致
+                        pts = max(int((p_time - base_time) / p.time_base),
+                                  last_pts + 1)
+                        p.pts = p.dts = last_pts = pts
+                        p.stream = out_stream
+                        output.mux(p)
+                        last_time = p_time
+    finally:
+        if output is not None:
+            output.close()
+    if base_time is None:
+        return None
+    return base_time, last_time
+
+
 if __name__ == "__main__":
     import cv2
     from tqdm import tqdm
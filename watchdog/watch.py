@@ -6,8 +6,9 @@ parser = argparse.ArgumentParser()
 
 parser.add_argument(
     "address", help="Camera address, like '/dev/video0' or "
-                    "'rtsp://[username]:[password]@[ip]'",
-    default="/dev/video0", type=str)
+                    "'rtsp://[username]:[password]@[ip]', ignored when "
+                    "-cameras-config is set",
+    nargs="?", default="/dev/video0", type=str)
 
 parser.version = str(__version__)
 parser.add_argument('-V', action='version', help='print the version and exit')
@@ -44,6 +45,21 @@ parser.add_argument(
     type=int
 )
 
+parser.add_argument(
+    "-adaptive-fps",
+    help="adjust the active fps between -adaptive-min-fps and -active-fps "
+         "by the measured detector latency and backlog",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-adaptive-min-fps",
+    help="lower bound of the active fps when -adaptive-fps is set, "
+         "default: 2",
+    default=2,
+    type=int
+)
+
 parser.add_argument(
     "-car-alart-secs",
     help="car detected alart time",
@@ -65,13 +81,222 @@ parser.add_argument(
     type=int
 )
 
+parser.add_argument(
+    "-frame-bus",
+    help="publish camera frames once to a shared memory bus that every "
+         "consumer subscribes to, instead of copying them through the "
+         "frame distributor",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-detect-batch-size",
+    help="max frames per detector forward pass, 1 means frame by frame, "
+         "default: 1",
+    default=1,
+    type=int
+)
+
+parser.add_argument(
+    "-detect-batch-wait-ms",
+    help="max milliseconds to wait for filling a detect batch, default: 20",
+    default=20,
+    type=int
+)
+
+parser.add_argument(
+    "-detect-workers",
+    help="number of detector processes sharing the frame feed, default is "
+         "os.cpu_count() // 4 (at least 1)",
+    default=max(1, os.cpu_count() // 4),
+    type=int
+)
+
+parser.add_argument(
+    "-detect-max-age-ms",
+    help="max milliseconds a frame may wait for detection, as "
+         "'active,viewed,rest' for cameras with a detected target, being "
+         "viewed and at rest, older frames are dropped instead of detected "
+         "late, 0 never drops, default: 1000,2000,5000",
+    default="1000,2000,5000",
+    type=str
+)
+
+parser.add_argument(
+    "-motion-gate",
+    help="skip detection on frames without motion, reusing the last "
+         "detect result",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-motion-roi",
+    help="motion check area 'x,y,w,h', default is the camera center box",
+    default="",
+    type=str
+)
+
+parser.add_argument(
+    "-roi-inference",
+    help="only run detection on the sensor target area (plus margin) "
+         "instead of the whole frame",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-roi-margin",
+    help="margin ratio added around the roi when -roi-inference is set, "
+         "default: 0.2",
+    default=0.2,
+    type=float
+)
+
+parser.add_argument(
+    "-detect-engine",
+    help="inference engine, 'auto' benchmarks the available engines at "
+         "startup and picks the fastest, default: auto",
+    default="auto",
+    choices=["auto", "opencv", "opencv-cuda", "onnxruntime", "stub"],
+    type=str
+)
+
+parser.add_argument(
+    "-ort-intra-threads",
+    help="onnxruntime intra-op threads, 0 means decided by onnxruntime",
+    default=0,
+    type=int
+)
+
+parser.add_argument(
+    "-ort-inter-threads",
+    help="onnxruntime inter-op threads, 0 means decided by onnxruntime",
+    default=0,
+    type=int
+)
+
+parser.add_argument(
+    "-debug-delay-text",
+    help="burn the per-stage delay text into frames (debug only), "
+         "latency stats are always available at /debug/latency",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-pre-roll-secs",
+    help="seconds of video before the trigger kept in memory and written "
+         "to the start of each recording, 0 to disable, default: 5",
+    default=5,
+    type=float
+)
+
+parser.add_argument(
+    "-pre-roll-max-mb",
+    help="memory cap of the pre-roll buffer in MB, default: 32",
+    default=32,
+    type=int
+)
+
+parser.add_argument(
+    "-continuous-record",
+    help="always encode into fixed-length segments, event recordings are "
+         "cut from the segments without re-encoding",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-segment-secs",
+    help="segment length in seconds of -continuous-record, default: 60",
+    default=60,
+    type=int
+)
+
+parser.add_argument(
+    "-segment-keep-hours",
+    help="hours to keep the segments of -continuous-record, default: 24",
+    default=24,
+    type=float
+)
+
+parser.add_argument(
+    "-record-raw",
+    help="record unmarked frames, detections are written to a "
+         ".detections.jsonl sidecar and drawn by the web player",
+    action="store_true"
+)
+
+parser.add_argument(
+    "-encoder-preset",
+    help="x264 preset of recordings, e.g. ultrafast, veryfast, medium, "
+         "default: veryfast",
+    default="veryfast",
+    type=str
+)
+
+parser.add_argument(
+    "-encoder-tune",
+    help="x264 tune of recordings, empty to disable, default: zerolatency",
+    default="zerolatency",
+    type=str
+)
+
+parser.add_argument(
+    "-encoder-threads",
+    help="x264 threads of recordings, 0 means decided by x264",
+    default=0,
+    type=int
+)
+
+parser.add_argument(
+    "-gop-secs",
+    help="keyframe interval in seconds of recordings, default: 1",
+    default=1.0,
+    type=float
+)
+
+parser.add_argument(
+    "-crf",
+    help="constant quality (0-51, lower is better) of recordings, "
+         "0 means bitrate mode with -bit-rate, default: 0",
+    default=0,
+    type=int
+)
+
+parser.add_argument(
+    "-bit-rate",
+    help="bitrate of recordings in bps when -crf is 0, default: 512000",
+    default=1024 * 500,
+    type=int
+)
+
+parser.add_argument(
+    "-cameras-config",
+    help="json file of multiple cameras, each camera is watched in its own "
+         "processes and all cameras share the -detect-workers detector pool, "
+         "view a camera by /stream/<name>",
+    default="",
+    type=str
+)
+
+parser.add_argument(
+    "-server",
+    help="http server, 'thread': flask on the threaded wsgi server, "
+         "'async': aiohttp event loop serving /stream, /check_records and "
+         "/check_video (pip install watchdog[async]), default: thread",
+    default="thread",
+    choices=["thread", "async"],
+    type=str
+)
+
 args = parser.parse_args()
 
 import logging
+from typing import *
 
 import setproctitle
 
-from watchdog.configs.constants import CameraConfig, PathConfig
+from watchdog.configs.constants import (CameraConfig, PathConfig,
+                                        DetectConfig, MotionConfig,
+                                        DebugConfig, RecordConfig)
 from watchdog.utils.util_log import set_scripts_logging
 
 from watchdog.server.monkey_patches import MonkeyPatches
@@ -81,7 +306,8 @@ from watchdog.server.api_handlers import *
 from watchdog.server.api_handlers.watch_handler import WatchCameraHandler
 from watchdog.server.custom_server import CustomFlask
 from watchdog.utils.util_router import load_routes_to_flask
-from watchdog.services.workshop import WorkShop
+from watchdog.services.workshop import WorkShop, MultiWorkShop
+from watchdog.services.camera_sources import load_camera_sources
 
 
 def main():
@@ -92,25 +318,91 @@ def main():
         PathConfig.CACHE_DATAS_PATH = args.cache_path
     CameraConfig.REST_FPS.value = args.rest_fps
     CameraConfig.ACTIVE_FPS.value = args.active_fps
+    CameraConfig.ADAPTIVE_FPS.value = int(args.adaptive_fps)
+    CameraConfig.ADAPTIVE_MIN_FPS.value = max(1, args.adaptive_min_fps)
     CameraConfig.CAR_ALART_SECS.value = args.car_alart_secs
     CameraConfig.CACHE_DAYS.value = args.cache_days
+    DetectConfig.BATCH_SIZE.value = max(1, args.detect_batch_size)
+    DetectConfig.BATCH_WAIT_MS.value = max(0, args.detect_batch_wait_ms)
+    DetectConfig.ENGINE = args.detect_engine
+    DetectConfig.ORT_INTRA_OP_THREADS = max(0, args.ort_intra_threads)
+    DetectConfig.ORT_INTER_OP_THREADS = max(0, args.ort_inter_threads)
+    DetectConfig.ROI_INFERENCE.value = int(args.roi_inference)
+    DetectConfig.ROI_MARGIN.value = max(0.0, args.roi_margin)
+    try:
+        max_age_ms = [max(0, int(v))
+                      for v in args.detect_max_age_ms.split(",")]
+    except ValueError:
+        max_age_ms = []
+    if len(max_age_ms) != len(DetectConfig.MAX_AGE_MS):
+        parser.error("-detect-max-age-ms needs 3 integers: active,viewed,rest")
+    DetectConfig.MAX_AGE_MS[:] = max_age_ms
+    MotionConfig.ENABLE.value = int(args.motion_gate)
+    if args.motion_roi:
+        try:
+            motion_roi = [int(v) for v in args.motion_roi.split(",")]
+        except ValueError:
+            motion_roi = []
+        if len(motion_roi) != len(MotionConfig.ROI):
+            parser.error("-motion-roi needs 4 integers: x,y,w,h")
+        MotionConfig.ROI[:] = motion_roi
+    DebugConfig.DELAY_TEXT.value = int(args.debug_delay_text)
+    RecordConfig.PRE_ROLL_SECS.value = max(0.0, args.pre_roll_secs)
+    RecordConfig.PRE_ROLL_MAX_MB.value = max(1, args.pre_roll_max_mb)
+    RecordConfig.CONTINUOUS.value = int(args.continuous_record)
+    RecordConfig.SEGMENT_SECS.value = max(1, args.segment_secs)
+    RecordConfig.SEGMENT_KEEP_HOURS.value = max(0.0, args.segment_keep_hours)
+    RecordConfig.RAW_FRAMES.value = int(args.record_raw)
+    RecordConfig.ENCODER_PRESET = args.encoder_preset
+    RecordConfig.ENCODER_TUNE = args.encoder_tune
+    RecordConfig.ENCODER_THREADS = max(0, args.encoder_threads)
+    RecordConfig.GOP_SECS = max(0.1, args.gop_secs)
+    RecordConfig.CRF = min(max(0, args.crf), 51)
+    RecordConfig.BIT_RATE = max(1, args.bit_rate)
     port = args.port
     set_scripts_logging(__file__)
 
+    if args.server == "async":
+        # 提前检查依赖，避免启动完所有工作进程后才报错
+        from watchdog.server.async_server import AsyncWatchServer, web
+        if web is None:
+            raise ImportError("aiohttp is required for '-server async', "
+                              "install it by: pip install watchdog[async]")
+
     app = CustomFlask(__name__, template_folder="templates",
                       static_folder="static")
     load_routes_to_flask(app)
-    ws = WorkShop(camera_address, video_width=args.width,
-                  video_height=args.height)
-    WatchCameraHandler.load_workshop(camera_address, ws)
+    work_shops: Dict[str, WorkShop] = {}
+    if args.cameras_config:
+        sources = load_camera_sources(args.cameras_config,
+                                      video_width=args.width,
+                                      video_height=args.height)
+        mws = MultiWorkShop(sources, use_frame_bus=args.frame_bus,
+                            detect_worker_num=max(1, args.detect_workers))
+        work_shops = mws.work_shops
+        for name, work_shop in work_shops.items():
+            WatchCameraHandler.load_workshop(name, work_shop)
+        ws = next(iter(work_shops.values()))
+        stream_urls = "\n".join(f"                http://0.0.0.0:{port}"
+                                 f"/stream/{name}" for name in work_shops)
+    else:
+        ws = WorkShop(camera_address, video_width=args.width,
+                      video_height=args.height, use_frame_bus=args.frame_bus,
+                      detect_worker_num=max(1, args.detect_workers))
+        WatchCameraHandler.load_workshop(camera_address, ws)
+        stream_urls = f"                http://0.0.0.0:{port}/stream"
 
     logging.info(f"""
     --------------------------------------------------------------------------
                 Start WatchDog, view stream:
-                http://0.0.0.0:{port}/stream
+{stream_urls}
     --------------------------------------------------------------------------
     """)
-    app.run(host="0.0.0.0", port=port)
+    if args.server == "async":
+        AsyncWatchServer(ws, work_shops=work_shops or None).run(
+            host="0.0.0.0", port=port)
+    else:
+        app.run(host="0.0.0.0", port=port)
 
 
 if __name__ == "__main__":